@@ -0,0 +1,698 @@
+# benchmark.py
+# Mediciones de rendimiento que no necesitan conectarse a Discord.
+# Uso: python benchmark.py <escenario> [opciones]
+import argparse
+import asyncio
+import contextlib
+import gc
+import hashlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import Counter
+from types import SimpleNamespace
+
+from utils import ledger, state, verify
+from utils.tracking import TrackedMessages
+
+# --- ESCENARIOS ---
+async def _burst(db_file: str, writer, moderators: int, approvals: int, allies: int):
+    """Simula `moderators` moderadores aprobando `approvals` envíos cada uno a la vez."""
+    async def moderator(mod_index: int):
+        for n in range(approvals):
+            message_id = mod_index * 1_000_000 + n
+            submission = {'allies': [str(1000 + a) for a in range(allies)]}
+            rows = ledger.submission_rows(1, message_id, submission, 50, 'ataque', 1)
+            if writer:
+                await writer.write(rows)
+            else:
+                ledger.insert_points(rows, db_file)
+            # Cede el control como lo haría el resto del manejador de la reacción.
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(moderator(i) for i in range(moderators)))
+    if writer:
+        await writer.close()
+    return time.perf_counter() - start
+
+def bench_group_commit(args):
+    """Compara un commit por aprobación contra el group commit de Puntos bajo una ráfaga."""
+    total_rows = args.moderators * args.approvals * args.allies
+    print(f"Ráfaga: {args.moderators} moderadores x {args.approvals} aprobaciones x {args.allies} aliados = {total_rows} filas")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('directo', 'group-commit'):
+            db_file = os.path.join(tmp, f'{mode}.db')
+            ledger.initialize_database(db_file)
+            writer = None
+            if mode == 'group-commit':
+                writer = ledger.GroupCommitWriter(db_file, args.delay_ms / 1000, args.max_rows)
+            elapsed = asyncio.run(_burst(db_file, writer, args.moderators, args.approvals, args.allies))
+            commits = writer.commits if writer else args.moderators * args.approvals
+            print(f"  {mode:>12}: {elapsed:7.3f} s | {commits / elapsed:9.1f} commits/s | {total_rows / elapsed:10.1f} filas/s | {commits} commits")
+
+def _serve_guilds(tmp: str, guilds: int, history: int, events: int, partitioned: bool):
+    """Procesa `events` envíos + aprobaciones por servidor y devuelve los eventos por segundo."""
+    state.DATA_DIR = os.path.join(tmp, f"{'part' if partitioned else 'shared'}-{guilds}")
+    db_file = os.path.join(state.DATA_DIR, 'leaderboard.db')
+    os.makedirs(state.DATA_DIR, exist_ok=True)
+    ledger.initialize_database(db_file)
+    pending = state.GuildState('pending_attacks.json')
+    judged = state.GuildState('judged_attacks.json')
+    # Sin particiones todos los servidores comparten un único archivo, como antes.
+    partition = (lambda guild_id: guild_id) if partitioned else (lambda guild_id: 0)
+    for guild_id in range(1, guilds + 1):
+        history_docs = judged.get(partition(guild_id))
+        for n in range(history):
+            history_docs[f"{guild_id}{n:08d}"] = {'points': 120, 'allies': ['1', '2', '3'], 'status': 'approved'}
+        judged.save(partition(guild_id))
+
+    start = time.perf_counter()
+    for n in range(events):
+        for guild_id in range(1, guilds + 1):
+            message_id = f"{guild_id}9{n:07d}"
+            pending.get(partition(guild_id))[message_id] = {'points': 120, 'allies': ['1', '2', '3']}
+            pending.save(partition(guild_id))
+            submission = pending.get(partition(guild_id)).pop(message_id)
+            ledger.insert_points(ledger.submission_rows(guild_id, message_id, submission, 120, 'ataque', 1), db_file)
+            submission['status'] = 'approved'
+            judged.get(partition(guild_id))[message_id] = submission
+            pending.save(partition(guild_id))
+            judged.save(partition(guild_id))
+    return events * guilds / (time.perf_counter() - start)
+
+def bench_guilds(args):
+    """Rendimiento de envío + aprobación según el número de servidores atendidos, con y sin particiones."""
+    print(f"Cada servidor: {args.history} envíos juzgados de historial, {args.events} envíos nuevos aprobados")
+    with tempfile.TemporaryDirectory() as tmp:
+        for guilds in args.guilds:
+            shared = _serve_guilds(tmp, guilds, args.history, args.events, partitioned=False)
+            part = _serve_guilds(tmp, guilds, args.history, args.events, partitioned=True)
+            print(f"  {guilds:>3} servidores: compartido {shared:8.1f} eventos/s | particionado {part:8.1f} eventos/s")
+
+def bench_reactions(args):
+    """
+    Coste de una reacción en un mensaje que no es un envío: antes cada uno de los cinco cogs
+    recibía su propia tarea y buscaba el mensaje en sus documentos (además de mirar los roles,
+    que aquí no se cuenta); ahora una sola tarea consulta el índice de mensajes seguidos.
+    """
+    kinds = ('ataque', 'defensa', 'tempo', 'interserver', 'koth')
+    with tempfile.TemporaryDirectory() as tmp:
+        state.DATA_DIR = tmp
+        sources = {kind: (state.GuildState(f'pending_{kind}.json'), state.GuildState(f'judged_{kind}.json')) for kind in kinds}
+        base = 1_000_000_000_000_000_000
+        for k, (pending, judged) in enumerate(sources.values()):
+            judged.get(1).update({str(base + k * 10_000_000 + n): {'status': 'approved'} for n in range(args.history)})
+            pending.get(1).update({str(base + k * 10_000_000 + args.history + n): {} for n in range(args.pending)})
+        tracked = TrackedMessages(lambda: sources)
+        start = time.perf_counter()
+        tracked.lookup(1, 0)
+        build = time.perf_counter() - start
+        untracked = [base + 900_000_000 + n for n in range(args.events)]
+
+        async def per_cog(message_id):
+            for pending, judged in (sources[kind] for kind in kinds):
+                if str(message_id) in pending.get(1) or str(message_id) in judged.get(1):
+                    return
+
+        async def per_cog_listeners(message_id):
+            await asyncio.gather(*(asyncio.create_task(per_cog(message_id)) for _ in kinds))
+
+        async def dispatcher(message_id):
+            await asyncio.create_task(asyncio.sleep(0, tracked.lookup(1, message_id)))
+
+        async def run(handler):
+            start = time.perf_counter()
+            for message_id in untracked:
+                await handler(message_id)
+            return (time.perf_counter() - start) / args.events
+
+        start = time.perf_counter()
+        for message_id in untracked:
+            tracked.lookup(1, message_id)
+        lookup = (time.perf_counter() - start) / args.events
+        before = asyncio.run(run(per_cog_listeners))
+        after = asyncio.run(run(dispatcher))
+        set_bytes = sum(entry[1].ids.itemsize * len(entry[1].ids) for entry in tracked._judged.values())
+        print(f"Historial: {args.history} juzgados y {args.pending} pendientes por tipo ({len(kinds)} tipos)")
+        print(f"  un listener por cog: {before * 1e6:7.2f} µs/reacción | despachador con índice: {after * 1e6:7.2f} µs/reacción")
+        print(f"  índice: {lookup * 1e6:.2f} µs por consulta, {build * 1000:.1f} ms para construirlo, {set_bytes / 1024:.1f} KiB de IDs juzgados")
+
+def _judged_workload(store, history: int, lookups: int, recent: int, rng, save: bool) -> float:
+    """Reacciones sobre juzgados: casi todas sobre los `recent` más nuevos, algunas sobre el historial."""
+    documents = store.get(1)
+    start = time.perf_counter()
+    for _ in range(lookups):
+        n = history - 1 - rng.randrange(recent) if rng.random() < 0.95 else rng.randrange(history)
+        message_id = str(1_000_000 + n)
+        submission = documents[message_id]
+        if save:
+            submission['status'] = 'denied' if submission['status'] == 'approved' else 'approved'
+            documents[message_id] = submission
+            store.save(1)
+    return (time.perf_counter() - start) / lookups
+
+def bench_judged(args):
+    """
+    Memoria y velocidad de los juzgados con un historial largo: el GuildState de antes (todo
+    el JSON en memoria, reescrito en cada guardado) frente al JudgedStore (SQLite con una
+    caché LRU de `--cache` envíos). La memoria (la que reserva Python; la caché de páginas de
+    SQLite no cuenta) se mide tras abrir el documento y atender `--lookups` reacciones sin
+    guardar; el tiempo, con un guardado por reacción.
+    """
+    import tracemalloc
+    from utils.judged import JudgedStore
+    submission = {'points': 120, 'base_points': 120, 'allies': ['1', '2', '3'], 'status': 'approved', 'channel_id': 7, 'seq': 1}
+    print(f"Historial: {args.history} juzgados, {args.lookups} reacciones (95 % sobre los {args.recent} más recientes)")
+    with tempfile.TemporaryDirectory() as tmp:
+        state.DATA_DIR = tmp
+        state.save_json(state.guild_path(1, 'judged_attacks.json'), {str(1_000_000 + n): dict(submission) for n in range(args.history)})
+        # La primera apertura del JudgedStore importa el JSON: se hace antes de medir.
+        JudgedStore('judged_attacks.json', db_file=os.path.join(tmp, 'judged.db')).get(1)
+        for name, factory in (('json', lambda: state.GuildState('judged_attacks.json')),
+                              ('sqlite+lru', lambda: JudgedStore('judged_attacks.json', cache_size=args.cache, db_file=os.path.join(tmp, 'judged.db')))):
+            tracemalloc.start()
+            store = factory()
+            _judged_workload(store, args.history, args.lookups, args.recent, random.Random(args.seed), save=False)
+            resident = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            per_reaction = _judged_workload(store, args.history, args.lookups, args.recent, random.Random(args.seed), save=True)
+            line = f"  {name:>10}: {resident / 1024:9.1f} KiB en memoria | {per_reaction * 1e3:7.2f} ms/reacción con guardado"
+            if isinstance(store, JudgedStore):
+                stats = store.stats()
+                line += f" | {stats['resident']} envíos en caché, {stats['hit_rate']:.1%} de aciertos"
+                store.close()
+            print(line)
+
+def bench_events(args):
+    """
+    Latencia que añaden las vistas derivadas a cada aprobación: llamarlas directamente
+    (esperando a cada una, como se hacía con get_cog) frente a publicar en el bus. Con el bus
+    las vistas de aviso descartan los eventos más antiguos si se quedan atrás; un agregador
+    igual de lento, suscrito sin pérdidas, debe contarlos todos.
+    """
+    from utils.events import EventBus, PointsChanged
+    delay = args.consumer_ms / 1000
+
+    async def consumer(event):
+        await asyncio.sleep(delay)
+
+    async def run(use_bus: bool):
+        bus = EventBus()
+        subscriptions = [bus.subscribe(PointsChanged, consumer, f"vista-{n}", maxsize=args.queue) for n in range(args.consumers)]
+        counted = Counter()
+
+        async def aggregate(summary):
+            await asyncio.sleep(delay)
+            counted.update(summary)
+
+        if use_bus:
+            subscriptions.append(bus.subscribe(PointsChanged, aggregate, 'agregado', fold=lambda summary, event: summary.update(events=1)))
+        latencies = []
+        for n in range(args.approvals):
+            event = PointsChanged(1, 'ataque', 'submission', ((n, 50),), 1)
+            start = time.perf_counter()
+            if use_bus:
+                bus.publish(event)
+            else:
+                for _ in range(args.consumers):
+                    await consumer(event)
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(args.interval_ms / 1000)
+        await bus.drain()
+        dropped = sum(subscription.dropped for subscription in subscriptions)
+        for subscription in subscriptions:
+            bus.unsubscribe(subscription)
+        return sorted(latencies), dropped, counted['events']
+
+    print(f"{args.approvals} aprobaciones cada {args.interval_ms:g} ms, {args.consumers} vistas de {args.consumer_ms:g} ms cada una")
+    for name, use_bus in (('directo', False), ('bus', True)):
+        latencies, dropped, counted = asyncio.run(run(use_bus))
+        p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+        line = f"  {name:>8}: p50 {p50 * 1000:8.3f} ms | p99 {p99 * 1000:8.3f} ms por aprobación"
+        if use_bus:
+            line += f" | {dropped} eventos descartados por las vistas | agregado sin pérdidas: {counted}/{args.approvals}"
+        print(line)
+
+def _rss_kib() -> int:
+    """Memoria residente actual del proceso (Linux); si no se puede leer, la máxima alcanzada."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _synthetic_user(n: int) -> dict:
+    return {'id': str(10**17 + n), 'username': f'usuario{n}', 'discriminator': '0', 'avatar': None, 'global_name': f'Usuario {n}'}
+
+def _synthetic_member(n: int) -> dict:
+    return {'user': _synthetic_user(n), 'roles': [], 'joined_at': '2024-01-01T00:00:00+00:00', 'deaf': False, 'mute': False, 'flags': 0}
+
+def _synthetic_guild(g: int, args, intents) -> dict:
+    """GUILD_CREATE de un servidor grande tal y como lo mandaría Discord con esos intents."""
+    guild_id = str(9 * 10**17 + g)
+    channel_ids = [str(7 * 10**17 + g * 10_000 + c) for c in range(args.channels)]
+    # Sin el intent de voz Discord no manda los estados de voz ni los miembros conectados.
+    in_voice = range(1, args.voice + 1) if intents.voice_states else range(0)
+    return {
+        'id': guild_id, 'name': f'servidor {g}', 'owner_id': str(10**17), 'large': True, 'unavailable': False,
+        'member_count': args.members, 'features': [], 'emojis': [], 'stickers': [], 'threads': [],
+        'roles': [{'id': guild_id if r == 0 else str(8 * 10**17 + g * 1000 + r), 'name': f'rol {r}', 'permissions': '0', 'position': r,
+                   'color': 0, 'hoist': False, 'managed': False, 'mentionable': False} for r in range(args.roles)],
+        'channels': [{'id': channel_id, 'type': 0, 'name': f'attack-{c}', 'position': c, 'permission_overwrites': []}
+                     for c, channel_id in enumerate(channel_ids)],
+        'members': [_synthetic_member(0)] + [_synthetic_member(n) for n in in_voice],
+        'voice_states': [{'user_id': str(10**17 + n), 'channel_id': channel_ids[0], 'session_id': 's', 'deaf': False, 'mute': False,
+                          'self_deaf': False, 'self_mute': False, 'self_video': False, 'suppress': False} for n in in_voice],
+    }
+
+def _synthetic_message(n: int, guild_id: str, channel_id: str) -> dict:
+    return {
+        'id': str(6 * 10**17 + n), 'channel_id': channel_id, 'guild_id': guild_id, 'author': _synthetic_user(50_000 + n),
+        'member': {'roles': [], 'joined_at': '2024-01-01T00:00:00+00:00', 'deaf': False, 'mute': False, 'flags': 0},
+        'content': f'Ataque con <@{10**17 + 1}> <@{10**17 + 2}>', 'timestamp': '2024-01-01T00:00:00+00:00', 'edited_timestamp': None,
+        'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'embeds': [], 'pinned': False, 'type': 0,
+        'attachments': [{'id': str(n), 'filename': 'captura.png', 'size': 1, 'url': 'https://cdn/captura.png',
+                         'proxy_url': 'https://cdn/captura.png', 'content_type': 'image/png'}],
+    }
+
+async def _gateway_profile(args) -> dict:
+    """Alimenta el estado de discord.py con servidores y mensajes sintéticos, sin conectarse."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import bot as bot_module
+    from discord.ext import commands
+    import discord
+    options = bot_module.gateway_options(args.profile == 'lean')
+    intents = options['intents']
+    baseline = _rss_kib()
+    client = commands.AutoShardedBot(command_prefix='!', **options)
+    await client._async_setup_hook()
+    connection = client._connection
+    connection.user = discord.ClientUser(state=connection, data=_synthetic_user(0))
+    start = time.perf_counter()
+    for g in range(args.guilds):
+        connection.parse_guild_create(_synthetic_guild(g, args, intents))
+    startup = time.perf_counter() - start
+    guild_id, channel_id = str(9 * 10**17), str(7 * 10**17)
+    for n in range(args.messages):
+        connection.parse_message_create(_synthetic_message(n, guild_id, channel_id))
+        # Con los intents completos también llegan los "está escribiendo..." de cada mensaje.
+        if intents.guild_typing:
+            connection.parse_typing_start({'channel_id': channel_id, 'guild_id': guild_id, 'user_id': str(10**17 + 50_000 + n),
+                                           'timestamp': 1700000000, 'member': _synthetic_member(50_000 + n)})
+    await asyncio.sleep(0)
+    gc.collect()
+    return {
+        'profile': args.profile, 'intents': intents.value, 'startup': startup, 'rss_kib': _rss_kib() - baseline,
+        'members': sum(len(guild.members) for guild in client.guilds),
+        'messages': len(connection._messages) if connection._messages is not None else 0,
+    }
+
+def bench_gateway(args):
+    """
+    Memoria y tiempo de arranque del perfil de gateway completo frente al ligero (LEAN_GATEWAY=1)
+    con servidores grandes sintéticos. Cada perfil se mide en su propio proceso para que la
+    memoria residente de uno no se mezcle con la del otro.
+    """
+    if args.profile:
+        print(json.dumps(asyncio.run(_gateway_profile(args))))
+        return 0
+    print(f"{args.guilds} servidores de {args.members} miembros ({args.voice} en voz), {args.channels} canales y {args.roles} roles; {args.messages} mensajes")
+    for profile in ('full', 'lean'):
+        command = [sys.executable, os.path.abspath(__file__), 'gateway', '--profile', profile, '--guilds', str(args.guilds),
+                   '--members', str(args.members), '--voice', str(args.voice), '--channels', str(args.channels),
+                   '--roles', str(args.roles), '--messages', str(args.messages)]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"  {profile:>5}: +{result['rss_kib'] / 1024:7.1f} MiB RSS | {result['startup'] * 1000:7.1f} ms de GUILD_CREATE | "
+              f"{result['members']} miembros y {result['messages']} mensajes en caché | intents {result['intents']}")
+
+class _SlowChannel:
+    """Canal falso cuyas llamadas a la API tardan unos milisegundos, como las reales."""
+    def __init__(self, rng, latency: float):
+        self.rng = rng
+        self.latency = latency
+
+    async def _wait(self):
+        await asyncio.sleep(self.rng.random() * self.latency)
+
+    def get_partial_message(self, message_id):
+        return SimpleNamespace(reactions=[], add_reaction=lambda emoji: self._wait(), remove_reaction=lambda emoji, user: self._wait())
+
+    async def fetch_message(self, message_id):
+        await self._wait()
+        return self.get_partial_message(message_id)
+
+async def _stress_reactions(args) -> dict:
+    """
+    Carga los cogs reales sin conectarse y lanza a la vez reacciones contradictorias sobre pocos
+    envíos, con varios /bulk en cada oleada que juzgan envíos al azar mientras llegan las reacciones.
+    """
+    import bot as bot_module
+    from utils.pending import PendingEntry
+    bot = bot_module.KompanyBot()
+    await bot._async_setup_hook()  # Crea los objetos asíncronos del cliente sin conectarse al gateway.
+    for extension in ('cogs.ataque', 'cogs.defenses', 'cogs.interserver', 'cogs.puntos', 'cogs.reacciones', 'cogs.moderacion'):
+        await bot.load_extension(extension)
+    guild_id, role_id, channel_id = 1, 42, 7
+    rng = random.Random(args.seed)
+    channel = _SlowChannel(rng, args.latency_ms / 1000)
+    bot.get_channel = lambda cid: channel if cid == channel_id else None
+    bot.guild_config.set(guild_id, admin_role_id=role_id)
+
+    stores = [(bot.get_cog('Ataque'), 'pending_attacks', 'judged_attacks', ['✅', '❌'], 'ataque'),
+              (bot.get_cog('Defensa'), 'pending_defenses', 'judged_defenses', ['✅', '❌', '🔥', '🌕'], 'defensa'),
+              (bot.get_cog('Interserver'), 'pending_interserver', 'judged_interserver', ['✅', '❌'], 'interserver')]
+    submissions = []
+
+    def seed():
+        # Un envío pendiente nuevo, repartido entre los tres cogs.
+        n = len(submissions)
+        cog, pending, judged, emojis, kind = stores[n % len(stores)]
+        getattr(cog, pending).get(guild_id)[str(10_000 + n)] = {
+            'points': 100, 'base_points': 100, 'allies': ['1', '2', '3'], 'channel_id': channel_id,
+            'multiplier_applied': False, 'multiplier_emoji': None,
+        }
+        submissions.append((10_000 + n, emojis, (cog, pending, judged), kind))
+        return submissions[-1]
+
+    def reaction(message_id, emoji):
+        user_id = 500 + len(submissions) + rng.randrange(10**6)
+        return SimpleNamespace(
+            guild_id=guild_id, channel_id=channel_id, message_id=message_id, user_id=user_id, emoji=emoji,
+            member=SimpleNamespace(bot=False, roles=[SimpleNamespace(id=role_id)], mention=f"<@{user_id}>"),
+        )
+
+    for _ in range(args.submissions):
+        seed()
+    for cog, pending, _, _, _ in stores:
+        getattr(cog, pending).save(guild_id)
+
+    payloads = []
+    for m in range(args.reactions):
+        message_id, emojis, _, _ = rng.choice(submissions[:args.submissions])
+        payloads.append(reaction(message_id, rng.choice(emojis)))
+    reacciones = bot.get_cog('Reacciones')
+    if args.no_locks:
+        async def handler(payload):
+            for _, method in reacciones._handlers(payload, 'handle_reaction_add'):
+                await method(payload)
+    else:
+        handler = reacciones.on_raw_reaction_add
+    moderacion = bot.get_cog('Moderacion')
+
+    errors = 0
+    bulk_judged = 0
+    start = time.perf_counter()
+    for wave in range(0, len(payloads), args.wave):
+        # Envíos nuevos de la oleada: la mitad recibe una reacción que empieza antes que los /bulk
+        # que los intentan juzgar, así que un /bulk llega mientras la reacción espera a la API.
+        fresh = [seed() for _ in range(args.bulk * args.bulk_size)]
+        reactions = [handler(payload) for payload in payloads[wave:wave + args.wave]]
+        reactions += [handler(reaction(message_id, rng.choice(('✅', '❌')))) for message_id, _, _, _ in fresh[::2]]
+        bulks = [moderacion.apply_verdicts(guild_id, [PendingEntry(message_id, kind, channel_id, ['1', '2', '3'], 100)
+                                                      for message_id, _, _, kind in fresh[i::args.bulk]],
+                                           rng.choice(('approved', 'denied')))
+                 for i in range(args.bulk)]
+        results = await asyncio.gather(*reactions, *bulks, return_exceptions=True)
+        errors += sum(isinstance(result, Exception) for result in results)
+        bulk_judged += sum(len(result) for result in results[len(reactions):] if isinstance(result, list))
+    elapsed = time.perf_counter() - start
+
+    # Cada envío debe seguir exactamente en un sitio: pendiente o juzgado.
+    misplaced = sum(
+        (str(message_id) in getattr(cog, pending).get(guild_id)) + (str(message_id) in getattr(cog, judged).get(guild_id)) != 1
+        for message_id, _, (cog, pending, judged), _ in submissions
+    )
+    locks = reacciones.locks
+    # Las reacciones que /bulk deja en cola no cuentan para la prueba: se descartan en vez de esperar al cierre.
+    while not moderacion.reaction_updates.empty():
+        moderacion.reaction_updates.get_nowait()
+        moderacion.reaction_updates.task_done()
+    for extension in list(bot.extensions):
+        await bot.unload_extension(extension)  # Vacía el group commit.
+    report = verify.verify_ledger([guild_id], db_file=ledger.DB_FILE)
+    return {'elapsed': elapsed, 'errors': errors, 'misplaced': misplaced, 'bulk_judged': bulk_judged, 'contended': locks.contended, 'locks_left': len(locks), 'report': report}
+
+def bench_stress(args):
+    """
+    Moderadores pulsando ✅ y ❌ a la vez sobre los mismos envíos, con los cogs reales y el
+    group commit (que hace que cada aprobación espere de verdad). Sin cerrojos la carrera se ve
+    en los manejadores que fallan con KeyError tras el pop de otro: uno aprueba y escribe sus
+    puntos mientras otro retira el envío como rechazado, y el verificador encuentra esos puntos
+    de más. Las aprobaciones repetidas no desvían el libro: las claves de origen las descartan.
+    """
+    rules_file = os.path.abspath(os.getenv("SCORING_RULES_FILE", 'scoring_rules.json'))
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # El bot usa rutas relativas (leaderboard.db, data/): se ejecuta dentro de la carpeta temporal.
+        os.chdir(tmp)
+        os.environ['SCORING_RULES_FILE'] = rules_file
+        os.environ['POINTS_GROUP_COMMIT'] = '1'
+        try:
+            result = asyncio.run(_stress_reactions(args))
+        finally:
+            os.chdir(cwd)
+    report = result['report']
+    print(f"{args.reactions} reacciones sobre {args.submissions} envíos en oleadas de {args.wave} ({'sin' if args.no_locks else 'con'} cerrojos), "
+          f"con {args.bulk} /bulk de {args.bulk_size} envíos por oleada")
+    print(f"  {result['elapsed']:.2f} s | {args.reactions / result['elapsed']:.0f} reacciones/s | {result['contended']} esperas por cerrojo | {result['locks_left']} cerrojos en memoria")
+    print(f"  {result['bulk_judged']} envíos juzgados por /bulk | {result['errors']} manejadores fallaron | {result['misplaced']} envíos perdidos o duplicados entre pendientes y juzgados")
+    print(f"  verificación: {report['submissions']} envíos juzgados, {report['drifted_submissions']} con diferencias ({report['drift_points']} puntos)")
+    return 1 if report['drifted_submissions'] or result['errors'] or result['misplaced'] else 0
+
+def _percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+async def _replay(args) -> dict:
+    """Carga los cogs reales sin conectarse y les entrega los eventos grabados por la gateway falsa."""
+    import bot as bot_module
+    import discord
+    from utils import replay
+    bot = bot_module.KompanyBot()
+    await bot._async_setup_hook()
+    connection = bot._connection
+    cogs_dir = os.path.join(os.path.dirname(os.path.abspath(bot_module.__file__)), 'cogs')
+    for filename in sorted(os.listdir(cogs_dir)):
+        if filename.endswith('.py') and not filename.startswith('__'):
+            await bot.load_extension(f'cogs.{filename[:-3]}')
+
+    errors = Counter()
+    default_on_error = bot.on_error
+    async def on_error(event_method, *event_args, **event_kwargs):
+        errors[event_method] += 1
+        await default_on_error(event_method, *event_args, **event_kwargs)
+    bot.on_error = on_error
+
+    loop = asyncio.get_running_loop()
+    latencies = {event: [] for event in replay.RECORDED_EVENTS}
+    counts = Counter()
+    api = None
+    guilds = set()
+
+    def track(tasks, event: str, dispatched: float):
+        """Latencia del evento: desde que se entrega hasta que terminan todos sus manejadores."""
+        remaining = [len(tasks)]
+        def done(_):
+            remaining[0] -= 1
+            if not remaining[0]:
+                latencies[event].append(loop.time() - dispatched)
+        for task in tasks:
+            task.add_done_callback(done)
+
+    start = loop.time()
+    clock = 0.0
+    previous = None
+    for record in replay.read_recording(args.recording):
+        event, data = record['e'], record['d']
+        if event == 'HEADER':
+            if api is None:
+                api = replay.FakeDiscordAPI(data['user'], args.latency_ms / 1000, args.seed)
+                bot.http.request = api.request
+                connection.user = discord.ClientUser(state=connection, data=data['user'])
+            continue
+        if event == 'GUILD':
+            if data['id'] not in guilds:
+                guilds.add(data['id'])
+                connection.parse_guild_create(replay.guild_payload(data, api.user))
+                bot.guild_config.set(int(data['id']), **{field: value for field, value in data['config'].items() if value})
+            continue
+        # Los huecos largos (horas sin actividad, reinicios entre grabaciones) se recortan a --max-gap.
+        if previous is not None:
+            clock += min(max(record['t'] - previous, 0), args.max_gap)
+        previous = record['t']
+        delay = start + clock / args.speed - loop.time() if args.speed else 0
+        await asyncio.sleep(max(delay, 0))
+        api.remember(event, data)
+        before = set(bot._event_tasks)
+        dispatched = loop.time()
+        connection.parsers[event](data)
+        counts[event] += 1
+        new_tasks = bot._event_tasks - before
+        if new_tasks:
+            track(new_tasks, event, dispatched)
+    fed = loop.time() - start
+    while bot._event_tasks:
+        await asyncio.wait(list(bot._event_tasks))
+    await bot.events.drain(timeout=5)
+    elapsed = loop.time() - start
+    for extension in list(bot.extensions):
+        await bot.unload_extension(extension)  # Vacía el group commit.
+
+    con = ledger.connect(ledger.DB_FILE)
+    try:
+        totals = con.execute("SELECT guild_id, user_id, SUM(points), COUNT(*) FROM puntuaciones GROUP BY guild_id, user_id").fetchall()
+    finally:
+        con.close()
+    board = {f"{guild_id}:{user_id}": points for guild_id, user_id, points, _ in totals}
+    report = verify.verify_ledger(db_file=ledger.DB_FILE)
+    return {
+        'recording': os.path.basename(args.recording), 'speed': args.speed, 'latency_ms': args.latency_ms,
+        'guilds': len(guilds), 'events': dict(counts), 'fed': fed, 'elapsed': elapsed,
+        'latency': {event: {'p50': _percentile(values, 0.5), 'p95': _percentile(values, 0.95), 'p99': _percentile(values, 0.99),
+                            'max': max(values, default=0.0)} for event, values in latencies.items() if values},
+        'errors': dict(errors), 'api_calls': dict(api.calls) if api else {}, 'unhandled_routes': dict(api.unhandled) if api else {},
+        'ledger_rows': sum(row[3] for row in totals), 'ledger_points': sum(board.values()),
+        'ledger_digest': hashlib.sha1(json.dumps(board, sort_keys=True).encode()).hexdigest(), 'ledger': board,
+        'drifted_submissions': report['drifted_submissions'],
+    }
+
+def bench_replay(args):
+    """
+    Reproduce una grabación de la gateway (GATEWAY_RECORD_FILE) contra los cogs reales y una
+    API de Discord falsa, en una carpeta temporal vacía, a la velocidad original (--speed 1),
+    acelerada o lo más rápido posible (--speed 0). El informe incluye una huella del libro
+    final: con --compare se contrasta con el de otra ejecución (por ejemplo, de otra versión).
+    """
+    rules_file = os.path.abspath(os.getenv("SCORING_RULES_FILE", 'scoring_rules.json'))
+    args.recording = os.path.abspath(args.recording)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # El bot usa rutas relativas (leaderboard.db, data/): se ejecuta dentro de la carpeta temporal.
+        os.chdir(tmp)
+        os.environ['SCORING_RULES_FILE'] = rules_file
+        try:
+            result = asyncio.run(_replay(args))
+        finally:
+            os.chdir(cwd)
+    total = sum(result['events'].values())
+    pace = f"a {args.speed:g}x" if args.speed else "lo más rápido posible"
+    print(f"{total} eventos de {result['guilds']} servidores reproducidos {pace} (latencia de la API hasta {args.latency_ms:g} ms)")
+    print("  " + " | ".join(f"{event}: {count}" for event, count in sorted(result['events'].items())))
+    print(f"  {result['elapsed']:.2f} s ({result['fed']:.2f} s entregando) | {total / max(result['elapsed'], 1e-9):.0f} eventos/s")
+    for event, stats in sorted(result['latency'].items()):
+        print(f"  {event:>24}: p50 {stats['p50'] * 1000:7.1f} ms | p95 {stats['p95'] * 1000:7.1f} ms | "
+              f"p99 {stats['p99'] * 1000:7.1f} ms | máx {stats['max'] * 1000:7.1f} ms")
+    print(f"  API falsa: {sum(result['api_calls'].values())} llamadas, {sum(result['unhandled_routes'].values())} a rutas sin simular "
+          f"| {sum(result['errors'].values())} manejadores fallaron")
+    print(f"  libro final: {result['ledger_rows']} filas, {len(result['ledger'])} usuarios, {result['ledger_points']} puntos "
+          f"| huella {result['ledger_digest'][:12]} | {result['drifted_submissions']} envíos con diferencias")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    status = 1 if result['errors'] or result['drifted_submissions'] else 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        previous_total = sum(previous['events'].values())
+        print(f"Comparación con {args.compare}: {previous_total / max(previous['elapsed'], 1e-9):.0f} -> "
+              f"{total / max(result['elapsed'], 1e-9):.0f} eventos/s")
+        if previous['ledger_digest'] == result['ledger_digest']:
+            print("  ✅ El libro final es idéntico.")
+        else:
+            changed = sorted(set(previous['ledger']) | set(result['ledger']))
+            changed = [key for key in changed if previous['ledger'].get(key) != result['ledger'].get(key)]
+            print(f"  ❌ El libro final difiere en {len(changed)} usuarios:")
+            for key in changed[:20]:
+                print(f"     {key}: {previous['ledger'].get(key, 0)} -> {result['ledger'].get(key, 0)}")
+            status = 1
+    return status
+
+# --- PUNTO DE ENTRADA ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks del bot sin conexión a Discord.")
+    sub = parser.add_subparsers(dest='scenario', required=True)
+
+    p = sub.add_parser('group-commit', help="Commits/s y filas/s con y sin group commit.")
+    p.add_argument('--moderators', type=int, default=8)
+    p.add_argument('--approvals', type=int, default=200)
+    p.add_argument('--allies', type=int, default=3)
+    p.add_argument('--delay-ms', type=float, default=5)
+    p.add_argument('--max-rows', type=int, default=500)
+    p.set_defaults(func=bench_group_commit)
+
+    p = sub.add_parser('guilds', help="Eventos/s según el número de servidores, con estado compartido o particionado.")
+    p.add_argument('--guilds', type=int, nargs='+', default=[1, 2, 4, 8])
+    p.add_argument('--history', type=int, default=2000)
+    p.add_argument('--events', type=int, default=50)
+    p.set_defaults(func=bench_guilds)
+
+    p = sub.add_parser('reactions', help="Coste de descartar reacciones en mensajes que no son envíos.")
+    p.add_argument('--history', type=int, default=20000)
+    p.add_argument('--pending', type=int, default=200)
+    p.add_argument('--events', type=int, default=50000)
+    p.set_defaults(func=bench_reactions)
+
+    p = sub.add_parser('judged', help="Memoria y aciertos de la caché de juzgados frente al JSON completo.")
+    p.add_argument('--history', type=int, default=20000)
+    p.add_argument('--lookups', type=int, default=100)
+    p.add_argument('--recent', type=int, default=500)
+    p.add_argument('--cache', type=int, default=1000)
+    p.add_argument('--seed', type=int, default=1)
+    p.set_defaults(func=bench_judged)
+
+    p = sub.add_parser('events', help="Latencia que añaden las vistas derivadas a una aprobación, con y sin bus de eventos.")
+    p.add_argument('--approvals', type=int, default=500)
+    p.add_argument('--interval-ms', type=float, default=1)
+    p.add_argument('--consumers', type=int, default=3)
+    p.add_argument('--consumer-ms', type=float, default=2)
+    p.add_argument('--queue', type=int, default=100, help="Tamaño de la cola de cada suscriptor.")
+    p.set_defaults(func=bench_events)
+
+    p = sub.add_parser('gateway', help="RSS y arranque con el perfil de gateway completo y el ligero.")
+    p.add_argument('--guilds', type=int, default=20)
+    p.add_argument('--members', type=int, default=100000)
+    p.add_argument('--voice', type=int, default=1500, help="Miembros conectados a voz en cada servidor.")
+    p.add_argument('--channels', type=int, default=300)
+    p.add_argument('--roles', type=int, default=200)
+    p.add_argument('--messages', type=int, default=20000)
+    p.add_argument('--profile', choices=('full', 'lean'), help="Mide solo ese perfil en este proceso.")
+    p.set_defaults(func=bench_gateway)
+
+    p = sub.add_parser('stress', help="Reacciones contradictorias simultáneas; comprueba que el libro sigue cuadrando.")
+    p.add_argument('--submissions', type=int, default=50)
+    p.add_argument('--reactions', type=int, default=5000)
+    p.add_argument('--wave', type=int, default=500, help="Reacciones lanzadas a la vez en cada oleada.")
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--latency-ms', type=float, default=20, help="Latencia máxima simulada de cada llamada a la API.")
+    p.add_argument('--no-locks', action='store_true', help="Llama a los cogs directamente, sin el despachador ni sus cerrojos.")
+    p.add_argument('--bulk', type=int, default=2, help="/bulk lanzados a la vez que las reacciones en cada oleada.")
+    p.add_argument('--bulk-size', type=int, default=10, help="Envíos que intenta juzgar cada /bulk.")
+    p.set_defaults(func=bench_stress)
+
+    p = sub.add_parser('replay', help="Reproduce una grabación de la gateway contra los cogs y una API falsa.")
+    p.add_argument('recording', help="Archivo grabado con GATEWAY_RECORD_FILE.")
+    p.add_argument('--speed', type=float, default=1.0, help="Multiplicador de velocidad; 0 entrega los eventos sin esperas.")
+    p.add_argument('--max-gap', type=float, default=5.0, help="Segundos máximos de espera entre dos eventos.")
+    p.add_argument('--latency-ms', type=float, default=20, help="Latencia máxima simulada de cada llamada a la API.")
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--report', help="Guarda el informe completo en este JSON.")
+    p.add_argument('--compare', help="Informe JSON de otra ejecución con el que comparar.")
+    p.set_defaults(func=bench_replay)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
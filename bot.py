@@ -1,33 +1,129 @@
 # bot.py (Estructura Final y Corregida)
 import discord
+from discord import app_commands
 from discord.ext import commands
 import os
 import asyncio
+import signal
+import hashlib
+import json
+import time
+import logging
 from dotenv import load_dotenv
 
 # --- Carga de Variables de Entorno ---
 # Esto buscará un archivo llamado exactamente ".env"
+# El resultado se registra en `main`, cuando el registro ya está configurado.
 found_dotenv = load_dotenv()
-if found_dotenv:
-    print("✅ Archivo .env encontrado y cargado exitosamente.")
-else:
-    print("❌ ¡ERROR CRÍTICO! No se encontró el archivo .env.")
 
 TOKEN = os.getenv("DISCORD_TOKEN")
 TEST_GUILD_ID = int(os.getenv("TEST_GUILD_ID", 0))
+# Con FORCE_COMMAND_SYNC=1 se sincroniza aunque el árbol de comandos no haya cambiado.
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "0") == "1"
+# Segundos que el cierre espera a que terminen los eventos que ya se estaban procesando.
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 20))
+# Eventos que traen trabajo nuevo y que se descartan en cuanto empieza el cierre.
+INTAKE_EVENTS = {'message', 'raw_reaction_add', 'raw_reaction_remove'}
+# Con LEAN_GATEWAY=1 el bot solo pide a la gateway lo que usan los cogs (ver `gateway_options`).
+LEAN_GATEWAY = os.getenv("LEAN_GATEWAY", "0") == "1"
+# Mensajes que guarda la caché de discord.py en el perfil ligero (0 la desactiva).
+GATEWAY_MAX_MESSAGES = int(os.getenv("GATEWAY_MAX_MESSAGES", 100))
+# Si se indica, los mensajes y reacciones de los canales de envíos se graban en ese archivo (.jsonl.gz)
+# para reproducirlos después con `python benchmark.py replay`.
+GATEWAY_RECORD_FILE = os.getenv("GATEWAY_RECORD_FILE", "")
 
-# --- SUBCLASE DE BOT PERSONALIZADA ---
-# Crear una subclase de commands.Bot nos permite usar el `setup_hook`
-# para una inicialización asíncrona más controlada y fiable.
-class KompanyBot(commands.Bot):
-    def __init__(self):
-        # Definimos los intents aquí, en el constructor de nuestra clase.
+# Se importan después de cargar el .env porque leen variables de entorno al importarse.
+from utils import ledger, shards, state
+from utils.guild_config import GuildConfigStore
+from utils.coordination import Coordinator
+from utils.rules import RulesEngine
+from utils.events import EventBus, EventMetrics
+from utils import logs
+from utils.replay import GatewayRecorder
+
+log = logging.getLogger(__name__)
+
+# Último árbol de comandos sincronizado con Discord, por aplicación y destino.
+COMMAND_TREE_FILE = os.path.join(state.DATA_DIR, 'command_tree.json')
+
+# --- ÁRBOL DE COMANDOS ---
+class KompanyTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        """Rechaza comandos nuevos mientras el bot se está cerrando."""
+        if self.client.accepting:
+            return True
+        await interaction.response.send_message("🔄 El bot se está reiniciando, inténtalo de nuevo en un momento.", ephemeral=True)
+        return False
+
+# --- GATEWAY ---
+def gateway_options(lean: bool = LEAN_GATEWAY) -> dict:
+    """
+    Intents y cachés de discord.py para el constructor del bot.
+
+    El perfil completo es el de siempre (Intents.default() con el contenido de los mensajes).
+    El ligero se queda con lo que necesitan los cogs: servidores y canales, mensajes de
+    servidor con su contenido y reacciones. Sin DMs, escritura, voz, invitaciones ni eventos
+    programados; sin caché de miembros (los roles de los moderadores llegan en la propia
+    reacción o interacción), sin pedir miembros al arrancar y con la caché de mensajes
+    acotada a GATEWAY_MAX_MESSAGES (los cogs piden los mensajes con fetch_message).
+    """
+    if not lean:
         intents = discord.Intents.default()
         intents.message_content = True
         intents.guilds = True
         intents.reactions = True
-        # Llamamos al constructor de la clase padre (commands.Bot)
-        super().__init__(command_prefix='!', intents=intents)
+        return {'intents': intents}
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.message_content = True
+    intents.guild_reactions = True
+    return {
+        'intents': intents,
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'chunk_guilds_at_startup': False,
+        'max_messages': GATEWAY_MAX_MESSAGES or None,
+    }
+
+# --- SUBCLASE DE BOT PERSONALIZADA ---
+# Crear una subclase del bot nos permite usar el `setup_hook` para una inicialización
+# asíncrona más controlada y fiable. AutoShardedBot reparte los servidores entre varias
+# conexiones a la gateway; con SHARD_COUNT/SHARD_IDS cada proceso atiende solo sus shards.
+class KompanyBot(commands.AutoShardedBot):
+    def __init__(self):
+        # Llamamos al constructor de la clase padre con los intents y cachés del perfil elegido,
+        # indicando los shards de este proceso si están configurados.
+        shard_options = {}
+        if shards.SHARD_COUNT:
+            shard_options['shard_count'] = shards.SHARD_COUNT
+            if shards.SHARD_IDS:
+                shard_options['shard_ids'] = shards.SHARD_IDS
+        super().__init__(command_prefix='!', tree_cls=KompanyTree, **gateway_options(), **shard_options)
+        # Mientras `accepting` sea False no se atienden reacciones, mensajes ni comandos nuevos.
+        self.accepting = True
+        self._event_tasks = set()
+        self._shutdown_task = None
+        # Si el proceso anterior no se cerró limpiamente, setup_hook revisa la base de datos.
+        self.clean_start = state.read_shutdown_marker().get('clean', False)
+        state.write_shutdown_marker(False, pid=os.getpid())
+        # Tiempos de cada fase del arranque, que setup_hook imprime al terminar.
+        self.started_at = time.perf_counter()
+        self.startup_timings = {}
+        # Configuración por servidor (roles y canales), guardada en la base de datos y cacheada.
+        # Los servidores sin configuración propia usan los valores del .env.
+        ledger.initialize_database()
+        self.guild_config = GuildConfigStore(ledger.DB_FILE)
+        # Datos compartidos entre procesos (latidos, arrendamientos y ranking global).
+        self.coordinator = Coordinator(ledger.DB_FILE, shards.SHARD_IDS)
+        # Tablas de puntos y multiplicadores (scoring_rules.json); /rules las recarga en caliente.
+        self.rules = RulesEngine()
+        # Avisos entre cogs (puntos escritos, envíos juzgados) para las vistas derivadas.
+        self.events = EventBus()
+        # Contadores de puntos y veredictos a partir del bus (en /cache y en el registro al cerrar).
+        self.metrics = EventMetrics()
+        # Grabadora de eventos de la gateway (solo con GATEWAY_RECORD_FILE).
+        self.recorder = None
+        self.startup_timings['base de datos'] = time.perf_counter() - self.started_at
 
     async def setup_hook(self):
         """
@@ -35,18 +131,37 @@ class KompanyBot(commands.Bot):
         pero antes de que esté completamente listo. Es el lugar perfecto para
         cargar cogs y sincronizar comandos.
         """
-        print("--- Cargando Módulos (Cogs) ---")
-        for filename in os.listdir('./cogs'):
+        timings = {}
+        if GATEWAY_RECORD_FILE:
+            self.recorder = GatewayRecorder(self, GATEWAY_RECORD_FILE)
+            self.recorder.install()
+            log.info("⏺️ Grabando los eventos de los canales de envíos en %s.", GATEWAY_RECORD_FILE)
+        phase_start = time.perf_counter()
+        if self.clean_start:
+            log.info("✅ El último cierre fue limpio; se omiten las comprobaciones de consistencia.")
+        else:
+            log.warning("⚠️ El último cierre no fue limpio; comprobando la base de datos...")
+            problems = await asyncio.to_thread(ledger.quick_check)
+            if problems:
+                log.error("❌ La base de datos tiene %d problemas de integridad:\n%s", len(problems),
+                          "\n".join(f"   - {problem}" for problem in problems[:10]))
+            else:
+                log.info("✅ La base de datos está íntegra.")
+            timings['comprobaciones'] = time.perf_counter() - phase_start
+
+        self.metrics.subscribe(self.events)
+
+        phase_start = time.perf_counter()
+        log.info("--- Cargando Módulos (Cogs) ---")
+        # En orden alfabético: `load_extension` importa y ejecuta `setup()` sin ceder el bucle, así
+        # que cargarlos a la vez no ganaría nada. Lo rápido es que ninguno lee su estado al cargarse.
+        for filename in sorted(os.listdir('./cogs')):
             if filename.endswith('.py') and not filename.startswith('__'):
-                extension_name = f'cogs.{filename[:-3]}'
-                try:
-                    await self.load_extension(extension_name)
-                    print(f"✅ Módulo '{filename}' cargado exitosamente.")
-                except Exception as e:
-                    print(f"❌ Error al cargar el módulo '{filename}':")
-                    print(f"   - {type(e).__name__}: {e}")
-        
-        print("\n--- Sincronizando comandos de barra (Slash Commands) ---")
+                await self._load_cog(f'cogs.{filename[:-3]}')
+        timings['cogs'] = time.perf_counter() - phase_start
+
+        phase_start = time.perf_counter()
+        log.info("--- Sincronizando comandos de barra (Slash Commands) ---")
         # Sincronizamos los comandos DESPUÉS de haber cargado todos los cogs.
         # Esto garantiza que todos los comandos se registren antes de la sincronización.
         try:
@@ -54,40 +169,168 @@ class KompanyBot(commands.Bot):
                 # Sincronización específica para el servidor de pruebas (instantánea).
                 guild = discord.Object(id=TEST_GUILD_ID)
                 self.tree.copy_global_to(guild=guild)
-                synced_commands = await self.tree.sync(guild=guild)
-                print(f"✅ ¡Se sincronizaron {len(synced_commands)} comandos para el servidor de pruebas!")
+                await self._sync_if_changed(guild, "para el servidor de pruebas")
             else:
                 # Sincronización global (puede tardar hasta 1 hora).
-                synced_commands = await self.tree.sync()
-                print(f"✅ ¡Se sincronizaron {len(synced_commands)} comandos globalmente!")
+                await self._sync_if_changed(None, "globalmente")
 
         except Exception as e:
-            print(f"❌ Error al sincronizar comandos: {e}")
+            log.exception("❌ Error al sincronizar comandos: %s", e)
+        timings['sync'] = time.perf_counter() - phase_start
+
+        phases = {**self.startup_timings, **timings}
+        log.info("--- Tiempos de arranque ---\n%s", "\n".join(f"   - {phase}: {elapsed * 1000:.0f} ms" for phase, elapsed in phases.items()),
+                 extra={'startup_ms': {phase: round(elapsed * 1000) for phase, elapsed in phases.items()}})
+
+    async def _load_cog(self, extension_name: str):
+        """Carga un cog midiendo cuánto tarda; un fallo no impide cargar los demás."""
+        start = time.perf_counter()
+        try:
+            await self.load_extension(extension_name)
+            elapsed_ms = round((time.perf_counter() - start) * 1000)
+            log.info("✅ Módulo '%s' cargado exitosamente (%d ms).", extension_name, elapsed_ms)
+        except Exception:
+            log.exception("❌ Error al cargar el módulo '%s':", extension_name)
+
+    def command_tree_hash(self, guild=None) -> str:
+        """Huella del árbol de comandos tal y como se enviaría a Discord."""
+        payload = sorted((command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)),
+                         key=lambda command: (command.get('type', 1), command['name']))
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def _sync_if_changed(self, guild, target: str):
+        """Llama a `tree.sync` solo si el árbol cambió desde la última sincronización guardada."""
+        scope = f"{self.application_id}:{guild.id if guild else 'global'}"
+        tree_hash = self.command_tree_hash(guild)
+        synced_hashes = state.load_json(COMMAND_TREE_FILE, {})
+        if not FORCE_COMMAND_SYNC and synced_hashes.get(scope) == tree_hash:
+            log.info("⏭️ Los comandos %s no cambiaron; se omite la sincronización.", target)
+            return
+        synced_commands = await self.tree.sync(guild=guild)
+        synced_hashes[scope] = tree_hash
+        state.save_json(COMMAND_TREE_FILE, synced_hashes)
+        log.info("✅ ¡Se sincronizaron %d comandos %s!", len(synced_commands), target)
+
+    # --- CIERRE ORDENADO ---
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        """Igual que en discord.py, pero recordando la tarea para poder esperarla al cerrar."""
+        task = super()._schedule_event(coro, event_name, *args, **kwargs)
+        self._event_tasks.add(task)
+        task.add_done_callback(self._event_tasks.discard)
+        return task
+
+    def dispatch(self, event_name, /, *args, **kwargs):
+        if not self.accepting and event_name in INTAKE_EVENTS:
+            return
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def shutdown(self, reason: str):
+        """Cierra el bot una sola vez, aunque se pida varias (señal y fin de `start`)."""
+        if self._shutdown_task is None:
+            self._shutdown_task = asyncio.create_task(self._shutdown(reason))
+        await asyncio.shield(self._shutdown_task)
+
+    async def _shutdown(self, reason: str):
+        """
+        Deja de aceptar trabajo, espera a los eventos en curso, vuelca el estado con fsync,
+        descarga los cogs (que vacían sus colas de escritura) y deja la marca
+        de cierre limpio. Si algo falla la marca no se escribe y el siguiente arranque
+        hará las comprobaciones completas.
+        """
+        log.info("--- Cerrando el bot (%s) ---", reason)
+        start = time.perf_counter()
+        self.accepting = False
+
+        pending = [task for task in self._event_tasks if task is not asyncio.current_task()]
+        if pending:
+            log.info("⏳ Esperando a %d eventos en curso...", len(pending))
+            _, still_running = await asyncio.wait(pending, timeout=SHUTDOWN_TIMEOUT)
+            if still_running:
+                log.warning("⚠️ %d eventos no terminaron a tiempo y se cancelan.", len(still_running))
+                for task in still_running:
+                    task.cancel()
+
+        # Los suscriptores del bus (tablero...) terminan lo que tengan en cola antes de descargar los cogs.
+        if not await self.events.drain(timeout=5):
+            log.warning("⚠️ Algunos suscriptores del bus de eventos no vaciaron su cola a tiempo.")
+        if self.metrics.totals:
+            log.info("📈 Métricas de la sesión: %s", ", ".join(f"{name}={value}" for name, value in sorted(self.metrics.totals.items())),
+                     extra={'metrics': dict(self.metrics.totals)})
+        # Con los eventos terminados el estado ya no cambia: se vuelca mientras los cogs siguen cargados.
+        try:
+            partitions = await asyncio.to_thread(state.flush_all)
+        except OSError as e:
+            log.error("❌ No se pudo volcar el estado: %s", e)
+            partitions = None
+        # Bot.close descarga todas las extensiones; su cog_unload vacía las escrituras pendientes.
+        if not self.is_closed():
+            await self.close()
+        if self.recorder:
+            self.recorder.close()
+            log.info("⏹️ Grabación cerrada: %d eventos en %s.", self.recorder.recorded, GATEWAY_RECORD_FILE)
+        if partitions is None:
+            return
+        state.write_shutdown_marker(True, reason=reason)
+        log.info("✅ Cierre limpio en %.1f s (%d particiones de estado volcadas).", time.perf_counter() - start, partitions)
 
     async def on_ready(self):
         """
         Este evento se dispara cuando el bot está completamente listo y operativo.
         Ahora solo lo usamos para confirmar la conexión.
         """
-        print('--------------------------------------------------')
-        print(f'✅ ¡Bot conectado como {self.user}!')
-        print(f'   ID del Bot: {self.user.id}')
-        print('--------------------------------------------------')
+        log.info(
+            "✅ ¡Bot conectado como %s!\n   ID del Bot: %s\n   Shards: %s de %s | Servidores: %d\n"
+            "   Perfil de gateway: %s | Intents: %s\n   Listo en %.1f s desde el arranque.",
+            self.user, self.user.id, sorted(self.shards), self.shard_count, len(self.guilds),
+            'ligero' if LEAN_GATEWAY else 'completo', self.intents.value, time.perf_counter() - self.started_at,
+        )
+        # Archivos de estado heredados sin servidor asignado (TEST_GUILD_ID=0 y sin LEGACY_GUILD_ID).
+        legacy_files = state.legacy_files()
+        if legacy_files:
+            if len(self.guilds) == 1 and not shards.SHARD_IDS:
+                adopted = state.adopt_legacy_files(self.guilds[0].id)
+                log.info("📦 Archivos heredados asignados al único servidor del bot (%s): %d entradas incorporadas.",
+                         self.guilds[0].id, sum(adopted.values()), extra={'guild_id': self.guilds[0].id})
+            else:
+                log.warning("⚠️ Hay archivos de estado heredados (%s) sin ningún servidor asignado: sus envíos no se ven. "
+                            "Indica su servidor en LEGACY_GUILD_ID.", ", ".join(legacy_files))
 
 # --- PUNTO DE ENTRADA ---
 async def main():
-    # Creamos una instancia de nuestro bot personalizado.
-    bot = KompanyBot()
+    if found_dotenv:
+        log.info("✅ Archivo .env encontrado y cargado exitosamente.")
+    else:
+        log.error("❌ ¡ERROR CRÍTICO! No se encontró el archivo .env.")
 
+    # Sin token no se construye el bot: su __init__ ya toca la base de datos y la marca de cierre.
     if TOKEN is None:
-        print("❌ ERROR FATAL: No se encontró el DISCORD_TOKEN en el archivo .env. El bot no puede iniciar.")
+        log.critical("❌ ERROR FATAL: No se encontró el DISCORD_TOKEN en el archivo .env. El bot no puede iniciar.")
         return
-    
+
+    # Creamos una instancia de nuestro bot personalizado.
+    bot = KompanyBot()
+
+    # SIGTERM (systemd, docker) y Ctrl+C inician el cierre ordenado.
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, lambda sig=sig: asyncio.create_task(bot.shutdown(sig.name)))
+        except NotImplementedError:
+            # Windows no admite manejadores de señales en el bucle; ahí queda el KeyboardInterrupt.
+            pass
+
     # Iniciamos el bot.
-    await bot.start(TOKEN)
+    try:
+        await bot.start(TOKEN)
+    finally:
+        await bot.shutdown("fin de la conexión")
 
 if __name__ == '__main__':
+    # Los cogs y discord.py registran con `logging`; aquí se monta la cola y el hilo que escribe.
+    logs.setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("\nBot desconectado manualmente.")
\ No newline at end of file
+        log.info("Bot desconectado manualmente.")
+    finally:
+        logs.shutdown_logging()
\ No newline at end of file
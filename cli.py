@@ -0,0 +1,201 @@
+# cli.py
+# Herramientas de administración que trabajan directamente sobre los datos, sin conectarse a Discord.
+# Uso: python cli.py <comando> [opciones]
+# No importa discord, así que arranca rápido y sirve para cron. Los comandos que escriben
+# estado JSON (import-json) deben usarse con el bot apagado, porque el bot lo tiene cacheado.
+import argparse
+import sys
+from dotenv import load_dotenv
+
+# Igual que en bot.py: los módulos de utils leen variables de entorno al importarse.
+load_dotenv()
+
+from utils import backup, export, ledger, rescore, state, verify
+from utils.coordination import Coordinator
+from utils.rules import RULES_FILE, RulesEngine
+
+# --- COMANDOS ---
+def cmd_rebuild_totals(args):
+    """Recalcula el ranking global y, si se pide, los snapshots de ranking de cada servidor."""
+    users = Coordinator(args.db).refresh_global_ranking()
+    print(f"✅ Ranking global recalculado: {users} usuarios con puntos.")
+    con = ledger.connect(args.db)
+    try:
+        totals = con.execute(
+            "SELECT guild_id, COUNT(DISTINCT user_id), SUM(points), COUNT(*) FROM puntuaciones GROUP BY guild_id ORDER BY guild_id"
+        ).fetchall()
+        for guild_id, user_count, points, rows in totals:
+            print(f"   - Servidor {guild_id}: {user_count} usuarios, {points} puntos, {rows} filas")
+            if args.snapshots:
+                snapshot = {str(user_id): total for user_id, total in
+                            con.execute("SELECT user_id, SUM(points) FROM puntuaciones WHERE guild_id = ? GROUP BY user_id", (guild_id,))}
+                state.save_json(state.guild_path(guild_id, 'ranking_snapshot.json'), snapshot, durable=True)
+    finally:
+        con.close()
+    if args.snapshots:
+        print(f"✅ Snapshots de ranking reescritos para {len(totals)} servidores.")
+
+def cmd_verify(args):
+    """Compara el libro con los envíos juzgados y, con --repair, corrige las diferencias."""
+    report = verify.verify_ledger(args.guild or None, args.repair, args.db, args.chunk_size)
+    print(
+        f"Verificación terminada en {report['elapsed']:.1f} s: {report['submissions']} envíos de {report['guilds']} servidores, "
+        f"{report['drifted_submissions']} con diferencias ({report['drift_points']} puntos), "
+        f"{report['in_flight']} en curso, {report['unverifiable']} no verificables."
+    )
+    for guild_id, category, message_id, differences in report['details']:
+        for position, user_id, expected, actual in differences:
+            print(f"   - Servidor {guild_id} · {category} {message_id} · mención {position} (<@{user_id}>): esperado {expected}, libro {actual}")
+    if args.repair:
+        print(f"✅ Filas de reparación escritas: {report['repaired_rows']}")
+    # Código de salida 1 si quedan diferencias, para que cron pueda avisar.
+    return 1 if report['drifted_submissions'] and not args.repair else 0
+
+def cmd_compact(args):
+    """Pliega las filas antiguas del libro en checkpoints."""
+    report = ledger.compact_ledger(args.db, args.keep_days, not args.no_archive)
+    print(
+        f"✅ Compactación terminada (filas anteriores a {report['cutoff']}): {report['rows_folded']} filas plegadas, "
+        f"{report['rows_before']} -> {report['rows_after']} filas, {report['checkpoints']} checkpoints, "
+        f"{report['bytes_reusable'] / 1024:.1f} KiB reutilizables."
+    )
+
+def cmd_export(args):
+    """Exporta un conjunto de datos a CSV o JSONL (comprimido si la ruta acaba en .gz)."""
+    path = args.output or f"{args.dataset}.{args.format}.gz"
+    rows = export.export(args.dataset, path, args.format, args.guild, args.db, args.chunk_size)
+    print(f"✅ Exportadas {rows} filas de '{args.dataset}' a {path}")
+
+def cmd_import_json(args):
+    """Incorpora envíos desde un documento JSON o una exportación JSONL de envíos."""
+    report = export.import_json(args.path, args.guild, args.kind, args.state, args.overwrite)
+    print(f"✅ Importados {report['imported']} envíos en {report['files']} archivos ({report['skipped']} ya existían).")
+
+def cmd_rescore(args):
+    """Recalcula los envíos con otra versión de las reglas y escribe las filas compensatorias."""
+    def progress(guild_id, kind, done, total):
+        print(f"\r   - Servidor {guild_id} · {kind}: {done}/{total}", end='', flush=True)
+
+    report = rescore.rescore_files(RulesEngine(args.rules), args.guild or None, args.version, args.dry_run,
+                                   args.db, args.chunk_size, progress)
+    print()
+    print(
+        f"{'Simulación del recálculo' if args.dry_run else 'Recálculo'} con las reglas v{report['version']} terminado en "
+        f"{report['elapsed']:.1f} s: {report['submissions']} envíos de {report['guilds']} servidores, "
+        f"{report['repriced']} con puntos nuevos, {report['rows']} filas compensatorias ({report['delta_points']:+} puntos), "
+        f"{report['unscorable']} sin entradas de reglas."
+    )
+    for (guild_id, user_id), delta in sorted(report['users'].items(), key=lambda item: abs(item[1]), reverse=True)[:args.top]:
+        print(f"   - Servidor {guild_id} · <@{user_id}>: {delta:+}")
+
+def cmd_backup(args):
+    """Hace una copia de seguridad en caliente (o, con --list, lista las que hay)."""
+    if args.list:
+        for name in backup.list_backups(args.dir):
+            manifest = backup.read_manifest(name, args.dir)
+            size = sum(entry['bytes'] for entry in manifest['files'].values())
+            print(f"   - {name}: {len(manifest['files'])} archivos, {size / 1024 / 1024:.1f} MiB")
+        return
+    report = backup.create_backup(args.label, args.dir, args.keep)
+    print(
+        f"✅ Copia {report['name']} creada en {report['elapsed']:.1f} s: {report['databases']} bases, "
+        f"{report['files']} archivos JSON, {report['bytes'] / 1024 / 1024:.1f} MiB ({len(report['removed'])} copias antiguas borradas)."
+    )
+
+def cmd_restore(args):
+    """Verifica una copia y, si no se pide solo comprobarla, la restaura (con el bot apagado)."""
+    problems = backup.verify_backup(args.name, args.dir)
+    for problem in problems:
+        print(f"   - {problem}")
+    if problems:
+        print(f"❌ La copia {args.name} no pasa la verificación; no se ha restaurado nada.")
+        return 1
+    print(f"✅ La copia {args.name} está íntegra.")
+    if args.check_only:
+        return
+    # Un latido anterior a la marca de cierre limpio es de un proceso que ya se apagó.
+    marker = state.read_shutdown_marker()
+    live = [row for row in Coordinator(args.db).live_processes() if not (marker['clean'] and marker.get('at', 0) >= row[3])]
+    if live and not args.force:
+        print(f"❌ Hay {len(live)} procesos del bot con latido reciente ({', '.join(row[0] for row in live)}). "
+              "Apágalos antes de restaurar, o usa --force si ya no están en marcha.")
+        return 1
+    report = backup.restore_backup(args.name, args.dir)
+    print(f"✅ Restaurados {report['files']} archivos ({len(report['removed'])} JSON retirados). El estado anterior quedó en la copia {report['safety']}.")
+
+def cmd_benchmark(args):
+    """Ejecuta un escenario de benchmark.py con sus propias opciones."""
+    import benchmark
+    return benchmark.main(args.options)
+
+# --- PUNTO DE ENTRADA ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Administración del bot sin conexión a Discord.")
+    parser.add_argument('--db', default=ledger.DB_FILE, help="Base de datos del libro de puntos.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('rebuild-totals', help="Recalcula el ranking global (y los snapshots con --snapshots).")
+    p.add_argument('--snapshots', action='store_true', help="Reescribe también los snapshots de ranking de cada servidor.")
+    p.set_defaults(func=cmd_rebuild_totals)
+
+    p = sub.add_parser('verify', help="Compara el libro de puntos con los envíos juzgados.")
+    p.add_argument('--guild', type=int, action='append', help="Verifica solo este servidor (se puede repetir).")
+    p.add_argument('--repair', action='store_true', help="Escribe filas compensatorias para las diferencias.")
+    p.add_argument('--chunk-size', type=int, default=500)
+    p.set_defaults(func=cmd_verify)
+
+    p = sub.add_parser('compact', help="Compacta las filas antiguas del libro en checkpoints.")
+    p.add_argument('--keep-days', type=int, default=30)
+    p.add_argument('--no-archive', action='store_true', help="No guarda copia de las filas plegadas.")
+    p.set_defaults(func=cmd_compact)
+
+    p = sub.add_parser('export', help="Exporta el libro, los envíos o las temporadas archivadas.")
+    p.add_argument('dataset', choices=export.DATASETS)
+    p.add_argument('output', nargs='?', help="Archivo de salida (por defecto <datos>.<formato>.gz).")
+    p.add_argument('--format', choices=export.FORMATS, default='csv')
+    p.add_argument('--guild', type=int, help="Exporta solo este servidor.")
+    p.add_argument('--chunk-size', type=int, default=5000)
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('import-json', help="Importa envíos desde un JSON de estado o una exportación JSONL (con el bot apagado).")
+    p.add_argument('path')
+    p.add_argument('--guild', type=int, help="Servidor de destino (para JSONL, filtra las filas de ese servidor).")
+    p.add_argument('--kind', choices=list(export.PENDING_FILES), help="Tipo de envío del documento JSON.")
+    p.add_argument('--state', choices=['pending', 'judged'], default='judged', help="Si el documento JSON es de pendientes o juzgados.")
+    p.add_argument('--overwrite', action='store_true', help="Reemplaza los envíos que ya existen.")
+    p.set_defaults(func=cmd_import_json)
+
+    p = sub.add_parser('rescore', help="Recalcula los envíos con las reglas de puntuación actuales (con el bot apagado).")
+    p.add_argument('--guild', type=int, action='append', help="Recalcula solo este servidor (se puede repetir).")
+    p.add_argument('--version', type=int, help="Versión de las reglas (por defecto la de scoring_rules.json).")
+    p.add_argument('--rules', default=RULES_FILE, help="Archivo de reglas.")
+    p.add_argument('--dry-run', action='store_true', help="Solo muestra las diferencias, sin escribir nada.")
+    p.add_argument('--chunk-size', type=int, default=1000)
+    p.add_argument('--top', type=int, default=20, help="Usuarios con más cambio que se listan.")
+    p.set_defaults(func=cmd_rescore)
+
+    p = sub.add_parser('backup', help="Copia de seguridad en caliente del libro y del estado (se puede usar con el bot encendido).")
+    p.add_argument('--label', help="Sufijo del nombre de la copia.")
+    p.add_argument('--dir', default=backup.BACKUP_DIR, help="Carpeta de las copias.")
+    p.add_argument('--keep', type=int, default=backup.BACKUP_KEEP, help="Copias que se conservan.")
+    p.add_argument('--list', action='store_true', help="Lista las copias en vez de hacer una.")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser('restore', help="Verifica y restaura una copia de seguridad (con el bot apagado).")
+    p.add_argument('name', help="Nombre de la copia (ver `backup --list`).")
+    p.add_argument('--dir', default=backup.BACKUP_DIR, help="Carpeta de las copias.")
+    p.add_argument('--check-only', action='store_true', help="Solo verifica la copia.")
+    p.add_argument('--force', action='store_true', help="Restaura aunque haya latidos recientes del bot.")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser('benchmark', help="Ejecuta un escenario de benchmark.py (p. ej. `benchmark guilds --guilds 1 4`).")
+    p.add_argument('options', nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_benchmark)
+
+    args = parser.parse_args(argv)
+    # Migra la base al esquema actual, igual que hace el bot al arrancar.
+    ledger.initialize_database(args.db)
+    return args.func(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,13 +3,20 @@ import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 from datetime import datetime, timezone
+import asyncio
 import json
 import os
-import traceback
+import tempfile
+import logging
+from utils import backup, export, logs
+from utils.checks import bot_owner, has_admin_role, guild_admin
+from utils.rebuild import HistoryRebuild, REBUILD_CHECKPOINT_FILE
+from utils.rules import RulesError, season_rules
+from utils.state import GuildState
+
+log = logging.getLogger(__name__)
 
 # --- CONFIGURACIÓN ---
-ADMIN_ROLE_ID = int(os.getenv("ADMIN_ROLE_ID", 0))
-KOTH_CHANNEL_ID = int(os.getenv("KOTH_CHANNEL_ID", 0))
 TEST_GUILD_ID = int(os.getenv("TEST_GUILD_ID", 0))
 STATUS_FILE = 'bot_status.json'
 
@@ -30,19 +37,31 @@ class Admin(commands.Cog):
         self.bot = bot
         
         # --- REGISTRO DEL COMANDO DE MENÚ CONTEXTUAL ---
-        # Este comando aparece al hacer clic derecho en un mensaje.
+        # Este comando aparece al hacer clic derecho en un mensaje. Se registra de forma global
+        # para que esté disponible en todos los servidores (bot.py lo copia al de pruebas).
         self.process_manually_ctx_menu = app_commands.ContextMenu(
             name='Procesar Envío Manualmente',
             callback=self.process_manually_callback,
         )
-        self.bot.tree.add_command(self.process_manually_ctx_menu, guild=discord.Object(id=TEST_GUILD_ID))
+        self.bot.tree.add_command(self.process_manually_ctx_menu)
+
+        # Avance de /rebuild por servidor y reconstrucciones en curso (una por servidor).
+        self.rebuild_checkpoints = GuildState(REBUILD_CHECKPOINT_FILE)
+        self.rebuilds = {}
         
         self.update_last_online_time.start()
+        if backup.BACKUP_INTERVAL_HOURS > 0:
+            self.backup_task.change_interval(hours=backup.BACKUP_INTERVAL_HOURS)
+            self.backup_task.start()
 
     def cog_unload(self):
         """Función de limpieza que se ejecuta si el cog se descarga."""
-        self.bot.tree.remove_command(self.process_manually_ctx_menu.name, type=self.process_manually_ctx_menu.type, guild=discord.Object(id=TEST_GUILD_ID))
+        self.bot.tree.remove_command(self.process_manually_ctx_menu.name, type=self.process_manually_ctx_menu.type)
         self.update_last_online_time.cancel()
+        self.backup_task.cancel()
+        # El punto de control ya está guardado: la reconstrucción se reanuda con el siguiente /rebuild.
+        for task in self.rebuilds.values():
+            task.cancel()
 
     @tasks.loop(minutes=5.0)
     async def update_last_online_time(self):
@@ -52,9 +71,22 @@ class Admin(commands.Cog):
         status['last_online'] = datetime.now(timezone.utc).isoformat()
         save_status(status)
 
+    @tasks.loop(hours=6)
+    async def backup_task(self):
+        """Copia de seguridad periódica del libro de puntos y del estado de los envíos, en un hilo aparte."""
+        await self.bot.wait_until_ready()
+        # Los archivos son compartidos: si hay varios procesos, solo copia el que tenga el arrendamiento
+        # (y un reinicio no repite la copia que se acaba de hacer).
+        if not await asyncio.to_thread(self.bot.coordinator.try_acquire, 'backup', backup.BACKUP_INTERVAL_HOURS * 3600 * 0.9):
+            return
+        try:
+            await asyncio.to_thread(backup.create_backup)
+        except Exception as e:
+            log.exception("Error al crear la copia de seguridad: %s", e)
+
     # --- COMANDOS SLASH ---
     @app_commands.command(name="scan_offline", description="Escanea canales en busca de envíos hechos mientras el bot estaba desconectado.")
-    @app_commands.checks.has_role(ADMIN_ROLE_ID)
+    @guild_admin()
     async def scan_offline_submissions(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True, thinking=True)
         status = load_status()
@@ -67,7 +99,8 @@ class Admin(commands.Cog):
         scan_report = []
 
         # Mapeo de nombres de Cog a identificadores de canal.
-        cogs_to_scan = {'Ataque': 'attack-', 'Defensa': 'defenses-', 'Koth': KOTH_CHANNEL_ID, 'Tempo': 'tempo-', 'Interserver': 'interserver-'}
+        koth_channel_id = self.bot.guild_config.get(interaction.guild_id)['koth_channel_id']
+        cogs_to_scan = {'Ataque': 'attack-', 'Defensa': 'defenses-', 'Koth': koth_channel_id, 'Tempo': 'tempo-', 'Interserver': 'interserver-'}
 
         for cog_name, identifier in cogs_to_scan.items():
             cog = self.bot.get_cog(cog_name)
@@ -88,7 +121,7 @@ class Admin(commands.Cog):
                                         processed_count += 1
                                         found_in_channel += 1
                                 except Exception as e:
-                                    print(f"Error al procesar mensaje {message.id} en {cog_name}: {e}")
+                                    log.exception("Error al procesar mensaje %s en %s: %s", message.id, cog_name, e, extra={'guild_id': interaction.guild_id, 'message_id': message.id})
                         
                         if found_in_channel > 0:
                             scan_report.append(f"Canal `#{channel.name}`: {found_in_channel} envíos encontrados.")
@@ -101,20 +134,208 @@ class Admin(commands.Cog):
         save_status(status)
         await interaction.followup.send(f"✅ **Escaneo completado.**\nSe procesaron **{processed_count}** nuevos envíos.\n\n**Reporte:**\n- " + "\n- ".join(scan_report if scan_report else ["No se encontraron nuevos envíos."]))
 
+    @app_commands.command(name="rebuild", description="Reconstruye los envíos pendientes y juzgados desde el historial de los canales.")
+    @app_commands.describe(desde_cero="Ignora el avance guardado de una reconstrucción anterior y vuelve a recorrer todo el historial.")
+    @guild_admin()
+    async def rebuild_state(self, interaction: discord.Interaction, desde_cero: bool = False):
+        if interaction.guild_id in self.rebuilds:
+            return await interaction.response.send_message("⏳ Ya hay una reconstrucción en curso en este servidor.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        job = HistoryRebuild(self.bot, interaction.guild, self.rebuild_checkpoints, restart=desde_cero)
+        last_update = 0.0
+
+        async def progress(report):
+            # Se edita el mensaje como mucho cada 2 segundos para no chocar con los límites de Discord.
+            nonlocal last_update
+            now = asyncio.get_running_loop().time()
+            if now - last_update >= 2:
+                last_update = now
+                try:
+                    await interaction.edit_original_response(
+                        content=f"⏳ Reconstruyendo... {report['messages']} mensajes leídos, {report['submissions']} envíos, {report['channels']} canales terminados."
+                    )
+                except discord.HTTPException:
+                    pass # El token de la interacción caduca a los 15 minutos; el resumen irá al canal de logs.
+
+        # La tarea sigue aunque falle la interacción y se cancela si se descarga el cog.
+        task = self.rebuilds[interaction.guild_id] = asyncio.create_task(job.run(progress))
+        try:
+            report = await task
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception("Error al reconstruir el servidor %s", interaction.guild_id, extra={'guild_id': interaction.guild_id})
+            return await self._rebuild_summary(interaction, f"❌ La reconstrucción se detuvo: {e}\nEl avance está guardado; vuelve a usar `/rebuild` para continuar.")
+        finally:
+            self.rebuilds.pop(interaction.guild_id, None)
+
+        lines = [
+            f"✅ **Reconstrucción {'reanudada y ' if job.resumed else ''}completada** ({report['elapsed']:.1f} s)",
+            f"- Mensajes leídos: **{report['messages']}** en {report['channels']} canales",
+            f"- Envíos encontrados: **{report['submissions']}** ({report['existing']} ya estaban guardados)",
+            f"- Recuperados: **{report['pending']}** pendientes, **{report['approved']}** aprobados, **{report['denied']}** rechazados",
+            f"- Con ✅ y ❌ a la vez (quedan pendientes): **{report['conflicts']}**",
+            f"- Filas escritas para aprobados sin puntos: **{report['awarded_rows']}**; filas de reparación: **{report['repaired_rows']}**",
+        ]
+        if report['legacy']:
+            lines.append(f"- Aprobados anteriores a las claves del libro (no se repagan): **{report['legacy']}**")
+        if report['forbidden']:
+            lines.append(f"- Sin permisos para leer: {', '.join(f'`#{name}`' for name in report['forbidden'])}")
+        await self._rebuild_summary(interaction, "\n".join(lines))
+
+    async def _rebuild_summary(self, interaction: discord.Interaction, content: str):
+        """Deja el resumen en la respuesta y en el canal de logs (la respuesta ya no se puede editar si pasaron 15 minutos)."""
+        try:
+            await interaction.edit_original_response(content=content[:2000])
+        except discord.HTTPException:
+            pass
+        log_channel = self.bot.get_channel(self.bot.guild_config.get(interaction.guild_id)['audit_channel_id'])
+        if log_channel:
+            await log_channel.send(f"🧱 {interaction.user.mention} ejecutó `/rebuild`:\n{content}"[:2000])
+
+    @app_commands.command(name="backup", description="Hace ahora una copia de seguridad del libro de puntos y del estado.")
+    @bot_owner()
+    async def backup_now(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            report = await asyncio.to_thread(backup.create_backup, 'manual')
+        except Exception as e:
+            log.exception("Error al crear la copia de seguridad manual: %s", e)
+            return await interaction.followup.send(f"❌ No se pudo crear la copia: {e}")
+        names = backup.list_backups()
+        await interaction.followup.send(
+            f"✅ Copia `{report['name']}` creada en {report['elapsed']:.1f} s: {report['databases']} bases y {report['files']} archivos JSON "
+            f"({report['bytes'] / 1024 / 1024:.1f} MiB).\n"
+            f"Se conservan **{len(names)}** copias (la más antigua: `{names[0]}`)."
+            + (f" Se borraron {len(report['removed'])} antiguas." if report['removed'] else "")
+            + f"\nPara restaurarla, con el bot apagado: `python cli.py restore {report['name']}`"
+        )
+
     @app_commands.command(name="sync", description="Sincroniza manualmente los comandos de barra con Discord.")
     @commands.is_owner() # CORRECCIÓN FINAL: El decorador correcto es de `commands`, no de `app_commands`.
     async def sync_commands(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         try:
             guild_obj = discord.Object(id=TEST_GUILD_ID) if TEST_GUILD_ID != 0 else None
+            if guild_obj:
+                self.bot.tree.copy_global_to(guild=guild_obj)
             synced = await self.bot.tree.sync(guild=guild_obj)
             await interaction.followup.send(f"✅ Sincronizados {len(synced)} comandos.")
         except Exception as e:
             await interaction.followup.send(f"❌ Error al sincronizar: {e}")
 
+    @app_commands.command(name="config", description="Configura los roles y canales del bot para este servidor.")
+    @app_commands.describe(
+        rol_admin="Rol que puede aprobar envíos y usar los comandos de administración.",
+        canal_logs="Canal donde se registran las decisiones.",
+        canal_koth="Canal de los eventos KOTH.",
+        canal_anuncios="Canal para los anuncios de fin de temporada."
+    )
+    @app_commands.checks.has_permissions(administrator=True)
+    async def configure_guild(self, interaction: discord.Interaction, rol_admin: discord.Role = None, canal_logs: discord.TextChannel = None,
+                              canal_koth: discord.TextChannel = None, canal_anuncios: discord.TextChannel = None):
+        values = {
+            'admin_role_id': rol_admin.id if rol_admin else None,
+            'audit_channel_id': canal_logs.id if canal_logs else None,
+            'koth_channel_id': canal_koth.id if canal_koth else None,
+            'announcement_channel_id': canal_anuncios.id if canal_anuncios else None,
+        }
+        values = {field: value for field, value in values.items() if value is not None}
+        config = self.bot.guild_config.set(interaction.guild_id, **values) if values else self.bot.guild_config.get(interaction.guild_id)
+
+        embed = discord.Embed(title="⚙️ Configuración del Servidor", color=discord.Color.blue())
+        embed.add_field(name="Rol de administrador", value=f"<@&{config['admin_role_id']}>" if config['admin_role_id'] else "—", inline=False)
+        embed.add_field(name="Canal de logs", value=f"<#{config['audit_channel_id']}>" if config['audit_channel_id'] else "—", inline=False)
+        embed.add_field(name="Canal de KOTH", value=f"<#{config['koth_channel_id']}>" if config['koth_channel_id'] else "—", inline=False)
+        embed.add_field(name="Canal de anuncios", value=f"<#{config['announcement_channel_id']}>" if config['announcement_channel_id'] else "—", inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="export", description="Exporta los datos de este servidor en un archivo comprimido.")
+    @app_commands.describe(datos="Qué datos exportar.", formato="Formato de las filas.")
+    @app_commands.choices(
+        datos=[app_commands.Choice(name="Libro de puntos", value="ledger"),
+               app_commands.Choice(name="Filas compactadas (auditoría)", value="ledger-archive"),
+               app_commands.Choice(name="Envíos", value="submissions"),
+               app_commands.Choice(name="Temporadas archivadas", value="seasons")],
+        formato=[app_commands.Choice(name="CSV", value="csv"), app_commands.Choice(name="JSONL", value="jsonl")]
+    )
+    @guild_admin()
+    async def export_data(self, interaction: discord.Interaction, datos: app_commands.Choice[str], formato: app_commands.Choice[str] = None):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        fmt = formato.value if formato else 'csv'
+        filename = f"{datos.value}-{interaction.guild_id}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{fmt}.gz"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, filename)
+            # La exportación lee y comprime por bloques en un hilo aparte.
+            rows = await asyncio.to_thread(export.export, datos.value, path, fmt, interaction.guild_id)
+            size = os.path.getsize(path)
+            if size > interaction.guild.filesize_limit:
+                return await interaction.followup.send(
+                    f"❌ La exportación ocupa {size / 1024 / 1024:.1f} MiB y supera el límite de archivos del servidor. "
+                    f"Usa `python cli.py export {datos.value} --guild {interaction.guild_id}` en la máquina del bot."
+                )
+            await interaction.followup.send(f"✅ Exportadas **{rows}** filas ({size / 1024:.1f} KiB).", file=discord.File(path, filename=filename))
+
+    @app_commands.command(name="rules", description="Muestra la versión de las reglas de puntuación o las recarga.")
+    @app_commands.describe(recargar="Vuelve a leer scoring_rules.json (solo el dueño del bot).")
+    @guild_admin()
+    async def show_rules(self, interaction: discord.Interaction, recargar: bool = False):
+        # Las reglas son comunes a todos los servidores, así que solo el dueño del bot puede recargarlas.
+        if recargar:
+            if not await self.bot.is_owner(interaction.user):
+                return await interaction.response.send_message("❌ Solo el dueño del bot puede recargar las reglas.", ephemeral=True)
+            previous = self.bot.rules.version
+            try:
+                version = self.bot.rules.reload()
+            except RulesError as e:
+                return await interaction.response.send_message(f"❌ No se cargaron las reglas nuevas (sigue activa la versión {previous}): {e}", ephemeral=True)
+            log.info("Reglas de puntuación recargadas por %s: versión %s -> %s", interaction.user, previous, version, extra={'user_id': interaction.user.id})
+            return await interaction.response.send_message(f"✅ Reglas recargadas: versión **{previous}** -> **{version}**.", ephemeral=True)
+
+        rules = season_rules(self.bot, interaction.guild_id)
+        season = f" con las modificaciones de la temporada {rules.season_number}" if rules.season_number else ""
+        bonuses = ", ".join(f"{emoji} x{factor:g}" for emoji, factor in rules.multipliers.get('defensa', {}).items()) or "ninguno"
+        await interaction.response.send_message(
+            f"📐 Reglas de puntuación: versión **{rules.version}**{season}.\nBonos de defensa: {bonuses}.", ephemeral=True
+        )
+
+    @app_commands.command(name="cache", description="Muestra las cachés de envíos juzgados y las colas del bus de eventos y del registro.")
+    @guild_admin()
+    async def show_cache(self, interaction: discord.Interaction):
+        # Las cachés son de todo el bot (no por servidor): las cifras incluyen a los demás servidores del shard.
+        reacciones = self.bot.get_cog('Reacciones')
+        sources = reacciones.submission_sources() if reacciones else {}
+        lines = []
+        for kind, (_, judged) in sources.items():
+            stats = judged.stats()
+            lines.append(
+                f"- **{kind}**: {stats['resident']}/{stats['capacity']} en memoria, "
+                f"{stats['hit_rate']:.1%} de aciertos ({stats['hits']} en memoria, {stats['misses']} de disco)."
+            )
+        if not lines:
+            return await interaction.response.send_message("ℹ️ No hay ningún cog de envíos cargado.", ephemeral=True)
+        # Las colas del bus de eventos: si un suscriptor pierde eventos, va demasiado lento.
+        # Los que agregan (auditoría, métricas) no pierden ninguno: agrupan los eventos en resúmenes.
+        subscribers = [
+            f"- **{stats['name']}**: {stats['coalesced']} eventos en {stats['delivered']} resúmenes, {stats['queued']} pendientes, {stats['failed']} con error."
+            if 'coalesced' in stats else
+            f"- **{stats['name']}**: {stats['delivered']} entregados, {stats['queued']} en cola, {stats['dropped']} descartados, {stats['failed']} con error."
+            for stats in self.bot.events.stats()
+        ]
+        message = "🗄️ Envíos juzgados en memoria:\n" + "\n".join(lines)
+        if subscribers:
+            message += f"\n\n📨 Bus de eventos ({self.bot.events.published} publicados):\n" + "\n".join(subscribers)
+        log_stats = logs.stats()
+        message += f"\n\n📝 Registro: {log_stats['queued']} en cola, {log_stats['dropped']} descartados por cola llena."
+        if self.bot.metrics.totals:
+            message += "\n\n📈 Métricas desde el arranque: " + ", ".join(f"`{name}` {value}" for name, value in sorted(self.bot.metrics.totals.items()))
+        if len(message) > 2000:  # Límite de Discord por mensaje.
+            message = message[:1997] + "..."
+        await interaction.response.send_message(message, ephemeral=True)
+
     # --- FUNCIÓN CALLBACK PARA EL MENÚ DE CONTEXTO ---
     async def process_manually_callback(self, interaction: discord.Interaction, message: discord.Message):
-        if not any(role.id == ADMIN_ROLE_ID for role in interaction.user.roles):
+        if not has_admin_role(self.bot, interaction.guild_id, interaction.user):
             return await interaction.response.send_message("❌ No tienes el rol de administrador necesario.", ephemeral=True)
         
         await interaction.response.defer(ephemeral=True, thinking=True)
@@ -126,7 +347,7 @@ class Admin(commands.Cog):
         elif channel_name.startswith('defenses-'): target_cog_name = 'Defensa'
         elif channel_name.startswith('tempo-'): target_cog_name = 'Tempo'
         elif channel_name.startswith('interserver-'): target_cog_name = 'Interserver'
-        elif message.channel.id == KOTH_CHANNEL_ID: target_cog_name = 'Koth'
+        elif message.channel.id == self.bot.guild_config.get(interaction.guild_id)['koth_channel_id']: target_cog_name = 'Koth'
         
         if not target_cog_name:
             return await interaction.followup.send("❌ Este comando solo se puede usar en un canal de evento válido.")
@@ -144,15 +365,15 @@ class Admin(commands.Cog):
     # --- Manejador de errores ---
     async def cog_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
         # CORRECCIÓN: Añadido `commands.NotOwner` para manejar el error del decorador.
-        if isinstance(error, (app_commands.MissingRole, commands.NotOwner)):
+        if isinstance(error, (app_commands.CheckFailure, commands.NotOwner)):
             await interaction.response.send_message("❌ No tienes los permisos necesarios para esta acción.", ephemeral=True)
         else:
             if not interaction.response.is_done():
                 await interaction.response.send_message("Ocurrió un error inesperado.", ephemeral=True)
             else:
                 await interaction.followup.send("Ocurrió un error inesperado.", ephemeral=True)
-            print(f"Error en un comando de Admin por {interaction.user}: {error}")
-            traceback.print_exc()
+            log.error("Error en un comando de Admin por %s: %s", interaction.user, error, exc_info=error,
+                      extra={'guild_id': interaction.guild_id, 'user_id': interaction.user.id})
 
 async def setup(bot):
     await bot.add_cog(Admin(bot))
@@ -0,0 +1,96 @@
+# cogs/auditoria.py
+import discord
+from discord.ext import commands, tasks
+from collections import Counter
+import os
+import logging
+from utils.events import PointsChanged, SubmissionJudged
+
+log = logging.getLogger(__name__)
+
+# --- CONFIGURACIÓN ---
+# Minutos entre dos resúmenes de moderación en el canal de auditoría (0 los desactiva).
+AUDIT_DIGEST_MINUTES = float(os.getenv("AUDIT_DIGEST_MINUTES", 60))
+# Moderadores que aparecen en cada resumen, los más activos primero.
+AUDIT_DIGEST_TOP = 20
+STATUS_LABELS = {'approved': ('✅', 'aprobados'), 'denied': ('❌', 'rechazados'), 'reverted': ('🔄', 'revertidos')}
+
+class Auditoria(commands.Cog):
+    """
+    Resumen periódico de la moderación en el canal de auditoría: envíos aprobados, rechazados y
+    revertidos (en total y por moderador) y puntos escritos en el libro desde el resumen anterior.
+
+    Se alimenta del bus de eventos con una suscripción sin pérdidas: los eventos se suman en un
+    resumen mientras el cog procesa el anterior, así que las cifras cuadran aunque haya ráfagas.
+    """
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        # Servidor -> contadores desde el último resumen publicado.
+        self.digests = {}
+        self.subscription = None
+
+    async def cog_load(self):
+        if AUDIT_DIGEST_MINUTES <= 0:
+            return
+        self.subscription = self.bot.events.subscribe((SubmissionJudged, PointsChanged), self.on_summary, 'auditoría', fold=self.fold)
+        self.digest_task.change_interval(minutes=AUDIT_DIGEST_MINUTES)
+        self.digest_task.start()
+
+    async def cog_unload(self):
+        self.digest_task.cancel()
+        if self.subscription:
+            self.bot.events.unsubscribe(self.subscription)
+
+    # --- AGREGACIÓN ---
+    @staticmethod
+    def fold(summary: Counter, event):
+        if isinstance(event, SubmissionJudged):
+            summary[(event.guild_id, 'status', event.status)] += 1
+            summary[(event.guild_id, 'moderator', event.moderator_id, event.status)] += 1
+        elif event.reason != 'season':
+            # El cambio de temporada archiva filas, no escribe puntos nuevos.
+            summary[(event.guild_id, 'writes')] += 1
+            summary[(event.guild_id, 'points')] += sum(points for _, points in event.rows)
+
+    def on_summary(self, summary: Counter):
+        for (guild_id, *key), value in summary.items():
+            self.digests.setdefault(guild_id, Counter())[tuple(key)] += value
+
+    # --- PUBLICACIÓN ---
+    @tasks.loop(minutes=60)
+    async def digest_task(self):
+        """Publica el resumen de cada servidor con actividad desde el anterior."""
+        await self.bot.wait_until_ready()
+        digests, self.digests = self.digests, {}
+        for guild_id, counts in digests.items():
+            await self.post_digest(guild_id, counts)
+
+    def format_digest(self, counts: Counter) -> str:
+        verdicts = [f"{counts[('status', status)]} {label}" for status, (_, label) in STATUS_LABELS.items() if counts[('status', status)]]
+        lines = [
+            f"📊 **Resumen de moderación** (últimos {AUDIT_DIGEST_MINUTES:g} min): {', '.join(verdicts) or 'ningún veredicto'}"
+            f" · **{counts[('points',)]}** puntos en {counts[('writes',)]} escrituras del libro."
+        ]
+        moderators = {}
+        for key, value in counts.items():
+            if key[0] == 'moderator':
+                moderators.setdefault(key[1], Counter())[key[2]] += value
+        ranked = sorted(moderators.items(), key=lambda item: -sum(item[1].values()))
+        for moderator_id, by_status in ranked[:AUDIT_DIGEST_TOP]:
+            who = f"<@{moderator_id}>" if moderator_id else "Sin moderador"
+            lines.append(f"> {who}: " + ", ".join(f"{by_status[status]} {emoji}" for status, (emoji, _) in STATUS_LABELS.items() if by_status[status]))
+        if len(ranked) > AUDIT_DIGEST_TOP:
+            lines.append(f"> ... y {len(ranked) - AUDIT_DIGEST_TOP} moderadores más.")
+        return "\n".join(lines)
+
+    async def post_digest(self, guild_id: int, counts: Counter):
+        log_channel = self.bot.get_channel(self.bot.guild_config.get(guild_id)['audit_channel_id'])
+        if not log_channel: return
+        try:
+            # Sin menciones: el resumen no debe avisar a cada moderador cada hora.
+            await log_channel.send(self.format_digest(counts), allowed_mentions=discord.AllowedMentions.none())
+        except discord.HTTPException as e:
+            log.warning("No se pudo publicar el resumen de moderación: %s", e, extra={'guild_id': guild_id})
+
+async def setup(bot):
+    await bot.add_cog(Auditoria(bot))
@@ -2,13 +2,13 @@
 import discord
 from discord.ext import commands
 import re
-import os
-import json
-import traceback
+import logging
+from utils.state import GuildState
+from utils.judged import JudgedStore
+from utils.checks import has_admin_role
+from utils.rules import season_rules, record
 
-# --- CONFIGURACIÓN ---
-ADMIN_ROLE_ID = int(os.getenv("ADMIN_ROLE_ID"))
-BOT_AUDIT_LOGS_CHANNEL_ID = int(os.getenv("BOT_AUDIT_LOGS_CHANNEL_ID"))
+log = logging.getLogger(__name__)
 
 # --- Emojis y Archivos de Datos ---
 PENDING_EMOJI = '📝'
@@ -17,49 +17,49 @@ DENY_EMOJI = '❌'
 PENDING_INTERSERVER_FILE = 'pending_interserver.json'
 JUDGED_INTERSERVER_FILE = 'judged_interserver.json'
 
-# --- Puntos para Interserver ---
-INTERSERVER_POINTS = {
-    "tempo-no_def-v1": 2,
-    "koth-v2-v3": 10,
-    "v4-v5": 30,
-}
-
 class Interserver(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.pending_interserver = self.load_data(PENDING_INTERSERVER_FILE)
-        self.judged_interserver = self.load_data(JUDGED_INTERSERVER_FILE)
-
-    def load_data(self, filename):
-        try:
-            with open(filename, 'r') as f: return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError): return {}
+        # Estado particionado por servidor (data/<guild_id>/...).
+        self.pending_interserver = GuildState(PENDING_INTERSERVER_FILE, legacy_file=PENDING_INTERSERVER_FILE)
+        self.judged_interserver = JudgedStore(JUDGED_INTERSERVER_FILE, legacy_file=JUDGED_INTERSERVER_FILE)
 
-    def save_data(self, data, filename):
-        with open(filename, 'w') as f: json.dump(data, f, indent=4)
-
-    @commands.Cog.listener()
-    async def on_message(self, message):
-        if message.author.bot or not message.channel.name.lower().startswith('interserver-'): return
+    def build_submission(self, message):
+        """El envío interserver del mensaje, o None si no es válido o su clave no da puntos."""
         all_mentions_in_text = re.findall(r'<@!?(\d+)>', message.content)
-        if not message.attachments or not all_mentions_in_text or not any(att.content_type.startswith('image/') for att in message.attachments): return
+        if not message.attachments or not all_mentions_in_text or not any(att.content_type.startswith('image/') for att in message.attachments): return None
 
         channel_name_lower = message.channel.name.lower()
         key_part = channel_name_lower.split('interserver-', 1)[1]
-        if key_part not in INTERSERVER_POINTS: return
-        
-        points_to_award = INTERSERVER_POINTS[key_part]
-        if points_to_award == 0: return
-
-        self.pending_interserver[str(message.id)] = {'points': points_to_award, 'allies': all_mentions_in_text}
-        self.save_data(self.pending_interserver, PENDING_INTERSERVER_FILE)
+        # Los puntos salen de la tabla 'interserver' de las reglas activas (scoring_rules.json).
+        rules = season_rules(self.bot, message.guild.id)
+        inputs = {'key': key_part}
+        points_to_award = rules.base_points('interserver', inputs)
+        if not points_to_award: return None
+        return record({'points': points_to_award, 'allies': all_mentions_in_text, 'channel_id': message.channel.id}, rules, inputs)
+
+    async def process_submission(self, message) -> bool:
+        """Registra el envío como pendiente. La usan on_message y /scan_offline."""
+        if any(reaction.me for reaction in message.reactions): return False
+        submission = self.build_submission(message)
+        if submission is None: return False
+        self.pending_interserver.get(message.guild.id)[str(message.id)] = submission
+        self.pending_interserver.save(message.guild.id)
         await message.add_reaction(PENDING_EMOJI)
+        return True
 
     @commands.Cog.listener()
-    async def on_raw_reaction_add(self, payload):
+    async def on_message(self, message):
+        if message.author.bot or not message.channel.name.lower().startswith('interserver-'): return
+        await self.process_submission(message)
+
+    # La llama el cog Reacciones solo para los mensajes que son envíos de este cog.
+    async def handle_reaction_add(self, payload):
         message_id_str = str(payload.message_id)
-        if payload.member.bot or not any(role.id == ADMIN_ROLE_ID for role in payload.member.roles): return
-        if message_id_str not in self.pending_interserver and message_id_str not in self.judged_interserver: return
+        if payload.member.bot or not has_admin_role(self.bot, payload.guild_id, payload.member): return
+        pending_interserver = self.pending_interserver.get(payload.guild_id)
+        judged_interserver = self.judged_interserver.get(payload.guild_id)
+        if message_id_str not in pending_interserver and message_id_str not in judged_interserver: return
         
         emoji = str(payload.emoji)
         if emoji not in [APPROVE_EMOJI, DENY_EMOJI]: return
@@ -75,77 +75,83 @@ class Interserver(commands.Cog):
                         async for user in reaction.users():
                             if not user.bot: await original_message.remove_reaction(opposite_emoji, user)
                         break
-            except Exception as e: print(f"No se pudieron limpiar las reacciones opuestas: {e}")
+            except Exception as e: log.warning("No se pudieron limpiar las reacciones opuestas: %s", e, extra={'guild_id': payload.guild_id, 'message_id': payload.message_id})
 
         puntos_cog = self.bot.get_cog('Puntos')
 
-        if message_id_str in self.pending_interserver:
-            submission = self.pending_interserver.pop(message_id_str)
-            self.save_data(self.pending_interserver, PENDING_INTERSERVER_FILE)
+        if message_id_str in pending_interserver:
+            submission = pending_interserver[message_id_str]
+            # Primero los puntos: si la escritura falla, la excepción deja el envío en pendientes.
+            if emoji == APPROVE_EMOJI and puntos_cog:
+                await puntos_cog.award_submission(payload, submission, submission['points'], 'interserver')
+            pending_interserver.pop(message_id_str)
+            self.pending_interserver.save(payload.guild_id)
             if emoji == APPROVE_EMOJI:
-                if puntos_cog:
-                    for user_id in submission['allies']:
-                        await puntos_cog.add_points(payload, user_id, submission['points'], 'interserver')
                 submission['status'] = 'approved'
-                self.judged_interserver[message_id_str] = submission
-                self.save_data(self.judged_interserver, JUDGED_INTERSERVER_FILE)
+                judged_interserver[message_id_str] = submission
+                self.judged_interserver.save(payload.guild_id)
                 await self.send_log_message(payload, submission, "Interserver", "aprobado")
             elif emoji == DENY_EMOJI:
                 submission['status'] = 'denied'
-                self.judged_interserver[message_id_str] = submission
-                self.save_data(self.judged_interserver, JUDGED_INTERSERVER_FILE)
+                judged_interserver[message_id_str] = submission
+                self.judged_interserver.save(payload.guild_id)
                 await self.send_log_message(payload, submission, "Interserver", "rechazado")
         
-        elif message_id_str in self.judged_interserver:
-            submission = self.judged_interserver[message_id_str]
+        elif message_id_str in judged_interserver:
+            submission = judged_interserver[message_id_str]
             old_status = submission['status']
             if emoji == APPROVE_EMOJI and old_status == 'denied':
                 if puntos_cog:
-                    for user_id in submission['allies']: await puntos_cog.add_points(payload, user_id, submission['points'], 'interserver')
+                    await puntos_cog.award_submission(payload, submission, submission['points'], 'interserver')
                 submission['status'] = 'approved'
-                self.judged_interserver[message_id_str] = submission
-                self.save_data(self.judged_interserver, JUDGED_INTERSERVER_FILE)
+                judged_interserver[message_id_str] = submission
+                self.judged_interserver.save(payload.guild_id)
                 await self.log_decision_change(payload, "Interserver", "APROBADO")
             elif emoji == DENY_EMOJI and old_status == 'approved':
                 if puntos_cog:
-                    for user_id in submission['allies']: await puntos_cog.add_points(payload, user_id, -submission['points'], 'interserver')
+                    await puntos_cog.award_submission(payload, submission, -submission['points'], 'interserver')
                 submission['status'] = 'denied'
-                self.judged_interserver[message_id_str] = submission
-                self.save_data(self.judged_interserver, JUDGED_INTERSERVER_FILE)
+                judged_interserver[message_id_str] = submission
+                self.judged_interserver.save(payload.guild_id)
                 await self.log_decision_change(payload, "Interserver", "RECHAZADO")
 
-    @commands.Cog.listener()
-    async def on_raw_reaction_remove(self, payload):
+    # La llama el cog Reacciones solo para los mensajes que son envíos de este cog.
+    async def handle_reaction_remove(self, payload):
         message_id_str = str(payload.message_id)
         guild = self.bot.get_guild(payload.guild_id)
         if not guild: return
+        judged_interserver = self.judged_interserver.get(payload.guild_id)
+        if message_id_str not in judged_interserver: return
+
+        # Al quitar una reacción Discord no manda el miembro; sin caché de miembros (LEAN_GATEWAY) se pide a la API.
         member = guild.get_member(payload.user_id)
-        if not member or member.bot: return
-        
-        self.judged_interserver = self.load_data(JUDGED_INTERSERVER_FILE)
-        if message_id_str not in self.judged_interserver: return
-        if not any(role.id == ADMIN_ROLE_ID for role in member.roles): return
+        if member is None:
+            try:
+                member = await guild.fetch_member(payload.user_id)
+            except discord.HTTPException:
+                return
+        if member.bot: return
+        if not has_admin_role(self.bot, payload.guild_id, member): return
 
-        submission = self.judged_interserver[message_id_str]
+        submission = judged_interserver[message_id_str]
         emoji = str(payload.emoji)
         
         if emoji == APPROVE_EMOJI and submission['status'] == 'approved':
             puntos_cog = self.bot.get_cog('Puntos')
             if puntos_cog:
-                for user_id_str in submission['allies']:
-                    await puntos_cog.add_points(payload, user_id_str, -submission['points'], 'interserver')
-            del self.judged_interserver[message_id_str]
-            self.save_data(self.judged_interserver, JUDGED_INTERSERVER_FILE)
-            log_channel = self.bot.get_channel(BOT_AUDIT_LOGS_CHANNEL_ID)
+                await puntos_cog.award_submission(payload, submission, -submission['points'], 'interserver')
+            del judged_interserver[message_id_str]
+            self.judged_interserver.save(payload.guild_id)
+            log_channel = self.bot.get_channel(self.bot.guild_config.get(payload.guild_id)['audit_channel_id'])
             if log_channel: await log_channel.send(f"🔄 Aprobación de **Interserver** revertida por {member.mention}.")
         elif emoji == DENY_EMOJI and submission['status'] == 'denied':
-            del self.judged_interserver[message_id_str]
-            self.save_data(self.judged_interserver, JUDGED_INTERSERVER_FILE)
-            log_channel = self.bot.get_channel(BOT_AUDIT_LOGS_CHANNEL_ID)
+            del judged_interserver[message_id_str]
+            self.judged_interserver.save(payload.guild_id)
+            log_channel = self.bot.get_channel(self.bot.guild_config.get(payload.guild_id)['audit_channel_id'])
             if log_channel: await log_channel.send(f"🔄 Rechazo de **Interserver** revertido por {member.mention}.")
 
     async def send_log_message(self, payload, submission, type_str, action_str):
-        log_channel = self.bot.get_channel(BOT_AUDIT_LOGS_CHANNEL_ID)
+        log_channel = self.bot.get_channel(self.bot.guild_config.get(payload.guild_id)['audit_channel_id'])
         if not log_channel: return
         event_name = "General"
         original_channel = self.bot.get_channel(payload.channel_id)
@@ -159,7 +165,7 @@ class Interserver(commands.Cog):
             await log_channel.send(f"{DENY_EMOJI} **{type_str} ({event_name})** {action_str} por {payload.member.mention}. [Ir al envío]({message_link})")
 
     async def log_decision_change(self, payload, type_str, new_status_str):
-        log_channel = self.bot.get_channel(BOT_AUDIT_LOGS_CHANNEL_ID)
+        log_channel = self.bot.get_channel(self.bot.guild_config.get(payload.guild_id)['audit_channel_id'])
         if not log_channel: return
         message_link = f"https://discord.com/channels/{payload.guild_id}/{payload.channel_id}/{payload.message_id}"
         await log_channel.send(f"🔄 Decisión cambiada a **{new_status_str}** por {payload.member.mention} para un envío de **{type_str}**. [Ir al envío]({message_link})")
@@ -0,0 +1,271 @@
+# cogs/moderacion.py
+import discord
+from discord import app_commands
+from discord.ext import commands
+import asyncio
+import re
+import logging
+from collections import Counter
+from contextlib import AsyncExitStack
+from utils.checks import guild_admin
+from utils.events import SubmissionJudged
+from utils.pending import PendingIndex, snowflake_time
+
+log = logging.getLogger(__name__)
+
+# --- CONFIGURACIÓN ---
+PENDING_EMOJI = '📝'
+APPROVE_EMOJI = '✅'
+DENY_EMOJI = '❌'
+# Tipo de envío -> (cog que lo gestiona, atributo de pendientes, atributo de juzgados).
+PENDING_SOURCES = {
+    'ataque': ('Ataque', 'pending_attacks', 'judged_attacks'),
+    'defensa': ('Defensa', 'pending_defenses', 'judged_defenses'),
+    'tempo': ('Tempo', 'pending_tempo', 'judged_tempo'),
+    'interserver': ('Interserver', 'pending_interserver', 'judged_interserver'),
+    'koth': ('koth', 'pending_koth', 'judged_koth'),
+}
+KIND_CHOICES = [app_commands.Choice(name=kind.capitalize(), value=kind) for kind in PENDING_SOURCES]
+# Envíos por página de /queue.
+QUEUE_PAGE_SIZE = 15
+# Máximo de envíos que puede juzgar un solo /bulk.
+BULK_MAX_ITEMS = 500
+# Pausa entre las reacciones que /bulk pone en segundo plano, para no saturar la API.
+REACTION_UPDATE_DELAY = 0.25
+
+@app_commands.guild_only()
+class Moderacion(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.pending_index = PendingIndex(self.pending_sources)
+        # Reacciones que /bulk deja para después: (channel_id, message_id, emoji).
+        self.reaction_updates = asyncio.Queue()
+        self.reaction_worker = None
+
+    async def cog_load(self):
+        self.reaction_worker = asyncio.create_task(self._apply_reaction_updates())
+
+    async def cog_unload(self):
+        # Al cerrar se intenta terminar la cola de reacciones antes de soltar la conexión.
+        if not self.reaction_updates.empty():
+            try:
+                await asyncio.wait_for(self.reaction_updates.join(), timeout=10)
+            except asyncio.TimeoutError:
+                log.warning("⚠️ Quedaron %d reacciones de /bulk sin aplicar.", self.reaction_updates.qsize())
+        self.reaction_worker.cancel()
+
+    def pending_sources(self) -> dict:
+        """Los GuildState de pendientes de los cogs que estén cargados, por tipo de envío."""
+        sources = {}
+        for kind, (cog_name, attribute, _) in PENDING_SOURCES.items():
+            cog = self.bot.get_cog(cog_name)
+            if cog:
+                sources[kind] = getattr(cog, attribute)
+        return sources
+
+    def judged_store(self, kind: str):
+        cog_name, _, attribute = PENDING_SOURCES[kind]
+        return getattr(self.bot.get_cog(cog_name), attribute)
+
+    # --- TAREA EN SEGUNDO PLANO ---
+    async def _apply_reaction_updates(self):
+        """Pone la reacción del veredicto y quita la de pendiente en los mensajes juzgados con /bulk."""
+        while True:
+            channel_id, message_id, emoji = await self.reaction_updates.get()
+            try:
+                channel = self.bot.get_channel(channel_id)
+                if channel:
+                    message = channel.get_partial_message(message_id)
+                    await message.add_reaction(emoji)
+                    await message.remove_reaction(PENDING_EMOJI, self.bot.user)
+            except discord.HTTPException as e:
+                log.warning("No se pudo actualizar la reacción del mensaje %s: %s", message_id, e, extra={'message_id': message_id})
+            except Exception:
+                log.exception("Error al actualizar la reacción del mensaje %s", message_id, extra={'message_id': message_id})
+            finally:
+                self.reaction_updates.task_done()
+            await asyncio.sleep(REACTION_UPDATE_DELAY)
+
+    def _format_entry(self, guild_id: int, entry) -> str:
+        created = int(snowflake_time(entry.message_id))
+        points = f"**{entry.points}** pts" if entry.points is not None else "pts del evento"
+        allies = ", ".join(f"<@{user_id}>" for user_id in dict.fromkeys(entry.allies))
+        if entry.channel_id:
+            where = f"<#{entry.channel_id}> · [Ir al envío](https://discord.com/channels/{guild_id}/{entry.channel_id}/{entry.message_id})"
+        else:
+            where = "canal desconocido"
+        return f"`{entry.kind}` · <t:{created}:R> · {points} · {allies} · {where}"
+
+    # --- COMANDOS SLASH ---
+    @app_commands.command(name="queue", description="Lista los envíos pendientes de revisión, del más antiguo al más reciente.")
+    @app_commands.describe(
+        tipo="Solo envíos de este tipo.",
+        canal="Solo envíos de este canal.",
+        aliado="Solo envíos que mencionan a este usuario.",
+        minimo_horas="Solo envíos con al menos estas horas de antigüedad.",
+        maximo_horas="Solo envíos con como mucho estas horas de antigüedad.",
+        pagina="Página de la cola a mostrar."
+    )
+    @app_commands.choices(tipo=KIND_CHOICES)
+    @guild_admin()
+    async def show_queue(self, interaction: discord.Interaction, tipo: app_commands.Choice[str] = None,
+                         canal: discord.TextChannel = None, aliado: discord.Member = None,
+                         minimo_horas: float = None, maximo_horas: float = None, pagina: int = 1):
+        entries = self.pending_index.query(
+            interaction.guild_id,
+            kind=tipo.value if tipo else None,
+            min_age_hours=minimo_horas,
+            max_age_hours=maximo_horas,
+            channel_id=canal.id if canal else None,
+            ally_id=aliado.id if aliado else None,
+        )
+        if not entries:
+            return await interaction.response.send_message("✅ No hay envíos pendientes que cumplan esos filtros.", ephemeral=True)
+
+        total_pages = (len(entries) - 1) // QUEUE_PAGE_SIZE + 1
+        pagina = min(max(pagina, 1), total_pages)
+        page_entries = entries[(pagina - 1) * QUEUE_PAGE_SIZE:pagina * QUEUE_PAGE_SIZE]
+        embed = discord.Embed(
+            title="📝 Cola de Envíos Pendientes",
+            description="\n".join(self._format_entry(interaction.guild_id, entry) for entry in page_entries)[:4096],
+            color=discord.Color.orange()
+        )
+        embed.set_footer(text=f"Página {pagina}/{total_pages} · {len(entries)} pendientes")
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="bulk", description="Aprueba o rechaza de una vez muchos envíos pendientes.")
+    @app_commands.describe(
+        accion="Veredicto para todos los envíos seleccionados.",
+        mensajes="IDs o enlaces de los mensajes, separados por espacios o comas.",
+        tipo="Solo envíos de este tipo.",
+        canal="Solo envíos de este canal.",
+        aliado="Solo envíos que mencionan a este usuario.",
+        minimo_horas="Solo envíos con al menos estas horas de antigüedad.",
+        maximo_horas="Solo envíos con como mucho estas horas de antigüedad.",
+        limite=f"Máximo de envíos a juzgar, empezando por los más antiguos (hasta {BULK_MAX_ITEMS})."
+    )
+    @app_commands.choices(
+        accion=[app_commands.Choice(name="Aprobar", value="approved"), app_commands.Choice(name="Rechazar", value="denied")],
+        tipo=KIND_CHOICES
+    )
+    @guild_admin()
+    async def bulk_judge(self, interaction: discord.Interaction, accion: app_commands.Choice[str], mensajes: str = None,
+                         tipo: app_commands.Choice[str] = None, canal: discord.TextChannel = None, aliado: discord.Member = None,
+                         minimo_horas: float = None, maximo_horas: float = None, limite: int = 50):
+        if not any(value is not None for value in (mensajes, tipo, canal, aliado, minimo_horas, maximo_horas)):
+            return await interaction.response.send_message("❌ Indica los mensajes o al menos un filtro; /bulk no juzga toda la cola sin filtros.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        entries = self.pending_index.query(
+            interaction.guild_id,
+            kind=tipo.value if tipo else None,
+            min_age_hours=minimo_horas,
+            max_age_hours=maximo_horas,
+            channel_id=canal.id if canal else None,
+            ally_id=aliado.id if aliado else None,
+        )
+        if mensajes:
+            # De un enlace de mensaje (.../servidor/canal/mensaje) solo interesa el último número.
+            selected = {int(re.findall(r'\d+', token)[-1]) for token in re.split(r'[\s,]+', mensajes) if re.search(r'\d', token)}
+            entries = [entry for entry in entries if entry.message_id in selected]
+        entries = entries[:min(max(limite, 1), BULK_MAX_ITEMS)]
+        if not entries:
+            return await interaction.followup.send("✅ No hay envíos pendientes que cumplan esos filtros.")
+
+        try:
+            judged = await self.apply_verdicts(interaction.guild_id, entries, accion.value, interaction.user.id)
+        except Exception as e:
+            log.exception("Error al aplicar el veredicto masivo: %s", e,
+                          extra={'guild_id': interaction.guild_id, 'user_id': interaction.user.id, 'submissions': len(entries)})
+            return await interaction.followup.send("❌ No se pudieron registrar los puntos; ningún envío ha cambiado de estado.")
+
+        emoji = APPROVE_EMOJI if accion.value == 'approved' else DENY_EMOJI
+        verdict = 'aprobados' if accion.value == 'approved' else 'rechazados'
+        summary = ", ".join(f"{count} de {kind}" for kind, count in Counter(entry.kind for entry in judged).items())
+        await interaction.followup.send(
+            f"{emoji} **{len(judged)}** envíos {verdict} ({summary}).\n"
+            f"Las reacciones de los mensajes se actualizarán en segundo plano."
+        )
+        log_channel = self.bot.get_channel(self.bot.guild_config.get(interaction.guild_id)['audit_channel_id'])
+        if log_channel:
+            await log_channel.send(f"{emoji} **Moderación masiva** por {interaction.user.mention}: {len(judged)} envíos {verdict} ({summary}).")
+
+    # --- VEREDICTOS EN LOTE ---
+    def _prepare_verdict(self, guild_id: int, kind: str, submission: dict, status: str) -> int:
+        """Ajusta el envío como lo haría la reacción de su cog y devuelve los puntos a registrar."""
+        if kind == 'koth':
+            points = self.bot.get_cog('koth').koth_event.get(guild_id).get('points_per_tag', 0)
+            if status == 'approved':
+                submission['points'] = points
+            return points if status == 'approved' and points > 0 else 0
+        if kind == 'defensa' and status == 'denied':
+            # Un rechazo descarta el multiplicador, igual que en el cog de defensas.
+            submission['points'] = submission.get('base_points', submission['points'])
+            submission['multiplier_applied'] = False
+            submission['multiplier_emoji'] = None
+        return submission['points'] if status == 'approved' else 0
+
+    async def apply_verdicts(self, guild_id: int, entries, status: str, moderator_id: int = None):
+        """
+        Juzga varios envíos pendientes a la vez, con los cerrojos por mensaje de Reacciones
+        tomados: los retira de pendientes antes de escribir (así una reacción simultánea ya no
+        los encuentra), registra los puntos de todos en una sola transacción y guarda cada
+        archivo de estado una única vez.
+        Si la escritura falla, los envíos vuelven a pendientes y se relanza la excepción.
+        Devuelve las entradas juzgadas.
+        """
+        sources = self.pending_sources()
+        reacciones = self.bot.get_cog('Reacciones')
+        async with AsyncExitStack() as stack:
+            # Los mismos cerrojos que Reacciones: una reacción que llegue a media moderación espera
+            # y después ve el envío ya juzgado, en vez de perderlo entre su lectura y su escritura.
+            if reacciones:
+                for message_id in sorted({entry.message_id for entry in entries}):
+                    await stack.enter_async_context(reacciones.locks.hold(guild_id, message_id))
+            claimed = []
+            for entry in entries:
+                if entry.kind not in sources:
+                    continue
+                submission = sources[entry.kind].get(guild_id).pop(str(entry.message_id), None)
+                if submission is not None:
+                    claimed.append((entry, submission))
+
+            original = [(entry, dict(submission)) for entry, submission in claimed]
+            awards = [(entry.message_id, submission, self._prepare_verdict(guild_id, entry.kind, submission, status), entry.kind)
+                      for entry, submission in claimed]
+            puntos_cog = self.bot.get_cog('Puntos')
+            try:
+                if puntos_cog and status == 'approved':
+                    await puntos_cog.award_submissions(guild_id, awards)
+            except Exception:
+                for entry, submission in original:
+                    sources[entry.kind].get(guild_id)[str(entry.message_id)] = submission
+                raise
+
+            for entry, submission in claimed:
+                submission['status'] = status
+                self.judged_store(entry.kind).get(guild_id)[str(entry.message_id)] = submission
+            for kind in {entry.kind for entry, _ in claimed}:
+                sources[kind].save(guild_id)
+                self.judged_store(kind).save(guild_id)
+
+        emoji = APPROVE_EMOJI if status == 'approved' else DENY_EMOJI
+        for entry, submission in claimed:
+            if entry.channel_id:
+                self.reaction_updates.put_nowait((entry.channel_id, entry.message_id, emoji))
+            self.bot.events.publish(SubmissionJudged(guild_id, entry.kind, entry.message_id, status, submission.get('points', 0), moderator_id))
+        return [entry for entry, _ in claimed]
+
+    async def cog_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        if isinstance(error, app_commands.MissingRole):
+            await interaction.response.send_message("❌ No tienes el rol de administrador necesario.", ephemeral=True)
+        else:
+            if not interaction.response.is_done():
+                await interaction.response.send_message("Ocurrió un error inesperado.", ephemeral=True)
+            else:
+                await interaction.followup.send("Ocurrió un error inesperado.", ephemeral=True)
+            log.error("Error en un comando de Moderación por %s: %s", interaction.user, error, exc_info=error,
+                      extra={'guild_id': interaction.guild_id, 'user_id': interaction.user.id})
+
+async def setup(bot):
+    await bot.add_cog(Moderacion(bot))
@@ -3,143 +3,462 @@ import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 import sqlite3
-import json
 from datetime import datetime, timezone
 import os
-import traceback
+import time
+import logging
+import asyncio
+from utils import ledger, rescore, shards, verify
+from utils.state import GuildState
+from utils.checks import has_admin_role
+from utils.rules import RulesError
+from utils.events import PointsChanged
+
+log = logging.getLogger(__name__)
 
 # --- CONFIGURACIÓN ---
-ADMIN_ROLE_ID = int(os.getenv("ADMIN_ROLE_ID"))
-BOT_AUDIT_LOGS_CHANNEL_ID = int(os.getenv("BOT_AUDIT_LOGS_CHANNEL_ID"))
-DB_FILE = 'leaderboard.db'
+DB_FILE = ledger.DB_FILE
 SNAPSHOT_FILE = 'ranking_snapshot.json'
+# Días de filas que la compactación deja intactas (0 desactiva la tarea automática).
+LEDGER_COMPACT_KEEP_DAYS = int(os.getenv("LEDGER_COMPACT_KEEP_DAYS", 30))
+# Si es "1", las filas compactadas se copian a `puntuaciones_archive` para auditoría.
+LEDGER_COMPACT_ARCHIVE = os.getenv("LEDGER_COMPACT_ARCHIVE", "1") == "1"
+# Group commit: si es "1", las inserciones se agrupan y se confirman juntas cada pocos milisegundos.
+POINTS_GROUP_COMMIT = os.getenv("POINTS_GROUP_COMMIT", "0") == "1"
+POINTS_GROUP_COMMIT_MS = float(os.getenv("POINTS_GROUP_COMMIT_MS", 5))
+POINTS_GROUP_COMMIT_ROWS = int(os.getenv("POINTS_GROUP_COMMIT_ROWS", 500))
+# Caracteres máximos por página del ranking.
+RANK_PAGE_CHARS = 4000
+# Clave de caché del ranking global (ningún servidor real tiene el ID 0).
+GLOBAL_RANKING_KEY = 0
+# Cada cuántas horas se verifica el libro contra los envíos juzgados (0 desactiva la tarea).
+VERIFY_INTERVAL_HOURS = float(os.getenv("VERIFY_INTERVAL_HOURS", 24))
+# Si es "1", la verificación automática también corrige las diferencias que encuentre.
+VERIFY_AUTO_REPAIR = os.getenv("VERIFY_AUTO_REPAIR", "0") == "1"
+# Cada cuánto se registra el latido del proceso y se recalcula el ranking global.
+COORDINATION_INTERVAL_MINUTES = 5
+# Tipo de envío -> (cog, atributo de pendientes, atributo de juzgados) que recalcula /rescore.
+RESCORE_STORES = {
+    'ataque': ('Ataque', 'pending_attacks', 'judged_attacks'),
+    'defensa': ('Defensa', 'pending_defenses', 'judged_defenses'),
+    'tempo': ('Tempo', 'pending_tempo', 'judged_tempo'),
+    'interserver': ('Interserver', 'pending_interserver', 'judged_interserver'),
+}
+# Envíos por bloque del recálculo: cada bloque es una transacción y una pausa del bucle de eventos.
+RESCORE_CHUNK_SIZE = 500
 
 class Puntos(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        # Versión del ranking por servidor y embeds ya preparados por (servidor, versión, página, vista).
+        self.ranking_versions = {}
+        self._render_cache = {}
         self._initialize_database()
+        # Snapshot del ranking por servidor (data/<guild_id>/ranking_snapshot.json).
+        self.snapshots = GuildState(SNAPSHOT_FILE, legacy_file=SNAPSHOT_FILE)
+        self.writer = None
+        if POINTS_GROUP_COMMIT:
+            self.writer = ledger.GroupCommitWriter(DB_FILE, POINTS_GROUP_COMMIT_MS / 1000, POINTS_GROUP_COMMIT_ROWS)
+        self._global_ranking_version = None
         self.snapshot_ranking_task.start()
+        self.coordination_task.start()
+        if LEDGER_COMPACT_KEEP_DAYS > 0:
+            self.compact_ledger_task.start()
+        if VERIFY_INTERVAL_HOURS > 0:
+            self.verify_ledger_task.change_interval(hours=VERIFY_INTERVAL_HOURS)
+            self.verify_ledger_task.start()
 
-    def cog_unload(self):
+    async def cog_unload(self):
         self.snapshot_ranking_task.cancel()
+        self.coordination_task.cancel()
+        self.compact_ledger_task.cancel()
+        self.verify_ledger_task.cancel()
+        # Vacía las inserciones pendientes antes de soltar el cog (también al cerrar el bot).
+        if self.writer:
+            await self.writer.close()
 
     def _initialize_database(self):
-        """Crea la tabla de la base de datos si no existe."""
+        """Crea la tabla de la base de datos si no existe (y migra su esquema si es antiguo)."""
         try:
-            con = sqlite3.connect(DB_FILE)
-            cur = con.cursor()
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS puntuaciones (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    guild_id INTEGER NOT NULL,
-                    category TEXT NOT NULL,
-                    points INTEGER NOT NULL,
-                    timestamp DATETIME NOT NULL
-                )
-            ''')
-            con.commit()
-            con.close()
+            ledger.initialize_database(DB_FILE)
         except Exception as e:
-            print(f"Error al inicializar la base de datos: {e}")
+            log.exception("Error al inicializar la base de datos: %s", e)
 
     @tasks.loop(hours=24)
     async def snapshot_ranking_task(self):
         """Toma una instantánea del ranking y la guarda en un archivo JSON."""
         await self.bot.wait_until_ready()
-        print(f"[{datetime.now()}] Creando snapshot del ranking...")
+        log.info("Creando snapshot del ranking...")
+        start = time.perf_counter()
         try:
             con = sqlite3.connect(DB_FILE)
             cur = con.cursor()
-            cur.execute("SELECT user_id, SUM(points) as total_points FROM puntuaciones GROUP BY user_id")
+            cur.execute("SELECT guild_id, user_id, SUM(points) as total_points FROM puntuaciones GROUP BY guild_id, user_id")
             ranking_data = cur.fetchall()
             con.close()
 
-            snapshot = {str(row[0]): row[1] for row in ranking_data}
-            with open(SNAPSHOT_FILE, 'w') as f:
-                json.dump(snapshot, f)
-            print("Snapshot del ranking creado exitosamente.")
+            snapshots = {}
+            for guild_id, user_id, total_points in ranking_data:
+                # Cada proceso guarda solo los snapshots de los servidores de sus shards.
+                if not shards.owns_guild(guild_id):
+                    continue
+                snapshots.setdefault(guild_id, {})[str(user_id)] = total_points
+            for guild_id, snapshot in snapshots.items():
+                self.snapshots.set(guild_id, snapshot)
+            # Las flechas de subida/bajada dependen del snapshot.
+            self._bump_ranking_version()
+            log.info("Snapshot del ranking creado exitosamente.",
+                     extra={'guilds': len(snapshots), 'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)})
+        except Exception as e:
+            log.exception("Error al crear el snapshot del ranking: %s", e)
+
+    @tasks.loop(minutes=COORDINATION_INTERVAL_MINUTES)
+    async def coordination_task(self):
+        """Registra el latido del proceso y mantiene el ranking global compartido entre shards."""
+        await self.bot.wait_until_ready()
+        coordinator = self.bot.coordinator
+        try:
+            await asyncio.to_thread(coordinator.heartbeat, len(self.bot.guilds))
+            # Solo un proceso recalcula el ranking global; el resto lo lee de la base compartida.
+            if await asyncio.to_thread(coordinator.try_acquire, 'global_ranking', COORDINATION_INTERVAL_MINUTES * 120):
+                await asyncio.to_thread(coordinator.refresh_global_ranking)
+            version = await asyncio.to_thread(coordinator.global_ranking_version)
+            if version != self._global_ranking_version:
+                self._global_ranking_version = version
+                self._bump_ranking_version(GLOBAL_RANKING_KEY)
+        except Exception as e:
+            log.exception("Error en la tarea de coordinación entre shards: %s", e)
+
+    @tasks.loop(hours=24)
+    async def compact_ledger_task(self):
+        """Compacta en segundo plano las filas antiguas del libro de puntos."""
+        await self.bot.wait_until_ready()
+        # La base es compartida: si hay varios procesos, solo compacta el que tenga el arrendamiento.
+        if not await asyncio.to_thread(self.bot.coordinator.try_acquire, 'compaction', 12 * 3600):
+            return
+        await self.run_compaction(LEDGER_COMPACT_KEEP_DAYS)
+
+    @tasks.loop(hours=24)
+    async def verify_ledger_task(self):
+        """Compara en segundo plano el libro con los envíos juzgados de los servidores de este shard."""
+        await self.bot.wait_until_ready()
+        # Tras un cierre limpio no hace falta verificar nada al arrancar; se espera a la siguiente vuelta.
+        if self.verify_ledger_task.current_loop == 0 and getattr(self.bot, 'clean_start', False):
+            return
+        try:
+            report = await self.run_verification(repair=VERIFY_AUTO_REPAIR)
         except Exception as e:
-            print(f"Error al crear el snapshot del ranking: {e}")
+            log.exception("Error al verificar el libro de puntos: %s", e)
+            return
+        if not report['drifted_submissions']:
+            return
+        # Se avisa en la auditoría de cada servidor con diferencias.
+        for guild_id in {guild_id for guild_id, _ in report['users']}:
+            log_channel = self.bot.get_channel(self.bot.guild_config.get(guild_id)['audit_channel_id'])
+            if log_channel:
+                await log_channel.send(self._format_verification(report, guild_id))
 
-    async def add_points(self, interaction_or_payload, user_id: str, amount: int, category: str):
-        """Añade una fila a la base de datos con los puntos otorgados."""
+    async def run_verification(self, guild_ids=None, repair: bool = False) -> dict:
+        """Ejecuta el verificador en un hilo aparte y refresca los rankings de los servidores reparados."""
+        log.info("Verificando el libro de puntos contra los envíos juzgados%s...", " (con reparación)" if repair else "")
+        report = await asyncio.to_thread(verify.verify_ledger, guild_ids, repair, DB_FILE)
+        for guild_id in report['repaired_guilds']:
+            self._bump_ranking_version(guild_id)
+            self.bot.events.publish(PointsChanged(guild_id, None, 'repair', (), report['repaired_rows']))
+        log.info(
+            "Verificación terminada en %.1f s: %d envíos, %d con diferencias (%d puntos), %d en curso, "
+            "%d no verificables, %d filas de reparación.",
+            report['elapsed'], report['submissions'], report['drifted_submissions'], report['drift_points'],
+            report['in_flight'], report['unverifiable'], report['repaired_rows'],
+            extra={'elapsed_ms': round(report['elapsed'] * 1000, 1), 'drifted': report['drifted_submissions']},
+        )
+        return report
+
+    def _format_verification(self, report: dict, guild_id: int) -> str:
+        """Resumen de una verificación para Discord, limitado a los usuarios de un servidor."""
+        users = sorted(((user_id, delta) for (gid, user_id), delta in report['users'].items() if gid == guild_id),
+                       key=lambda item: abs(item[1]), reverse=True)
+        lines = [
+            f"🔎 **Verificación del libro de puntos** ({report['elapsed']:.1f} s)",
+            f"- Envíos revisados: **{report['submissions']}** ({report['in_flight']} en curso, {report['unverifiable']} no verificables)",
+            f"- Envíos con diferencias: **{report['drifted_submissions']}** ({report['drift_points']} puntos)",
+        ]
+        if users:
+            lines.append("- Diferencias por usuario (positivo = faltan puntos en el libro):")
+            lines.extend(f"  - <@{user_id}>: **{delta:+}**" for user_id, delta in users[:15])
+            if len(users) > 15:
+                lines.append(f"  - ... y {len(users) - 15} usuarios más")
+        if report['repaired_rows']:
+            lines.append(f"- ✅ Se escribieron **{report['repaired_rows']}** filas de reparación.")
+        elif users:
+            lines.append("- Usa `/verify reparar:True` para corregirlas.")
+        return "\n".join(lines)[:2000]
+
+    async def run_compaction(self, keep_days: int) -> dict:
+        """Ejecuta la compactación en un hilo aparte para no bloquear el bucle de eventos."""
+        log.info("Compactando el libro de puntos (ventana de %d días)...", keep_days)
+        report = await asyncio.to_thread(ledger.compact_ledger, DB_FILE, keep_days, LEDGER_COMPACT_ARCHIVE)
+        log.info(
+            "Compactación terminada: %d filas plegadas, %d -> %d filas, %d bytes reutilizables, ranking %.1f ms -> %.1f ms.",
+            report['rows_folded'], report['rows_before'], report['rows_after'], report['bytes_reusable'],
+            report['ranking_query_before'] * 1000, report['ranking_query_after'] * 1000,
+        )
+        return report
+
+    async def run_rescore(self, guild_id: int, version: int = None, dry_run: bool = False, progress=None) -> dict:
+        """
+        Recalcula los envíos de un servidor con las reglas de `version` (la activa por defecto).
+        Trabaja sobre el estado de los cogs por bloques: cada bloque se aplica a los envíos antes
+        de escribir sus filas compensatorias (una reacción que llegue mientras tanto ya ve los
+        puntos nuevos), se deshace si la escritura falla y se guarda en cuanto se escribe, así
+        que los juzgados modificados no se acumulan en memoria.
+        `progress(hechos, total)` es una corrutina opcional que se espera tras cada bloque.
+        """
+        start = asyncio.get_running_loop().time()
+        version = version or self.bot.rules.version
+        report = rescore.new_report(version, dry_run)
+        report['guilds'] = 1
+        stores = []
+        for kind, (cog_name, pending_attribute, judged_attribute) in RESCORE_STORES.items():
+            cog = self.bot.get_cog(cog_name)
+            if cog:
+                # Pendientes primero: un envío que se apruebe durante el recálculo ya lleva los puntos nuevos.
+                stores.extend((kind, getattr(cog, attribute)) for attribute in (pending_attribute, judged_attribute))
+        total = sum(len(store.get(guild_id)) for _, store in stores)
+        done = 0
+        for kind, store in stores:
+            documents = store.get(guild_id)
+            # Cada bloque lee sus envíos al llegar a él: los que se juzgaron o movieron mientras
+            # se esperaba al bloque anterior ya no aparecen.
+            for chunk in rescore.chunks(documents, RESCORE_CHUNK_SIZE):
+                done += len(chunk)
+                changes = rescore.plan_chunk(self.bot.rules, guild_id, kind, chunk, version, report)
+                if changes and not dry_run:
+                    undo = rescore.apply_changes(documents, changes, version)
+                    rows = rescore.change_rows(changes)
+                    try:
+                        if rows:
+                            await self._write_rows(rows)
+                    except Exception:
+                        rescore.restore_changes(undo)
+                        raise
+                    store.save(guild_id, durable=True)
+                if progress:
+                    await progress(done, total)
+                await asyncio.sleep(0)
+        if report['rows'] and not dry_run:
+            self._bump_ranking_version(guild_id)
+            self.bot.events.publish(PointsChanged(guild_id, None, 'rescore', (), report['rows']))
+        report['users'] = {user_key: delta for user_key, delta in report['users'].items() if delta}
+        report['elapsed'] = asyncio.get_running_loop().time() - start
+        log.info(
+            "Recálculo %sdel servidor %s con las reglas v%s: %d envíos, %d con puntos nuevos, %d filas (%+d puntos), %d sin entradas.",
+            "simulado " if dry_run else "", guild_id, version, report['submissions'], report['repriced'],
+            report['rows'], report['delta_points'], report['unscorable'],
+            extra={'guild_id': guild_id, 'elapsed_ms': round(report['elapsed'] * 1000, 1)},
+        )
+        return report
+
+    async def _write_rows(self, rows) -> int:
+        """Escribe filas del libro, en grupo si el group commit está activo. Vuelve cuando son durables."""
+        if self.writer:
+            return await self.writer.write(rows)
+        return ledger.insert_points(rows, DB_FILE)
+
+    async def add_points(self, interaction_or_payload, user_id: str, amount: int, category: str, source_key: str = None):
+        """
+        Añade una fila a la base de datos con los puntos otorgados.
+        Si se indica `source_key`, la fila es idempotente: repetirla no vuelve a sumar puntos.
+        """
         if amount == 0:
             return
         
+        guild_id = interaction_or_payload.guild_id
+        fields = {'guild_id': guild_id, 'user_id': user_id, 'category': category, 'source_key': source_key}
         try:
-            con = sqlite3.connect(DB_FILE)
-            cur = con.cursor()
-            guild_id = interaction_or_payload.guild_id
-            
-            cur.execute(
-                "INSERT INTO puntuaciones (user_id, guild_id, category, points, timestamp) VALUES (?, ?, ?, ?, ?)",
-                (int(user_id), guild_id, category, amount, datetime.now(timezone.utc))
-            )
-            
-            con.commit()
-            con.close()
-            print(f"Se registraron {amount} puntos para el usuario {user_id} en la categoría '{category}'.")
+            row = (int(user_id), guild_id, category, amount, datetime.now(timezone.utc), source_key)
+            start = time.perf_counter()
+            if await self._write_rows([row]):
+                self._bump_ranking_version(guild_id)
+                self._publish_points(guild_id, category, 'manual', [row], 1)
+                log.info("Se registraron %d puntos para el usuario %s en la categoría '%s'.", amount, user_id, category,
+                         extra={**fields, 'elapsed_ms': round((time.perf_counter() - start) * 1000, 1), 'sample': 'points.manual'})
+            else:
+                log.info("Puntos ya registrados para la clave '%s', se ignora el duplicado.", source_key, extra=fields)
         except Exception as e:
-            print(f"Error al añadir puntos a la base de datos: {e}")
+            log.exception("Error al añadir puntos a la base de datos: %s", e, extra=fields)
 
-    @app_commands.command(name="rank", description="Muestra la tabla de clasificación de puntos completa.")
-    async def show_rank(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=False)
+    async def award_submission(self, payload, submission: dict, amount: int, category: str) -> int:
+        """
+        Registra `amount` puntos para cada aliado de un envío en una sola transacción.
+        Cada llamada es una nueva transición del envío (aprobar, revertir, reaprobar...) y
+        se numera en `submission['seq']`; el llamador debe guardar el envío después.
+        Si el proceso se cae antes de guardar, al reintentar se reutiliza el mismo número
+        de transición y las filas ya escritas se ignoran en lugar de duplicarse.
+        Si la escritura falla se relanza la excepción sin tocar `seq`: el llamador no debe
+        cambiar el estado del envío, y repetir la reacción más tarde es seguro.
+        """
+        if amount == 0:
+            return 0
+        seq = submission.get('seq', 0) + 1
+        rows = ledger.submission_rows(payload.guild_id, payload.message_id, submission, amount, category, seq)
+        fields = {'guild_id': payload.guild_id, 'message_id': payload.message_id, 'category': category, 'seq': seq}
+        start = time.perf_counter()
         try:
-            with open(SNAPSHOT_FILE, 'r') as f: previous_ranking_snapshot = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError): previous_ranking_snapshot = {}
-        
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("SELECT user_id, SUM(points) as total_points FROM puntuaciones WHERE guild_id = ? GROUP BY user_id HAVING SUM(points) != 0 ORDER BY total_points DESC", (interaction.guild.id,))
-        current_ranking_data = cur.fetchall()
-        con.close()
+            inserted = await self._write_rows(rows)
+        except Exception as e:
+            log.exception("Error al añadir puntos a la base de datos: %s", e, extra=fields)
+            raise
+        submission['seq'] = seq
+        if inserted:
+            self._bump_ranking_version(payload.guild_id)
+            self._publish_points(payload.guild_id, category, 'submission', rows, inserted)
+        # Una línea por aprobación es el mensaje más frecuente del bot: se muestrea.
+        log.info("Se registraron %d puntos para %d/%d menciones en la categoría '%s' (envío %s, transición %s).",
+                 amount, inserted, len(rows), category, payload.message_id, seq,
+                 extra={**fields, 'elapsed_ms': round((time.perf_counter() - start) * 1000, 1), 'sample': 'points.submission'})
+        return inserted
 
-        if not current_ranking_data:
-            await interaction.followup.send("Aún no se ha registrado ningún punto en este servidor.")
-            return
+    async def award_submissions(self, guild_id: int, awards) -> int:
+        """
+        Versión por lotes de `award_submission` para la moderación masiva: recibe tuplas
+        (message_id, envío, puntos, categoría) y escribe las filas de todas en una sola transacción.
+        Si la escritura falla lanza la excepción sin tocar ningún `seq`, para que el llamador
+        pueda deshacer el lote entero.
+        """
+        rows = []
+        transitions = []
+        for message_id, submission, amount, category in awards:
+            if amount == 0:
+                continue
+            seq = submission.get('seq', 0) + 1
+            rows.extend(ledger.submission_rows(guild_id, message_id, submission, amount, category, seq))
+            transitions.append((submission, seq))
+        if not rows:
+            return 0
+        inserted = await self._write_rows(rows)
+        for submission, seq in transitions:
+            submission['seq'] = seq
+        if inserted:
+            self._bump_ranking_version(guild_id)
+            categories = {row[2] for row in rows}
+            self._publish_points(guild_id, categories.pop() if len(categories) == 1 else None, 'bulk', rows, inserted)
+        log.info("Se registraron %d/%d menciones de %d envíos en un solo lote (servidor %s).",
+                 inserted, len(rows), len(transitions), guild_id, extra={'guild_id': guild_id})
+        return inserted
 
-        previous_ranks = {user_id: i for i, (user_id, _) in enumerate(sorted(previous_ranking_snapshot.items(), key=lambda item: item[1], reverse=True))}
-        
-        full_rank_list_text = []
+    def _publish_points(self, guild_id: int, category: str, reason: str, rows, inserted: int):
+        """Avisa por el bus de eventos de las filas escritas (sin esperar a los suscriptores)."""
+        self.bot.events.publish(PointsChanged(guild_id, category, reason, tuple((row[0], row[3]) for row in rows), inserted))
+
+    # --- CACHÉ DE RANKINGS ---
+    def _bump_ranking_version(self, guild_id: int = None):
+        """
+        Invalida los rankings cacheados de un servidor (o de todos si no se indica).
+        Se llama tras cualquier cambio de puntos, del snapshot o de la base de datos.
+        """
+        if guild_id is None:
+            guild_ids = set(self.ranking_versions) | {key[0] for key in self._render_cache}
+        else:
+            guild_ids = {guild_id}
+        for gid in guild_ids:
+            self.ranking_versions[gid] = self.ranking_versions.get(gid, 0) + 1
+        # Las entradas de versiones antiguas ya no se pueden pedir: se descartan.
+        self._render_cache = {key: payload for key, payload in self._render_cache.items() if key[0] not in guild_ids}
+
+    def _render_ranking_pages(self, guild_id: int):
+        """Consulta el ranking de un servidor (o el global) y lo divide en páginas de texto para el embed."""
+        if guild_id == GLOBAL_RANKING_KEY:
+            # El ranking global lo mantiene el proceso con el arrendamiento; no tiene flechas de cambio.
+            current_ranking_data = self.bot.coordinator.global_ranking()
+            previous_ranks = None
+        else:
+            previous_ranking_snapshot = self.snapshots.get(guild_id)
+
+            con = sqlite3.connect(DB_FILE)
+            cur = con.cursor()
+            cur.execute(ledger.RANKING_SQL, (guild_id,))
+            current_ranking_data = cur.fetchall()
+            con.close()
+
+            previous_ranks = {user_id: i for i, (user_id, _) in enumerate(sorted(previous_ranking_snapshot.items(), key=lambda item: item[1], reverse=True))}
+
+        pages, lines, length = [], [], 0
         for i, (user_id, total_points) in enumerate(current_ranking_data):
             current_pos = i + 1
-            previous_pos = previous_ranks.get(str(user_id))
             rank_change_emoji = ""
-            if previous_pos is not None:
-                if current_pos < previous_pos + 1: rank_change_emoji = "⬆️"
-                elif current_pos > previous_pos + 1: rank_change_emoji = "⬇️"
-            else: rank_change_emoji = "🆕"
-            
-            full_rank_list_text.append(f"**{current_pos}.** <@{user_id}> - `{total_points}` puntos {rank_change_emoji}")
-        
-        description_text = "\n".join(full_rank_list_text)
-        
-        if len(description_text) > 4000:
-            description_text = description_text[:4000]
-            last_newline = description_text.rfind('\n')
-            if last_newline != -1:
-                description_text = description_text[:last_newline]
-            description_text += "\n\n... y más (lista demasiado larga para mostrar completamente)."
-
-        embed = discord.Embed(
-            title="🏆 Ranking de Puntos Completo 🏆",
-            description=description_text or "Nadie ha puntuado aún.",
-            color=discord.Color.gold()
-        )
+            if previous_ranks is not None:
+                previous_pos = previous_ranks.get(str(user_id))
+                if previous_pos is not None:
+                    if current_pos < previous_pos + 1: rank_change_emoji = "⬆️"
+                    elif current_pos > previous_pos + 1: rank_change_emoji = "⬇️"
+                else: rank_change_emoji = "🆕"
+
+            line = f"**{current_pos}.** <@{user_id}> - `{total_points}` puntos {rank_change_emoji}"
+            # Cada página cabe en la descripción de un embed (máximo 4096 caracteres).
+            if lines and length + len(line) + 1 > RANK_PAGE_CHARS:
+                pages.append("\n".join(lines))
+                lines, length = [], 0
+            lines.append(line)
+            length += len(line) + 1
+        if lines:
+            pages.append("\n".join(lines))
+        return pages
+
+    async def _build_ranking_embed(self, guild_id: int, page: int = 1, view: str = 'full'):
+        """
+        Devuelve el embed del ranking (o None si no hay puntos), reutilizando el ya preparado
+        mientras no cambie la versión del ranking del servidor.
+        `view` es 'full' para /rank, 'final' para el anuncio de fin de temporada y 'global'
+        para el ranking de todos los servidores (con `guild_id` = GLOBAL_RANKING_KEY).
+        """
+        key = (guild_id, self.ranking_versions.get(guild_id, 0), page, view)
+        if key in self._render_cache:
+            payload = self._render_cache[key]
+            return discord.Embed.from_dict(payload) if payload else None
+
+        pages = await asyncio.to_thread(self._render_ranking_pages, guild_id)
+        if not pages:
+            payload = None
+        else:
+            page = min(max(page, 1), len(pages))
+            title = {
+                'full': "🏆 Ranking de Puntos Completo 🏆",
+                'final': "🏁 Ranking Final de la Temporada 🏁",
+                'global': "🌍 Ranking Global de Todos los Servidores 🌍",
+            }[view]
+            embed = discord.Embed(title=title, description=pages[page - 1], color=discord.Color.gold())
+            if len(pages) > 1:
+                embed.set_footer(text=f"Página {page}/{len(pages)}")
+            payload = embed.to_dict()
+        # Si los puntos cambiaron mientras se consultaba, el resultado ya nace obsoleto.
+        if key[1] == self.ranking_versions.get(guild_id, 0):
+            self._render_cache[key] = payload
+        return discord.Embed.from_dict(payload) if payload else None
+
+    @app_commands.command(name="rank", description="Muestra la tabla de clasificación de puntos completa.")
+    @app_commands.describe(pagina="Página del ranking a mostrar (por defecto la primera).", todos_los_servidores="Muestra el ranking global de todos los servidores.")
+    async def show_rank(self, interaction: discord.Interaction, pagina: int = 1, todos_los_servidores: bool = False):
+        await interaction.response.defer(ephemeral=False)
+        if todos_los_servidores:
+            embed = await self._build_ranking_embed(GLOBAL_RANKING_KEY, pagina, 'global')
+        else:
+            embed = await self._build_ranking_embed(interaction.guild.id, pagina, 'full')
+        if not embed:
+            await interaction.followup.send("Aún no se ha registrado ningún punto en este servidor.")
+            return
         await interaction.followup.send(embed=embed)
 
     @app_commands.command(name="points", description="Añade o resta puntos a un usuario manualmente.")
     @app_commands.describe(usuario="El usuario al que quieres modificar los puntos.", puntos="La cantidad (negativa para restar).", motivo="La razón del ajuste manual (opcional).")
     async def manual_points(self, interaction: discord.Interaction, usuario: discord.Member, puntos: int, motivo: str = "Ajuste manual"):
         # Verificación de rol manual para asegurar que el comando se registre
-        if not any(role.id == ADMIN_ROLE_ID for role in interaction.user.roles):
+        if not has_admin_role(self.bot, interaction.guild_id, interaction.user):
             return await interaction.response.send_message("❌ No tienes el rol de administrador necesario para usar este comando.", ephemeral=True)
             
-        await self.add_points(interaction, str(usuario.id), puntos, 'manual')
+        await self.add_points(interaction, str(usuario.id), puntos, 'manual', source_key=ledger.manual_source_key(interaction.id))
         
-        log_channel = self.bot.get_channel(BOT_AUDIT_LOGS_CHANNEL_ID)
+        log_channel = self.bot.get_channel(self.bot.guild_config.get(interaction.guild_id)['audit_channel_id'])
         if log_channel:
             embed = discord.Embed(title="⚙️ Ajuste Manual de Puntos", color=discord.Color.blue() if puntos > 0 else discord.Color.dark_red())
             embed.add_field(name="Administrador", value=interaction.user.mention, inline=True)
@@ -153,6 +472,69 @@ class Puntos(commands.Cog):
             
         await interaction.response.send_message(f"✅ Se han ajustado los puntos de {usuario.mention} en {puntos:+} puntos.", ephemeral=True)
 
+    @app_commands.command(name="compact", description="Compacta las filas antiguas del libro de puntos.")
+    @app_commands.describe(dias="Días recientes que se conservan sin compactar.")
+    async def compact_ledger(self, interaction: discord.Interaction, dias: int = LEDGER_COMPACT_KEEP_DAYS):
+        if not has_admin_role(self.bot, interaction.guild_id, interaction.user):
+            return await interaction.response.send_message("❌ No tienes el rol de administrador necesario para usar este comando.", ephemeral=True)
+        if dias < 0:
+            return await interaction.response.send_message("❌ El número de días no puede ser negativo.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        report = await self.run_compaction(dias)
+        await interaction.followup.send(
+            f"✅ **Compactación completada** (filas anteriores a `{report['cutoff']}`).\n"
+            f"- Filas plegadas: **{report['rows_folded']}** ({report['rows_before']} → {report['rows_after']}, {report['checkpoints']} checkpoints)\n"
+            f"- Espacio reutilizable: **{report['bytes_reusable'] / 1024:.1f} KiB**"
+            f"{' (copia de auditoría en `puntuaciones_archive`)' if report['archived'] else ''}\n"
+            f"- Consulta de ranking: {report['ranking_query_before'] * 1000:.1f} ms → {report['ranking_query_after'] * 1000:.1f} ms"
+        )
+
+    @app_commands.command(name="verify", description="Compara los puntos del libro con los envíos juzgados de este servidor.")
+    @app_commands.describe(reparar="Escribe filas compensatorias para corregir las diferencias encontradas.")
+    async def verify_ledger(self, interaction: discord.Interaction, reparar: bool = False):
+        if not has_admin_role(self.bot, interaction.guild_id, interaction.user):
+            return await interaction.response.send_message("❌ No tienes el rol de administrador necesario para usar este comando.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        report = await self.run_verification([interaction.guild_id], reparar)
+        await interaction.followup.send(self._format_verification(report, interaction.guild_id))
+
+    @app_commands.command(name="rescore", description="Recalcula los envíos de este servidor con las reglas de puntuación actuales.")
+    @app_commands.describe(simular="Solo calcula las diferencias sin escribir nada.", version="Versión de las reglas (por defecto la activa).")
+    async def rescore_submissions(self, interaction: discord.Interaction, simular: bool = True, version: int = None):
+        if not has_admin_role(self.bot, interaction.guild_id, interaction.user):
+            return await interaction.response.send_message("❌ No tienes el rol de administrador necesario para usar este comando.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        last_update = 0.0
+
+        async def progress(done, total):
+            # Se edita el mensaje como mucho cada 2 segundos para no chocar con los límites de Discord.
+            nonlocal last_update
+            now = asyncio.get_running_loop().time()
+            if now - last_update >= 2 and done < total:
+                last_update = now
+                await interaction.edit_original_response(content=f"⏳ Recalculando envíos... {done}/{total}")
+
+        try:
+            report = await self.run_rescore(interaction.guild_id, version, simular, progress)
+        except RulesError as e:
+            return await interaction.followup.send(f"❌ {e}")
+        users = sorted(((user_id, delta) for (_, user_id), delta in report['users'].items()), key=lambda item: abs(item[1]), reverse=True)
+        lines = [
+            f"{'🧪 **Simulación del recálculo**' if simular else '✅ **Recálculo completado**'} con las reglas v{report['version']} ({report['elapsed']:.1f} s)",
+            f"- Envíos revisados: **{report['submissions']}** ({report['unscorable']} anteriores al motor de reglas o fuera de la tabla)",
+            f"- Envíos con puntos nuevos: **{report['repriced']}**",
+            f"- Filas compensatorias{' que se escribirían' if simular else ''}: **{report['rows']}** ({report['delta_points']:+} puntos)",
+        ]
+        lines.extend(f"  - <@{user_id}>: **{delta:+}**" for user_id, delta in users[:15])
+        if len(users) > 15:
+            lines.append(f"  - ... y {len(users) - 15} usuarios más")
+        if simular and report['rows']:
+            lines.append("- Usa `/rescore simular:False` para aplicarlo.")
+        await interaction.edit_original_response(content="\n".join(lines)[:2000])
+
     async def cog_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
         # Este manejador de errores es para el comando /rank que no tiene chequeo manual
         # No es estrictamente necesario para /points ya que tiene su propio chequeo, pero es una buena práctica tenerlo
@@ -163,8 +545,8 @@ class Puntos(commands.Cog):
                 await interaction.response.send_message("Ocurrió un error inesperado.", ephemeral=True)
             else:
                 await interaction.followup.send("Ocurrió un error inesperado.", ephemeral=True)
-            print(f"Error en un comando de Puntos por {interaction.user}: {error}")
-            traceback.print_exc()
+            log.error("Error en un comando de Puntos por %s: %s", interaction.user, error, exc_info=error,
+                      extra={'guild_id': interaction.guild_id, 'user_id': interaction.user.id})
 
 async def setup(bot):
     await bot.add_cog(Puntos(bot))
\ No newline at end of file
@@ -0,0 +1,101 @@
+# cogs/reacciones.py
+import discord
+import os
+from discord.ext import commands
+from utils.events import SubmissionJudged
+from utils.locks import MessageLocks
+from utils.tracking import TrackedMessages
+
+# --- CONFIGURACIÓN ---
+# Tipo de envío -> (cog que lo gestiona, atributo de pendientes, atributo de juzgados).
+SUBMISSION_SOURCES = {
+    'ataque': ('Ataque', 'pending_attacks', 'judged_attacks'),
+    'defensa': ('Defensa', 'pending_defenses', 'judged_defenses'),
+    'tempo': ('Tempo', 'pending_tempo', 'judged_tempo'),
+    'interserver': ('Interserver', 'pending_interserver', 'judged_interserver'),
+    'koth': ('koth', 'pending_koth', 'judged_koth'),
+}
+# Cerrojos por envío que se conservan como máximo, y segundos sin uso tras los que se descartan.
+REACTION_LOCKS_MAX = int(os.getenv("REACTION_LOCKS_MAX", 10000))
+REACTION_LOCKS_IDLE_SECONDS = float(os.getenv("REACTION_LOCKS_IDLE_SECONDS", 300))
+
+class Reacciones(commands.Cog):
+    """
+    Único receptor de las reacciones del gateway. Consulta primero el índice de mensajes
+    seguidos y solo entrega la reacción al cog del envío, así que las reacciones en mensajes
+    que no son envíos se descartan sin mirar roles ni leer ningún documento.
+    Las reacciones de un mismo envío se procesan de una en una (dos moderadores pulsando
+    ✅ y ❌ a la vez ya no pueden sumar o restar los puntos dos veces), y cuando una cambia el
+    estado del envío se publica un SubmissionJudged en el bus de eventos.
+    """
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.tracked = TrackedMessages(self.submission_sources)
+        self.locks = MessageLocks(REACTION_LOCKS_MAX, REACTION_LOCKS_IDLE_SECONDS)
+
+    def submission_sources(self) -> dict:
+        """Los GuildState (pendientes, juzgados) de los cogs de envíos que estén cargados."""
+        sources = {}
+        for kind, (cog_name, pending_attribute, judged_attribute) in SUBMISSION_SOURCES.items():
+            cog = self.bot.get_cog(cog_name)
+            if cog:
+                sources[kind] = (getattr(cog, pending_attribute), getattr(cog, judged_attribute))
+        return sources
+
+    def _handlers(self, payload, method: str):
+        if payload.guild_id is None:
+            return []
+        handlers = []
+        for kind in self.tracked.lookup(payload.guild_id, payload.message_id):
+            handler = getattr(self.bot.get_cog(SUBMISSION_SOURCES[kind][0]), method, None)
+            if handler:
+                handlers.append((kind, handler))
+        return handlers
+
+    def _submission_state(self, kind: str, guild_id: int, message_id: int):
+        """(estado, puntos) del envío: 'approved'/'denied' si está juzgado, 'pending' o None."""
+        pending, judged = self.submission_sources()[kind]
+        submission = judged.get(guild_id).get(str(message_id))
+        if submission is not None:
+            return submission.get('status'), submission.get('points', 0)
+        return ('pending' if str(message_id) in pending.get(guild_id) else None), 0
+
+    def _publish_transition(self, payload, kind: str, before, after):
+        if after[0] == before[0]:
+            return
+        if after[0] in ('approved', 'denied'):
+            status = after[0]
+        elif before[0] in ('approved', 'denied'):
+            status = 'reverted'
+        else:
+            return
+        self.bot.events.publish(SubmissionJudged(payload.guild_id, kind, payload.message_id, status, after[1] or before[1], payload.user_id))
+
+    async def _dispatch(self, payload, method: str):
+        handlers = self._handlers(payload, method)
+        if not handlers:
+            return
+        # Los manejadores leen el estado, esperan a la red y luego lo modifican: el cerrojo
+        # evita que otra reacción del mismo envío lea el estado entre medias.
+        async with self.locks.hold(payload.guild_id, payload.message_id):
+            for kind, handler in handlers:
+                # Con el cerrojo nadie más toca el envío: comparar antes y después basta para saber si se juzgó.
+                before = self._submission_state(kind, payload.guild_id, payload.message_id)
+                await handler(payload)
+                self._publish_transition(payload, kind, before, self._submission_state(kind, payload.guild_id, payload.message_id))
+
+    # --- LISTENERS ---
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        await self._dispatch(payload, 'handle_reaction_add')
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        await self._dispatch(payload, 'handle_reaction_remove')
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.tracked.forget(guild.id)
+
+async def setup(bot):
+    await bot.add_cog(Reacciones(bot))
@@ -0,0 +1,183 @@
+# cogs/tablero.py
+import discord
+from discord import app_commands
+from discord.ext import commands
+from datetime import datetime, timezone
+import asyncio
+import hashlib
+import os
+import logging
+from utils import ledger, logs
+from utils.checks import guild_admin
+from utils.events import PointsChanged
+from utils.state import GuildState
+
+log = logging.getLogger(__name__)
+
+# --- CONFIGURACIÓN ---
+DB_FILE = ledger.DB_FILE
+# Mensaje del tablero de cada servidor: {channel_id, message_id, digest} en data/<guild_id>/live_leaderboard.json.
+LIVE_BOARD_FILE = 'live_leaderboard.json'
+# Segundos mínimos entre dos ediciones del tablero de un mismo servidor.
+LIVE_BOARD_INTERVAL_SECONDS = float(os.getenv("LIVE_BOARD_INTERVAL_SECONDS", 30))
+# Puestos que muestra el tablero.
+LIVE_BOARD_TOP = int(os.getenv("LIVE_BOARD_TOP", 15))
+# Espera mínima tras el primer cambio, para que una ráfaga de aprobaciones salga en una sola edición.
+LIVE_BOARD_SETTLE_SECONDS = 2
+
+@app_commands.guild_only()
+class Tablero(commands.Cog):
+    """
+    Tablero de clasificación fijado que el bot edita cuando cambian los puntos.
+
+    Se suscribe a PointsChanged en el bus de eventos; el tablero no se edita con cada aviso sino
+    que se programa una sola edición por servidor, como pronto `LIVE_BOARD_INTERVAL_SECONDS`
+    después de la anterior, así que cien aprobaciones seguidas cuestan una edición. Antes de
+    editar se compara el top visible con el último publicado y, si no cambió (por ejemplo,
+    puntos fuera del top), no se llama a la API.
+    """
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.boards = GuildState(LIVE_BOARD_FILE, default=dict)
+        # Servidor -> tarea con la edición programada.
+        self._scheduled = {}
+        # Servidor -> momento (reloj del bucle) de la última edición.
+        self._last_edit = {}
+        self.edits = 0
+        self.skipped = 0
+        self.subscription = None
+
+    async def cog_load(self):
+        # Los avisos son idempotentes (solo marcan el servidor), así que una cola corta basta.
+        self.subscription = self.bot.events.subscribe(PointsChanged, self.on_points_changed, 'tablero', maxsize=100)
+
+    async def cog_unload(self):
+        self.bot.events.unsubscribe(self.subscription)
+        for task in self._scheduled.values():
+            task.cancel()
+
+    # --- PROGRAMACIÓN DE EDICIONES ---
+    def on_points_changed(self, event: PointsChanged):
+        self.mark_dirty(event.guild_id)
+
+    def mark_dirty(self, guild_id: int = None):
+        """Anota que los puntos del servidor (o de todos si no se indica) cambiaron."""
+        if guild_id is None:
+            for gid, board in self.boards.items():
+                if board.get('message_id'):
+                    self._schedule(gid)
+        elif self.boards.get(guild_id).get('message_id'):
+            self._schedule(guild_id)
+
+    def _schedule(self, guild_id: int):
+        if guild_id in self._scheduled:
+            # Ya hay una edición en camino: la consulta se hará después y recogerá este cambio.
+            return
+        loop = asyncio.get_running_loop()
+        delay = LIVE_BOARD_SETTLE_SECONDS
+        if guild_id in self._last_edit:
+            delay = max(delay, self._last_edit[guild_id] + LIVE_BOARD_INTERVAL_SECONDS - loop.time())
+        self._scheduled[guild_id] = loop.create_task(self._refresh_later(guild_id, delay))
+
+    async def _refresh_later(self, guild_id: int, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            # Los cambios que lleguen a partir de aquí programan la siguiente edición.
+            del self._scheduled[guild_id]
+            await self.refresh(guild_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Error al actualizar el tablero del servidor %s", guild_id, extra={'guild_id': guild_id})
+
+    # --- RENDERIZADO ---
+    def _render_top(self, guild_id: int) -> str:
+        con = ledger.connect(DB_FILE)
+        try:
+            rows = con.execute(f"{ledger.RANKING_SQL} LIMIT ?", (guild_id, LIVE_BOARD_TOP)).fetchall()
+        finally:
+            con.close()
+        lines = [f"**{position}.** <@{user_id}> - `{total_points}` puntos" for position, (user_id, total_points) in enumerate(rows, start=1)]
+        return "\n".join(lines) or "Aún no se ha registrado ningún punto en este servidor."
+
+    def _board_embed(self, description: str) -> discord.Embed:
+        embed = discord.Embed(title="🏆 Ranking en Directo 🏆", description=description, color=discord.Color.gold())
+        embed.set_footer(text=f"Top {LIVE_BOARD_TOP} · Se actualiza solo · Usa /rank para verlo completo")
+        embed.timestamp = datetime.now(timezone.utc)
+        return embed
+
+    async def refresh(self, guild_id: int, force: bool = False) -> bool:
+        """
+        Edita el tablero del servidor si el top visible cambió desde la última edición (o
+        siempre con `force`). Devuelve True si se editó.
+        """
+        board = self.boards.get(guild_id)
+        if not board.get('message_id'):
+            return False
+        description = await asyncio.to_thread(self._render_top, guild_id)
+        digest = hashlib.sha1(description.encode()).hexdigest()
+        if digest == board.get('digest') and not force:
+            self.skipped += 1
+            return False
+        channel = self.bot.get_channel(board['channel_id'])
+        if channel is None:
+            return False
+        try:
+            with logs.timed(log, "Tablero actualizado", logging.DEBUG, guild_id=guild_id):
+                await channel.get_partial_message(board['message_id']).edit(embed=self._board_embed(description))
+        except discord.NotFound:
+            # Alguien borró el mensaje: se deja de seguir hasta que se vuelva a crear con /board.
+            log.warning("El tablero del servidor %s ya no existe; se desactiva.", guild_id, extra={'guild_id': guild_id})
+            self.boards.set(guild_id, {})
+            return False
+        self._last_edit[guild_id] = asyncio.get_running_loop().time()
+        self.edits += 1
+        board['digest'] = digest
+        self.boards.save(guild_id)
+        return True
+
+    # --- COMANDOS ---
+    @app_commands.command(name="board", description="Publica un ranking fijado que se actualiza solo, o lo quita.")
+    @app_commands.describe(canal="Canal donde publicar el tablero (por defecto este).", quitar="Deja de actualizar el tablero actual y lo borra.")
+    @guild_admin()
+    async def manage_board(self, interaction: discord.Interaction, canal: discord.TextChannel = None, quitar: bool = False):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        previous = self.boards.get(interaction.guild_id)
+        # El tablero anterior se borra tanto al quitarlo como al moverlo a otro canal.
+        if previous.get('message_id'):
+            scheduled = self._scheduled.pop(interaction.guild_id, None)
+            if scheduled:
+                scheduled.cancel()
+            old_channel = self.bot.get_channel(previous['channel_id'])
+            if old_channel:
+                try:
+                    await old_channel.get_partial_message(previous['message_id']).delete()
+                except discord.HTTPException:
+                    pass
+            self.boards.set(interaction.guild_id, {})
+        if quitar:
+            message = "✅ Tablero eliminado." if previous.get('message_id') else "ℹ️ Este servidor no tenía tablero."
+            return await interaction.followup.send(message)
+
+        channel = canal or interaction.channel
+        description = await asyncio.to_thread(self._render_top, interaction.guild_id)
+        try:
+            board_message = await channel.send(embed=self._board_embed(description))
+        except discord.Forbidden:
+            return await interaction.followup.send(f"❌ No tengo permiso para escribir en {channel.mention}.")
+        pinned = True
+        try:
+            await board_message.pin(reason="Tablero de clasificación en directo")
+        except discord.HTTPException:
+            pinned = False
+        self.boards.set(interaction.guild_id, {
+            'channel_id': channel.id, 'message_id': board_message.id, 'digest': hashlib.sha1(description.encode()).hexdigest(),
+        })
+        self._last_edit[interaction.guild_id] = asyncio.get_running_loop().time()
+        await interaction.followup.send(
+            f"✅ Tablero publicado en {channel.mention}{'' if pinned else ' (no pude fijarlo: me falta el permiso de gestionar mensajes)'}. "
+            f"Se actualizará como mucho cada {LIVE_BOARD_INTERVAL_SECONDS:g} s."
+        )
+
+async def setup(bot):
+    await bot.add_cog(Tablero(bot))
@@ -2,13 +2,13 @@
 import discord
 from discord.ext import commands
 import re
-import os
-import json
-import traceback
+import logging
+from utils.state import GuildState
+from utils.judged import JudgedStore
+from utils.checks import has_admin_role
+from utils.rules import season_rules, record
 
-# --- CONFIGURACIÓN ---
-ADMIN_ROLE_ID = int(os.getenv("ADMIN_ROLE_ID"))
-BOT_AUDIT_LOGS_CHANNEL_ID = int(os.getenv("BOT_AUDIT_LOGS_CHANNEL_ID"))
+log = logging.getLogger(__name__)
 
 # --- Emojis y Archivos de Datos ---
 PENDING_EMOJI = '📝'
@@ -17,59 +17,45 @@ DENY_EMOJI = '❌'
 PENDING_TEMPO_FILE = 'pending_tempo.json'
 JUDGED_TEMPO_FILE = 'judged_tempo.json'
 
-# --- Puntos para Tempo ---
-TEMPO_POINTS = {
-    "5-10min": 15,
-    "10-15min": 25,
-    "15-20min": 40,
-    "20-25min": 50,
-    "25-30min": 60,
-    "plus-de-30": 75,
-}
-
 class Tempo(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.pending_tempo = self.load_data(PENDING_TEMPO_FILE)
-        self.judged_tempo = self.load_data(JUDGED_TEMPO_FILE)
-
-    def load_data(self, filename):
-        try:
-            with open(filename, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
-
-    def save_data(self, data, filename):
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=4)
-
-    async def process_submission(self, message: discord.Message):
-        """Función centralizada para validar y registrar un envío de Tempo."""
-        for reaction in message.reactions:
-            if reaction.me:
-                return False # Ya fue procesado
+        # Estado particionado por servidor (data/<guild_id>/...).
+        self.pending_tempo = GuildState(PENDING_TEMPO_FILE, legacy_file=PENDING_TEMPO_FILE)
+        self.judged_tempo = JudgedStore(JUDGED_TEMPO_FILE, legacy_file=JUDGED_TEMPO_FILE)
 
+    def build_submission(self, message: discord.Message):
+        """El envío de Tempo del mensaje, o None si no es válido o su clave no da puntos."""
         all_mentions_in_text = re.findall(r'<@!?(\d+)>', message.content)
         if not message.attachments or not all_mentions_in_text or not any(att.content_type.startswith('image/') for att in message.attachments):
-            return False
+            return None
 
         channel_name_lower = message.channel.name.lower()
         key_part = ""
         try:
             key_part = channel_name_lower.split('tempo-', 1)[1]
         except IndexError:
-            return False
+            return None
 
-        if key_part not in TEMPO_POINTS:
-            return False
+        # Los puntos salen de la tabla 'tempo' de las reglas activas (scoring_rules.json).
+        rules = season_rules(self.bot, message.guild.id)
+        inputs = {'key': key_part}
+        points_to_award = rules.base_points('tempo', inputs)
+        if not points_to_award:
+            return None
+        return record({'points': points_to_award, 'allies': all_mentions_in_text, 'channel_id': message.channel.id}, rules, inputs)
 
-        points_to_award = TEMPO_POINTS[key_part]
-        if points_to_award == 0:
-            return False
+    async def process_submission(self, message: discord.Message):
+        """Función centralizada para validar y registrar un envío de Tempo."""
+        for reaction in message.reactions:
+            if reaction.me:
+                return False # Ya fue procesado
 
-        self.pending_tempo[str(message.id)] = {'points': points_to_award, 'allies': all_mentions_in_text}
-        self.save_data(self.pending_tempo, PENDING_TEMPO_FILE)
+        submission = self.build_submission(message)
+        if submission is None:
+            return False
+        self.pending_tempo.get(message.guild.id)[str(message.id)] = submission
+        self.pending_tempo.save(message.guild.id)
         await message.add_reaction(PENDING_EMOJI)
         return True
 
@@ -81,10 +67,10 @@ class Tempo(commands.Cog):
         
         await self.process_submission(message)
 
-    @commands.Cog.listener()
-    async def on_raw_reaction_add(self, payload):
+    # La llama el cog Reacciones solo para los mensajes que son envíos de este cog.
+    async def handle_reaction_add(self, payload):
         """Maneja la lógica de aprobación, rechazo y cambio de decisión."""
-        if payload.member.bot or not any(role.id == ADMIN_ROLE_ID for role in payload.member.roles):
+        if payload.member.bot or not has_admin_role(self.bot, payload.guild_id, payload.member):
             return
 
         message_id_str = str(payload.message_id)
@@ -93,8 +79,10 @@ class Tempo(commands.Cog):
         if emoji not in [APPROVE_EMOJI, DENY_EMOJI]:
             return
         
-        is_pending = message_id_str in self.pending_tempo
-        is_judged = message_id_str in self.judged_tempo
+        pending_tempo = self.pending_tempo.get(payload.guild_id)
+        judged_tempo = self.judged_tempo.get(payload.guild_id)
+        is_pending = message_id_str in pending_tempo
+        is_judged = message_id_str in judged_tempo
         if not is_pending and not is_judged:
             return
 
@@ -110,49 +98,48 @@ class Tempo(commands.Cog):
                                 await original_message.remove_reaction(opposite_emoji, user)
                         break
             except (discord.NotFound, discord.Forbidden, discord.HTTPException):
-                print(f"No se pudieron gestionar las reacciones opuestas del mensaje {message_id_str}")
+                log.warning("No se pudieron gestionar las reacciones opuestas del mensaje %s", message_id_str, extra={'guild_id': payload.guild_id})
 
         puntos_cog = self.bot.get_cog('Puntos')
 
         if is_pending:
-            submission = self.pending_tempo.pop(message_id_str)
-            self.save_data(self.pending_tempo, PENDING_TEMPO_FILE)
+            submission = pending_tempo[message_id_str]
+            # Primero los puntos: si la escritura falla, la excepción deja el envío en pendientes.
+            if emoji == APPROVE_EMOJI and puntos_cog:
+                await puntos_cog.award_submission(payload, submission, submission['points'], 'tempo')
+            pending_tempo.pop(message_id_str)
+            self.pending_tempo.save(payload.guild_id)
             if emoji == APPROVE_EMOJI:
-                if puntos_cog:
-                    for user_id in submission['allies']:
-                        await puntos_cog.add_points(payload, user_id, submission['points'], 'tempo')
                 submission['status'] = 'approved'
-                self.judged_tempo[message_id_str] = submission
-                self.save_data(self.judged_tempo, JUDGED_TEMPO_FILE)
+                judged_tempo[message_id_str] = submission
+                self.judged_tempo.save(payload.guild_id)
                 await self.send_log_message(payload, submission, "Tempo", "aprobado")
             elif emoji == DENY_EMOJI:
                 submission['status'] = 'denied'
-                self.judged_tempo[message_id_str] = submission
-                self.save_data(self.judged_tempo, JUDGED_TEMPO_FILE)
+                judged_tempo[message_id_str] = submission
+                self.judged_tempo.save(payload.guild_id)
                 await self.send_log_message(payload, submission, "Tempo", "rechazado")
         
         elif is_judged:
-            submission = self.judged_tempo[message_id_str]
+            submission = judged_tempo[message_id_str]
             old_status = submission['status']
             if emoji == APPROVE_EMOJI and old_status == 'denied':
                 if puntos_cog:
-                    for user_id in submission['allies']:
-                        await puntos_cog.add_points(payload, user_id, submission['points'], 'tempo')
+                    await puntos_cog.award_submission(payload, submission, submission['points'], 'tempo')
                 submission['status'] = 'approved'
-                self.judged_tempo[message_id_str] = submission
-                self.save_data(self.judged_tempo, JUDGED_TEMPO_FILE)
+                judged_tempo[message_id_str] = submission
+                self.judged_tempo.save(payload.guild_id)
                 await self.log_decision_change(payload, "Tempo", "APROBADO")
             elif emoji == DENY_EMOJI and old_status == 'approved':
                 if puntos_cog:
-                    for user_id in submission['allies']:
-                        await puntos_cog.add_points(payload, user_id, -submission['points'], 'tempo')
+                    await puntos_cog.award_submission(payload, submission, -submission['points'], 'tempo')
                 submission['status'] = 'denied'
-                self.judged_tempo[message_id_str] = submission
-                self.save_data(self.judged_tempo, JUDGED_TEMPO_FILE)
+                judged_tempo[message_id_str] = submission
+                self.judged_tempo.save(payload.guild_id)
                 await self.log_decision_change(payload, "Tempo", "RECHAZADO")
 
     async def send_log_message(self, payload, submission, type_str, action_str):
-        log_channel = self.bot.get_channel(BOT_AUDIT_LOGS_CHANNEL_ID)
+        log_channel = self.bot.get_channel(self.bot.guild_config.get(payload.guild_id)['audit_channel_id'])
         if not log_channel: return
         message_link = f"https://discord.com/channels/{payload.guild_id}/{payload.channel_id}/{payload.message_id}"
         if action_str == "aprobado":
@@ -162,7 +149,7 @@ class Tempo(commands.Cog):
             await log_channel.send(f"{DENY_EMOJI} **{type_str}** {action_str} por {payload.member.mention}. [Ir al envío]({message_link})")
 
     async def log_decision_change(self, payload, type_str, new_status_str):
-        log_channel = self.bot.get_channel(BOT_AUDIT_LOGS_CHANNEL_ID)
+        log_channel = self.bot.get_channel(self.bot.guild_config.get(payload.guild_id)['audit_channel_id'])
         if not log_channel: return
         message_link = f"https://discord.com/channels/{payload.guild_id}/{payload.channel_id}/{payload.message_id}"
         await log_channel.send(f"🔄 Decisión cambiada a **{new_status_str}** por {payload.member.mention} para un envío de **{type_str}**. [Ir al envío]({message_link})")
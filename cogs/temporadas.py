@@ -2,38 +2,30 @@
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
-import json
 import os
 import re
 from datetime import datetime, timedelta, timezone
-import traceback
-import sqlite3
+import logging
+import asyncio
+from utils import ledger
+from utils.state import GuildState
+from utils.checks import guild_admin
+from utils.events import PointsChanged
+
+log = logging.getLogger(__name__)
 
 # --- CONFIGURACIÓN ---
 # Carga de IDs desde el archivo .env para mantener la configuración centralizada y segura.
-ADMIN_ROLE_ID = int(os.getenv("ADMIN_ROLE_ID", 0))
-ANNOUNCEMENT_CHANNEL_ID = int(os.getenv("ANNOUNCEMENT_CHANNEL_ID", 0))
 SEASONS_CATEGORY_ID = int(os.getenv("SEASONS_CATEGORY_ID", 0))
-TEST_GUILD_ID = int(os.getenv("TEST_GUILD_ID", 0))
 
 # --- CONSTANTES DE ARCHIVOS ---
-DB_FILE = 'leaderboard.db'
+DB_FILE = ledger.DB_FILE
 SEASON_STATUS_FILE = 'season_status.json'
 
 # --- FUNCIONES DE AYUDA PARA GESTIÓN DE ESTADO ---
-def load_season_data():
-    """Carga el estado de la temporada desde un archivo JSON. Si no existe, devuelve un estado por defecto."""
-    try:
-        with open(SEASON_STATUS_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Estado inicial si no hay temporada o el archivo está corrupto.
-        return {'active': False, 'name': None, 'end_time': None, 'channel_id': None, 'season_number': 0}
-
-def save_season_data(data):
-    """Guarda el estado actual de la temporada en el archivo JSON."""
-    with open(SEASON_STATUS_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+def inactive_season():
+    """Estado inicial de un servidor sin temporada (o con el archivo corrupto)."""
+    return {'active': False, 'name': None, 'end_time': None, 'channel_id': None, 'season_number': 0}
 
 # --- COG DE TEMPORADAS ---
 # Usamos un GroupCog para agrupar todos los subcomandos bajo /season (ej. /season start)
@@ -42,6 +34,8 @@ class Temporadas(commands.GroupCog, name="season", description="Comandos para ge
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         super().__init__()
+        # Cada servidor tiene su propia temporada (data/<guild_id>/season_status.json).
+        self.seasons = GuildState(SEASON_STATUS_FILE, default=inactive_season, legacy_file=SEASON_STATUS_FILE)
         # Inicia la tarea en segundo plano al cargar el Cog.
         self.check_season_end.start()
 
@@ -52,15 +46,16 @@ class Temporadas(commands.GroupCog, name="season", description="Comandos para ge
     # --- TAREA EN SEGUNDO PLANO ---
     @tasks.loop(hours=1)
     async def check_season_end(self):
-        """Verifica cada hora si la temporada activa ha llegado a su fin."""
-        status = load_season_data()
-        if status.get("active") and status.get("end_time"):
+        """Verifica cada hora si la temporada activa de algún servidor ha llegado a su fin."""
+        for guild_id, status in self.seasons.items():
+            if not (status.get("active") and status.get("end_time")):
+                continue
             end_time = datetime.fromisoformat(status["end_time"])
             # Compara la fecha de fin con la fecha actual (con zona horaria UTC para consistencia).
             if datetime.now(timezone.utc) >= end_time:
-                print(f"Temporada '{status['name']}' finalizada automáticamente.")
-                guild = self.bot.get_guild(TEST_GUILD_ID)
+                guild = self.bot.get_guild(guild_id)
                 if guild:
+                    log.info("Temporada '%s' del servidor %s finalizada automáticamente.", status['name'], guild_id, extra={'guild_id': guild_id})
                     # Llama a la lógica principal de finalización de temporada.
                     await self.end_season_logic(guild)
 
@@ -72,17 +67,17 @@ class Temporadas(commands.GroupCog, name="season", description="Comandos para ge
     # --- LÓGICA CENTRALIZADA ---
     async def end_season_logic(self, guild: discord.Guild, interaction_channel: discord.TextChannel = None):
         """Lógica reutilizable para finalizar una temporada, usada tanto por el comando manual como por la tarea automática."""
-        status = load_season_data()
+        status = self.seasons.get(guild.id)
         if not status.get("active"):
             if interaction_channel:
                 await interaction_channel.send("No hay ninguna temporada activa para terminar.")
             return
 
         # Determina el canal para los anuncios. Prioriza el canal de anuncios, si no, usa el canal de la interacción.
-        announcement_channel = self.bot.get_channel(ANNOUNCEMENT_CHANNEL_ID)
+        announcement_channel = self.bot.get_channel(self.bot.guild_config.get(guild.id)['announcement_channel_id'])
         final_channel = announcement_channel or interaction_channel
         if not final_channel:
-            print("Error: No se encontró un canal para enviar el anuncio de fin de temporada.")
+            log.error("No se encontró un canal para enviar el anuncio de fin de temporada.", extra={'guild_id': guild.id})
             return
 
         await final_channel.send(f"🏁 **¡La Temporada '{status['name']}' ha finalizado!** 🏁\nAquí está el ranking final:")
@@ -90,33 +85,33 @@ class Temporadas(commands.GroupCog, name="season", description="Comandos para ge
         # Interactúa con el Cog 'Puntos' para obtener el ranking final.
         puntos_cog = self.bot.get_cog('Puntos')
         if puntos_cog:
-            final_ranking_embed = await puntos_cog._build_ranking_embed(guild.id)
+            final_ranking_embed = await puntos_cog._build_ranking_embed(guild.id, view='final')
             if final_ranking_embed:
                 await final_channel.send(embed=final_ranking_embed)
             else:
                 await final_channel.send("No se registraron puntos en esta temporada.")
 
-        # Archiva la base de datos de la temporada y resetea el estado.
+        # Archiva los puntos de este servidor (los demás servidores siguen su propia temporada).
         season_number = status.get('season_number', 'X')
-        archive_db_name = f'season-{season_number}-leaderboard.db'
-        if os.path.exists(DB_FILE):
-            os.rename(DB_FILE, archive_db_name)
-            if final_channel:
-                await final_channel.send(f"La base de datos de puntos ha sido archivada como `{archive_db_name}`.")
+        archive_db_name = f'season-{season_number}-{guild.id}-leaderboard.db'
+        archived_rows = await asyncio.to_thread(ledger.archive_guild_season, guild.id, archive_db_name, DB_FILE)
+        if archived_rows and final_channel:
+            await final_channel.send(f"Los puntos de la temporada han sido archivados en `{archive_db_name}`.")
         
-        # Resetea la base de datos para la nueva temporada.
+        # El ranking del servidor empieza de cero para la nueva temporada.
         if puntos_cog:
-            puntos_cog._initialize_database()
+            puntos_cog._bump_ranking_version(guild.id)
+        self.bot.events.publish(PointsChanged(guild.id, None, 'season', (), archived_rows))
         
         # Actualiza el estado a inactivo.
-        save_season_data({"active": False, "name": None, "end_time": None, "season_number": season_number, "channel_id": None})
+        self.seasons.set(guild.id, {"active": False, "name": None, "end_time": None, "season_number": season_number, "channel_id": None})
 
     # --- COMANDOS ---
     @app_commands.command(name="start", description="Inicia una nueva temporada.")
     @app_commands.describe(nombre="El nombre para esta nueva temporada.", duracion="Duración (ej: 30d, 4w, 12h).")
-    @app_commands.checks.has_role(ADMIN_ROLE_ID) # Usando el decorador de chequeo de rol.
+    @guild_admin() # Rol de administrador configurado para este servidor.
     async def season_start(self, interaction: discord.Interaction, nombre: str, duracion: str):
-        status = load_season_data()
+        status = self.seasons.get(interaction.guild_id)
         if status.get("active"):
             return await interaction.response.send_message("❌ Ya hay una temporada activa. Termínala primero.", ephemeral=True)
 
@@ -144,7 +139,7 @@ class Temporadas(commands.GroupCog, name="season", description="Comandos para ge
             'season_number': new_season_number,
             'channel_id': None # Aquí iría new_channel.id
         }
-        save_season_data(new_status)
+        self.seasons.set(interaction.guild_id, new_status)
 
         embed = discord.Embed(title=f"✨ ¡Nueva Temporada Iniciada: {nombre}! ✨", color=discord.Color.brand_green())
         embed.add_field(name="Inicio", value=discord.utils.format_dt(start_date, 'F'), inline=False)
@@ -154,7 +149,7 @@ class Temporadas(commands.GroupCog, name="season", description="Comandos para ge
         await interaction.followup.send(embed=embed)
 
     @app_commands.command(name="end", description="Termina la temporada actual de forma manual.")
-    @app_commands.checks.has_role(ADMIN_ROLE_ID)
+    @guild_admin()
     async def season_end(self, interaction: discord.Interaction):
         await interaction.response.defer(thinking=True)
         await self.end_season_logic(interaction.guild, interaction.channel)
@@ -162,7 +157,7 @@ class Temporadas(commands.GroupCog, name="season", description="Comandos para ge
 
     @app_commands.command(name="status", description="Muestra el estado de la temporada actual.")
     async def season_status(self, interaction: discord.Interaction):
-        status = load_season_data()
+        status = self.seasons.get(interaction.guild_id)
         if status.get("active"):
             end_time = datetime.fromisoformat(status["end_time"])
             embed = discord.Embed(title=f"Temporada en Curso: {status['name']}", color=discord.Color.blue())
@@ -182,8 +177,8 @@ class Temporadas(commands.GroupCog, name="season", description="Comandos para ge
                 await interaction.response.send_message("Ocurrió un error inesperado.", ephemeral=True)
             else:
                 await interaction.followup.send("Ocurrió un error inesperado.", ephemeral=True)
-            print(f"Error en un comando de Temporadas por {interaction.user}: {error}")
-            traceback.print_exc()
+            log.error("Error en un comando de Temporadas por %s: %s", interaction.user, error, exc_info=error,
+                      extra={'guild_id': interaction.guild_id, 'user_id': interaction.user.id})
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(Temporadas(bot))
@@ -0,0 +1,3 @@
+# utils/
+# Módulos de apoyo compartidos por los cogs. Salvo `checks.py`, nada de lo que vive aquí
+# importa `discord`, de modo que puede reutilizarse desde scripts y herramientas offline.
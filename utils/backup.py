@@ -0,0 +1,259 @@
+# utils/backup.py
+# Copias de seguridad en caliente del libro de puntos y del estado de los envíos, con rotación y restauración verificada.
+import glob
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timezone
+from utils import ledger, state
+from utils.judged import db_path as judged_db_path
+from utils.rules import RULES_HISTORY_DIR
+
+log = logging.getLogger(__name__)
+
+# --- CONFIGURACIÓN ---
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+# Cada cuántas horas se hace una copia automática (0 desactiva la tarea).
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", 6))
+# Copias que se conservan; al terminar una nueva se borran las más antiguas.
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 14))
+# Páginas por paso de la API de backup de SQLite y pausa entre pasos: entre paso y paso
+# la base queda libre para los escritores.
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", 256))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", 0.005))
+# Veces que se deja reiniciar la copia por pasos antes de copiar la base de una vez (ver `backup_database`).
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", 3))
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+# Temporadas archivadas por /season end (en la carpeta del bot).
+SEASON_ARCHIVE_GLOB = 'season-*-*-leaderboard.db'
+
+class BackupError(Exception):
+    """Una copia que no se pudo hacer o que no pasa la verificación."""
+
+class _Restarted(Exception):
+    pass
+
+# --- FUNCIONES DE AYUDA ---
+def snapshot_name(label: str = None) -> str:
+    name = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+    return f"{name}-{label}" if label else name
+
+def snapshot_path(path: str) -> str:
+    """Ruta dentro de la copia: la misma que en la carpeta del bot, o solo el nombre si está fuera."""
+    relative = os.path.relpath(path)
+    return os.path.basename(path) if relative.startswith('..') else relative
+
+def databases() -> list:
+    """Bases SQLite que se copian con la API de backup."""
+    paths = [ledger.DB_FILE, judged_db_path()] + sorted(glob.glob(SEASON_ARCHIVE_GLOB))
+    return [path for path in paths if os.path.exists(path)]
+
+def state_files() -> list:
+    """
+    Archivos JSON de estado: las particiones de data/, el historial de reglas y los archivos
+    de la carpeta del bot (los heredados de cuando atendía a un solo servidor, la configuración).
+    """
+    paths = glob.glob('*.json')
+    for directory in (state.DATA_DIR, RULES_HISTORY_DIR):
+        for root, _, files in os.walk(directory):
+            paths.extend(os.path.join(root, name) for name in files if name.endswith('.json'))
+    return sorted(paths)
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def integrity_problems(db_file: str) -> list:
+    """PRAGMA integrity_check de una base (lista vacía si está sana)."""
+    con = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in con.execute("PRAGMA integrity_check")]
+        return [] if problems == ['ok'] else problems
+    finally:
+        con.close()
+
+# --- COPIA ---
+def backup_database(src: str, dest: str, pages: int = BACKUP_PAGES_PER_STEP, sleep: float = BACKUP_STEP_SLEEP,
+                    max_restarts: int = BACKUP_MAX_RESTARTS) -> int:
+    """
+    Copia una base en uso con la API de backup de SQLite, `pages` páginas por paso, y
+    devuelve cuántas veces se reinició. Cada escritura de otra conexión entre dos pasos hace
+    que SQLite empiece de nuevo, así que con el bot escribiendo sin parar la copia por pasos
+    podría no terminar nunca: tras `max_restarts` reinicios se copia en un solo paso, que en
+    modo WAL solo retiene una lectura y tampoco bloquea a los escritores.
+    """
+    source = ledger.connect(src)
+    target = sqlite3.connect(dest)
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _Restarted()
+        last_remaining = remaining
+
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=sleep)
+        except _Restarted:
+            source.backup(target)
+        # La copia es un solo archivo: sin WAL, abrirla en solo lectura no deja -wal ni -shm al lado.
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+    return restarts
+
+def create_backup(label: str = None, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+                  pages: int = BACKUP_PAGES_PER_STEP, sleep: float = BACKUP_STEP_SLEEP) -> dict:
+    """
+    Hace una copia completa en `backup_dir/<fecha>[-label]/`: las bases SQLite con la API de
+    backup (comprobadas con integrity_check) y los JSON de estado, más un manifiesto con el
+    sha256 de cada archivo. Se escribe en una carpeta temporal que se renombra al terminar,
+    así que una copia a medias nunca aparece en la lista. Después borra las copias que pasen
+    de `keep` (None no borra ninguna).
+    """
+    start = time.perf_counter()
+    os.makedirs(backup_dir, exist_ok=True)
+    name = base_name = snapshot_name(label)
+    # Dos copias en el mismo segundo (una manual justo tras la automática) no se pisan.
+    for suffix in itertools.count(2):
+        if not os.path.exists(os.path.join(backup_dir, name)):
+            break
+        name = f"{base_name}.{suffix}"
+    final_path = os.path.join(backup_dir, name)
+    partial_path = os.path.join(backup_dir, f".{name}.partial")
+    shutil.rmtree(partial_path, ignore_errors=True)
+    report = {'name': name, 'path': final_path, 'databases': 0, 'files': 0, 'bytes': 0, 'restarts': 0, 'removed': []}
+    manifest = {'version': MANIFEST_VERSION, 'created': datetime.now(timezone.utc).isoformat(), 'label': label, 'files': {}}
+    try:
+        for path in databases():
+            dest = os.path.join(partial_path, snapshot_path(path))
+            os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+            report['restarts'] += backup_database(path, dest, pages, sleep)
+            problems = integrity_problems(dest)
+            if problems:
+                raise BackupError(f"La copia de {path} no pasa integrity_check: {'; '.join(problems[:5])}")
+            manifest['files'][snapshot_path(path)] = {'path': path, 'kind': 'sqlite'}
+            report['databases'] += 1
+        # Los JSON se guardan con un reemplazo atómico (state.save_json): copiar lee siempre un archivo completo.
+        for path in state_files():
+            dest = os.path.join(partial_path, snapshot_path(path))
+            os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+            try:
+                shutil.copy2(path, dest)
+            except FileNotFoundError:
+                continue
+            manifest['files'][snapshot_path(path)] = {'path': path, 'kind': 'json'}
+            report['files'] += 1
+        for relative, entry in manifest['files'].items():
+            copied = os.path.join(partial_path, relative)
+            entry['sha256'] = file_digest(copied)
+            entry['bytes'] = os.path.getsize(copied)
+            report['bytes'] += entry['bytes']
+        state.save_json(os.path.join(partial_path, MANIFEST_FILE), manifest, durable=True)
+        os.replace(partial_path, final_path)
+    except BaseException:
+        shutil.rmtree(partial_path, ignore_errors=True)
+        raise
+    if keep is not None:
+        report['removed'] = rotate_backups(backup_dir, keep)
+    report['elapsed'] = time.perf_counter() - start
+    log.info("Copia de seguridad %s creada: %d bases, %d archivos JSON, %.1f KiB (%d reinicios), %d copias antiguas borradas.",
+             name, report['databases'], report['files'], report['bytes'] / 1024, report['restarts'], len(report['removed']),
+             extra={'elapsed_ms': round(report['elapsed'] * 1000, 1)})
+    return report
+
+# --- ROTACIÓN Y LISTADO ---
+def list_backups(backup_dir: str = BACKUP_DIR) -> list:
+    """Nombres de las copias terminadas (con manifiesto), de la más antigua a la más reciente."""
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted(name for name in os.listdir(backup_dir)
+                  if not name.startswith('.') and os.path.exists(os.path.join(backup_dir, name, MANIFEST_FILE)))
+
+def rotate_backups(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> list:
+    """Borra las copias más antiguas hasta dejar `keep`. Devuelve los nombres borrados."""
+    removed = list_backups(backup_dir)[:-keep] if keep > 0 else []
+    for name in removed:
+        shutil.rmtree(os.path.join(backup_dir, name), ignore_errors=True)
+    return removed
+
+def read_manifest(name: str, backup_dir: str = BACKUP_DIR) -> dict:
+    manifest = state.load_json(os.path.join(backup_dir, name, MANIFEST_FILE), None)
+    if manifest is None:
+        raise BackupError(f"La copia '{name}' no existe o no tiene manifiesto.")
+    return manifest
+
+# --- VERIFICACIÓN Y RESTAURACIÓN ---
+def verify_backup(name: str, backup_dir: str = BACKUP_DIR) -> list:
+    """Problemas de una copia: archivos que faltan, sha256 que no coincide o bases que no pasan integrity_check."""
+    manifest = read_manifest(name, backup_dir)
+    problems = []
+    for relative, entry in manifest['files'].items():
+        path = os.path.join(backup_dir, name, relative)
+        if not os.path.exists(path):
+            problems.append(f"{relative}: falta en la copia")
+        elif file_digest(path) != entry['sha256']:
+            problems.append(f"{relative}: el sha256 no coincide con el manifiesto")
+        elif entry['kind'] == 'sqlite':
+            problems.extend(f"{relative}: {problem}" for problem in integrity_problems(path)[:5])
+    return problems
+
+def restore_database(src: str, dest: str):
+    """Vuelca la base copiada sobre la de destino con la API de backup (respeta su WAL en vez de pisar el archivo)."""
+    if os.path.dirname(dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+    source = sqlite3.connect(f"file:{src}?mode=ro", uri=True)
+    target = ledger.connect(dest)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+def restore_backup(name: str, backup_dir: str = BACKUP_DIR) -> dict:
+    """
+    Restaura una copia después de verificarla entera; con el bot apagado, porque el bot tiene
+    el estado cacheado. Antes guarda el estado actual en una copia `-pre-restore` (que no
+    rota ninguna otra). Los JSON de data/ que no existían en la copia se retiran para que el
+    estado quede igual que entonces (siguen en la copia previa).
+    """
+    problems = verify_backup(name, backup_dir)
+    if problems:
+        raise BackupError(f"La copia '{name}' no pasa la verificación: {'; '.join(problems[:5])}")
+    manifest = read_manifest(name, backup_dir)
+    safety = create_backup('pre-restore', backup_dir, keep=None)
+    restored = set()
+    for relative, entry in manifest['files'].items():
+        src = os.path.join(backup_dir, name, relative)
+        dest = entry['path']
+        if entry['kind'] == 'sqlite':
+            restore_database(src, dest)
+            problems = integrity_problems(dest)
+            if problems:
+                raise BackupError(f"{dest} no pasa integrity_check tras restaurarla: {'; '.join(problems[:5])}")
+        else:
+            if os.path.dirname(dest):
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copy2(src, f"{dest}.tmp")
+            os.replace(f"{dest}.tmp", dest)
+        restored.add(os.path.normpath(dest))
+    removed = [path for path in state_files()
+               if os.path.normpath(path) not in restored and os.path.normpath(path).startswith(os.path.normpath(state.DATA_DIR) + os.sep)]
+    for path in removed:
+        os.remove(path)
+    log.info("Copia %s restaurada: %d archivos, %d JSON retirados (estado anterior en %s).",
+             name, len(restored), len(removed), safety['name'])
+    return {'name': name, 'files': len(restored), 'removed': removed, 'safety': safety['name']}
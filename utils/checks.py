@@ -0,0 +1,24 @@
+# utils/checks.py
+# Comprobaciones de permisos para comandos de barra según la configuración de cada servidor.
+from discord import app_commands
+
+def has_admin_role(bot, guild_id: int, member) -> bool:
+    """True si el miembro tiene el rol de administrador configurado para su servidor."""
+    admin_role_id = bot.guild_config.get(guild_id)['admin_role_id']
+    return any(role.id == admin_role_id for role in getattr(member, 'roles', []))
+
+def guild_admin():
+    """Equivalente a `app_commands.checks.has_role`, pero con el rol configurado en cada servidor."""
+    async def predicate(interaction) -> bool:
+        if interaction.guild is None or not has_admin_role(interaction.client, interaction.guild_id, interaction.user):
+            raise app_commands.MissingRole(interaction.client.guild_config.get(interaction.guild_id)['admin_role_id'])
+        return True
+    return app_commands.check(predicate)
+
+def bot_owner():
+    """Solo el dueño de la aplicación: para los comandos que afectan a todos los servidores."""
+    async def predicate(interaction) -> bool:
+        if not await interaction.client.is_owner(interaction.user):
+            raise app_commands.CheckFailure("Solo el dueño del bot puede usar este comando.")
+        return True
+    return app_commands.check(predicate)
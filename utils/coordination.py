@@ -0,0 +1,102 @@
+# utils/coordination.py
+# Coordinación entre procesos (shards) a través de leaderboard.db, que todos comparten en modo WAL.
+import os
+import socket
+import sqlite3
+import time
+
+class Coordinator:
+    """
+    Latidos de cada proceso, arrendamientos para las tareas que solo debe ejecutar uno
+    (compactación, ranking global) y el ranking global materializado que leen todos.
+    """
+    def __init__(self, db_file: str, shard_ids=None):
+        self.db_file = db_file
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.shard_ids = list(shard_ids or [])
+        self._initialize_tables()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file, timeout=30)
+
+    def _initialize_tables(self):
+        con = self._connect()
+        try:
+            con.execute("CREATE TABLE IF NOT EXISTS shard_heartbeats (owner TEXT PRIMARY KEY, shard_ids TEXT, guild_count INTEGER, updated_at REAL)")
+            con.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+            con.execute("CREATE TABLE IF NOT EXISTS global_ranking (user_id INTEGER PRIMARY KEY, total_points INTEGER NOT NULL, guild_count INTEGER NOT NULL, updated_at REAL NOT NULL)")
+            con.commit()
+        finally:
+            con.close()
+
+    # --- LATIDOS ---
+    def heartbeat(self, guild_count: int):
+        """Registra que este proceso sigue vivo y cuántos servidores atiende."""
+        con = self._connect()
+        try:
+            con.execute(
+                "INSERT OR REPLACE INTO shard_heartbeats (owner, shard_ids, guild_count, updated_at) VALUES (?, ?, ?, ?)",
+                (self.owner, ",".join(map(str, self.shard_ids)), guild_count, time.time())
+            )
+            con.commit()
+        finally:
+            con.close()
+
+    def live_processes(self, max_age: float = 600):
+        """Procesos con un latido reciente: [(owner, shard_ids, guild_count, updated_at)]."""
+        con = self._connect()
+        try:
+            return con.execute("SELECT owner, shard_ids, guild_count, updated_at FROM shard_heartbeats WHERE updated_at >= ? ORDER BY owner", (time.time() - max_age,)).fetchall()
+        finally:
+            con.close()
+
+    # --- ARRENDAMIENTOS ---
+    def try_acquire(self, name: str, ttl: float) -> bool:
+        """Intenta quedarse (o renovar) el arrendamiento `name` durante `ttl` segundos."""
+        now = time.time()
+        con = self._connect()
+        try:
+            con.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at < ? OR leases.owner = excluded.owner",
+                (name, self.owner, now + ttl, now)
+            )
+            con.commit()
+            row = con.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+            return bool(row) and row[0] == self.owner
+        finally:
+            con.close()
+
+    # --- RANKING GLOBAL ---
+    def refresh_global_ranking(self) -> int:
+        """Recalcula el ranking de todos los servidores. Solo debe hacerlo quien tenga el arrendamiento."""
+        con = self._connect()
+        try:
+            with con:
+                con.execute("DELETE FROM global_ranking")
+                con.execute(
+                    "INSERT INTO global_ranking (user_id, total_points, guild_count, updated_at) "
+                    "SELECT user_id, SUM(points), COUNT(DISTINCT guild_id), ? FROM puntuaciones "
+                    "GROUP BY user_id HAVING SUM(points) != 0",
+                    (time.time(),)
+                )
+            return con.execute("SELECT COUNT(*) FROM global_ranking").fetchone()[0]
+        finally:
+            con.close()
+
+    def global_ranking_version(self) -> float:
+        """Momento del último recálculo del ranking global (0 si nunca se ha calculado)."""
+        con = self._connect()
+        try:
+            return con.execute("SELECT MAX(updated_at) FROM global_ranking").fetchone()[0] or 0
+        finally:
+            con.close()
+
+    def global_ranking(self):
+        """[(user_id, total_points)] de todos los servidores, de mayor a menor."""
+        con = self._connect()
+        try:
+            return con.execute("SELECT user_id, total_points FROM global_ranking ORDER BY total_points DESC").fetchall()
+        finally:
+            con.close()
@@ -0,0 +1,178 @@
+# utils/events.py
+# Bus de eventos interno: los cogs publican cambios y las vistas derivadas se suscriben sin retrasar a quien publica.
+import asyncio
+import inspect
+import logging
+from collections import Counter, namedtuple
+
+log = logging.getLogger(__name__)
+
+# --- EVENTOS ---
+# Puntos escritos en el libro. `rows` son pares (user_id, puntos) de las filas nuevas; `category`
+# es None cuando el cambio no es de una sola categoría (reparaciones, recálculos, cambio de temporada).
+PointsChanged = namedtuple('PointsChanged', 'guild_id category reason rows inserted')
+# Un envío cambió de estado: 'approved', 'denied' o 'reverted' (vuelve a poder juzgarse).
+SubmissionJudged = namedtuple('SubmissionJudged', 'guild_id kind message_id status points moderator_id')
+
+# Eventos que cada suscriptor puede tener en cola, por defecto.
+DEFAULT_QUEUE_SIZE = 1000
+
+# --- SUSCRIPCIONES ---
+class Subscription:
+    """
+    Cola acotada y tarea propia de un suscriptor. Publicar nunca espera: si la cola está
+    llena se descarta el evento más antiguo y se cuenta en `dropped`, así un suscriptor lento
+    solo se retrasa a sí mismo. Sirve a los suscriptores que tratan cada evento como un aviso
+    y vuelven a leer el estado (como el tablero); los que agregan usan CoalescingSubscription.
+    """
+    def __init__(self, event_types, handler, name: str, maxsize: int):
+        self.event_types = event_types
+        self.handler = handler
+        self.name = name
+        self.queue = asyncio.Queue(maxsize)
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def offer(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def _next(self):
+        return await self.queue.get()
+
+    async def _run(self):
+        while True:
+            event = await self._next()
+            try:
+                result = self.handler(event)
+                if inspect.isawaitable(result):
+                    await result
+                self.delivered += 1
+            except Exception:
+                self.failed += 1
+                log.exception("Error en el suscriptor '%s' con el evento %s", self.name, type(event).__name__,
+                              extra={'guild_id': getattr(event, 'guild_id', None)})
+            finally:
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        return {'name': self.name, 'queued': self.queue.qsize(), 'delivered': self.delivered, 'dropped': self.dropped, 'failed': self.failed}
+
+class CoalescingSubscription(Subscription):
+    """
+    Suscripción sin pérdidas para las vistas que solo suman (auditoría, métricas). En lugar de
+    encolar cada evento, `fold(resumen, evento)` lo acumula en un resumen pendiente y el manejador
+    recibe resúmenes: mientras procesa uno, lo que se publique se pliega en el siguiente. Publicar
+    sigue sin esperar y la memoria depende de las claves del resumen, no de cuántos eventos lleguen.
+    """
+    def __init__(self, event_types, handler, name: str, fold, initial=Counter):
+        self.fold = fold
+        self.initial = initial
+        self.pending = None
+        self.pending_events = 0
+        self.coalesced = 0
+        super().__init__(event_types, handler, name, maxsize=1)
+
+    def offer(self, event):
+        if self.pending is None:
+            self.pending = self.initial()
+            self.queue.put_nowait(self.pending)
+        self.fold(self.pending, event)
+        self.pending_events += 1
+        self.coalesced += 1
+
+    async def _next(self):
+        summary = await self.queue.get()
+        # Lo que se publique a partir de aquí va al resumen siguiente.
+        self.pending = None
+        self.pending_events = 0
+        return summary
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'queued': self.pending_events, 'coalesced': self.coalesced}
+
+# --- BUS ---
+class EventBus:
+    """
+    Publicación/suscripción dentro del proceso, por tipo de evento.
+
+    `publish` es síncrono y barato (una inserción en la cola de cada suscriptor), así que se
+    puede llamar desde el camino de una aprobación sin añadirle esperas. Cada suscriptor
+    procesa sus eventos en orden en su propia tarea.
+    """
+    def __init__(self):
+        self._subscriptions = []
+        self.published = 0
+
+    def subscribe(self, event_types, handler, name: str, maxsize: int = DEFAULT_QUEUE_SIZE, fold=None, initial=Counter) -> Subscription:
+        """
+        Llama a `handler(evento)` (función o corrutina) con cada evento de `event_types`. Con `fold`
+        la suscripción no pierde eventos: el manejador recibe resúmenes (ver CoalescingSubscription).
+        Requiere el bucle en marcha.
+        """
+        if isinstance(event_types, type):
+            event_types = (event_types,)
+        if fold:
+            subscription = CoalescingSubscription(tuple(event_types), handler, name, fold, initial)
+        else:
+            subscription = Subscription(tuple(event_types), handler, name, maxsize)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+        subscription.task.cancel()
+
+    def publish(self, event):
+        self.published += 1
+        for subscription in self._subscriptions:
+            if isinstance(event, subscription.event_types):
+                subscription.offer(event)
+
+    async def drain(self, timeout: float = None) -> bool:
+        """Espera a que los suscriptores vacíen sus colas. Devuelve False si no terminaron a tiempo."""
+        waits = [subscription.queue.join() for subscription in self._subscriptions]
+        if not waits:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.gather(*waits), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stats(self) -> list:
+        return [subscription.stats() for subscription in self._subscriptions]
+
+# --- MÉTRICAS ---
+class EventMetrics:
+    """
+    Contadores del bot a partir del bus: escrituras, filas y puntos por motivo, y envíos juzgados
+    por tipo y estado. Se suscribe sin pérdidas, así que las cifras son exactas aunque vaya por
+    detrás en una ráfaga.
+    """
+    def __init__(self):
+        self.totals = Counter()
+        self.subscription = None
+
+    @staticmethod
+    def fold(summary: Counter, event):
+        if isinstance(event, PointsChanged):
+            summary[f'points.{event.reason}.writes'] += 1
+            summary[f'points.{event.reason}.rows'] += event.inserted
+            summary[f'points.{event.reason}.points'] += sum(points for _, points in event.rows)
+        else:
+            summary[f'judged.{event.kind}.{event.status}'] += 1
+
+    def subscribe(self, bus: EventBus):
+        self.subscription = bus.subscribe((PointsChanged, SubmissionJudged), self.totals.update, 'métricas', fold=self.fold)
+
+    def unsubscribe(self, bus: EventBus):
+        if self.subscription:
+            bus.unsubscribe(self.subscription)
+            self.subscription = None
@@ -0,0 +1,238 @@
+# utils/export.py
+# Exportación en streaming del libro de puntos, los envíos y las temporadas archivadas a CSV o JSONL.
+import csv
+import glob
+import gzip
+import itertools
+import json
+import os
+import re
+from utils import ledger, state
+from utils.verify import JUDGED_FILES, judged_stores
+
+# --- CONFIGURACIÓN ---
+PENDING_FILES = {
+    'ataque': 'pending_attacks.json',
+    'defensa': 'pending_defenses.json',
+    'tempo': 'pending_tempo.json',
+    'interserver': 'pending_interserver.json',
+    'koth': 'pending_koth.json',
+}
+SEASON_ARCHIVE_PATTERN = re.compile(r'season-(\d+)-(\d+)-leaderboard\.db$')
+DATASETS = ('ledger', 'ledger-archive', 'submissions', 'seasons')
+FORMATS = ('csv', 'jsonl')
+
+LEDGER_COLUMNS = ['id', 'user_id', 'guild_id', 'category', 'points', 'timestamp', 'source_key']
+# Las columnas planas son para hojas de cálculo; `data` lleva el envío completo en JSON para
+# recalcular, auditar o volver a importarlo sin perder campos.
+SUBMISSION_COLUMNS = ['guild_id', 'kind', 'state', 'message_id', 'status', 'points', 'allies', 'seq', 'channel_id',
+                      'base_points', 'multiplier_applied', 'multiplier_emoji', 'rules_version', 'rules_season', 'rescore_seq', 'data']
+SEASON_COLUMNS = ['season_number', 'guild_id', 'user_id', 'category', 'points']
+# Envíos importados entre guardado y guardado del almacén de juzgados.
+IMPORT_CHUNK_SIZE = 1000
+
+# --- ESCRITORES ---
+class _Writer:
+    """Escribe filas (listas) en CSV o JSONL, comprimiendo con gzip si la ruta acaba en .gz."""
+    def __init__(self, path: str, fmt: str, columns):
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato desconocido: {fmt}")
+        self.fmt = fmt
+        self.columns = columns
+        self.rows = 0
+        opener = gzip.open if path.endswith('.gz') else open
+        self.file = opener(path, 'wt', newline='', encoding='utf-8')
+        if fmt == 'csv':
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(columns)
+
+    def write_many(self, rows):
+        if self.fmt == 'csv':
+            self.csv.writerows(rows)
+        else:
+            self.file.writelines(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False, default=str) + '\n' for row in rows)
+        self.rows += len(rows)
+
+    def close(self):
+        self.file.close()
+
+def _stream_query(con, sql: str, params, writer: _Writer, chunk_size: int):
+    """Vuelca una consulta por bloques de `chunk_size` filas con fetchmany; nunca la carga entera."""
+    cur = con.execute(sql, params)
+    while rows := cur.fetchmany(chunk_size):
+        writer.write_many(rows)
+
+# --- CONJUNTOS DE DATOS ---
+def _export_ledger(writer, guild_id, db_file, chunk_size, table='puntuaciones'):
+    """
+    `puntuaciones` ya suma bien por sí sola (los checkpoints incluyen lo plegado);
+    `puntuaciones_archive` son las filas originales que se plegaron, solo para auditoría.
+    """
+    where, params = ("WHERE guild_id = ?", (guild_id,)) if guild_id else ("", ())
+    con = ledger.connect(db_file)
+    try:
+        _stream_query(con, f"SELECT {', '.join(LEDGER_COLUMNS)} FROM {table} {where} ORDER BY id", params, writer, chunk_size)
+    finally:
+        con.close()
+
+def _export_documents(writer, gid, kind, store_state, documents, chunk_size):
+    batch = []
+    for message_id, submission in documents.items():
+        batch.append([
+            gid, kind, store_state, message_id, submission.get('status', 'pending'), submission.get('points'),
+            " ".join(map(str, submission.get('allies', []))), submission.get('seq', 0), submission.get('channel_id'),
+            submission.get('base_points'), submission.get('multiplier_applied'), submission.get('multiplier_emoji'),
+            submission.get('rules_version'), submission.get('rules_season'), submission.get('rescore_seq'),
+            json.dumps(submission, ensure_ascii=False, sort_keys=True),
+        ])
+        if len(batch) >= chunk_size:
+            writer.write_many(batch)
+            batch = []
+    writer.write_many(batch)
+
+def _export_submissions(writer, guild_id, chunk_size):
+    judged = judged_stores()
+    try:
+        guild_ids = [guild_id] if guild_id else sorted(
+            {gid for filename in PENDING_FILES.values() for gid in state.guild_ids_with(filename)}
+            | {gid for store in judged.values() for gid in store.guild_ids()}
+            | ({state.LEGACY_GUILD_ID} if state.LEGACY_GUILD_ID else set())
+        )
+        for gid in guild_ids:
+            for kind in PENDING_FILES:
+                filename = PENDING_FILES[kind]
+                pending = state.load_json(state.partition_path(gid, filename, filename), {})
+                _export_documents(writer, gid, kind, 'pending', pending, chunk_size)
+                # Los juzgados se leen del almacén por páginas, sin cargarlos enteros.
+                _export_documents(writer, gid, kind, 'judged', judged[kind].get(gid), chunk_size)
+    finally:
+        for store in judged.values():
+            store.close()
+
+def _export_seasons(writer, guild_id, chunk_size, archive_dir='.'):
+    for path in sorted(glob.glob(os.path.join(archive_dir, 'season-*-*-leaderboard.db'))):
+        match = SEASON_ARCHIVE_PATTERN.search(os.path.basename(path))
+        if not match:
+            continue
+        season_number, archive_guild = int(match.group(1)), int(match.group(2))
+        if guild_id and archive_guild != guild_id:
+            continue
+        con = ledger.connect(path)
+        try:
+            _stream_query(con, '''
+                SELECT ?, guild_id, user_id, category, SUM(points) FROM puntuaciones
+                GROUP BY guild_id, user_id, category ORDER BY user_id, category
+            ''', (season_number,), writer, chunk_size)
+        finally:
+            con.close()
+
+# --- PUNTO DE ENTRADA ---
+def export(dataset: str, path: str, fmt: str = 'csv', guild_id: int = None,
+           db_file: str = ledger.DB_FILE, chunk_size: int = 5000) -> int:
+    """
+    Exporta `dataset` ('ledger', 'ledger-archive', 'submissions' o 'seasons') a `path` en CSV o JSONL,
+    comprimido con gzip si `path` acaba en .gz. Con `guild_id` solo se exporta ese servidor.
+    Lee y escribe por bloques de `chunk_size`, así que la memoria no depende del tamaño
+    de la tabla. Es síncrona y bloqueante: desde el bot debe llamarse con `asyncio.to_thread`.
+    Devuelve el número de filas exportadas.
+    """
+    columns = {'ledger': LEDGER_COLUMNS, 'ledger-archive': LEDGER_COLUMNS, 'submissions': SUBMISSION_COLUMNS, 'seasons': SEASON_COLUMNS}.get(dataset)
+    if columns is None:
+        raise ValueError(f"Conjunto de datos desconocido: {dataset}")
+    writer = _Writer(path, fmt, columns)
+    try:
+        if dataset == 'ledger':
+            _export_ledger(writer, guild_id, db_file, chunk_size)
+        elif dataset == 'ledger-archive':
+            _export_ledger(writer, guild_id, db_file, chunk_size, 'puntuaciones_archive')
+        elif dataset == 'submissions':
+            _export_submissions(writer, guild_id, chunk_size)
+        else:
+            _export_seasons(writer, guild_id, chunk_size, os.path.dirname(db_file) or '.')
+    finally:
+        writer.close()
+    return writer.rows
+
+# --- IMPORTACIÓN ---
+def _read_export_rows(path: str):
+    """Filas de una exportación de envíos en JSONL (comprimida o no)."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def _submission_from_row(row: dict) -> dict:
+    """
+    El envío de una fila exportada: el documento completo de `data` si lo trae, o si no (exportaciones
+    antiguas) reconstruido campo a campo a partir de las columnas planas.
+    """
+    if row.get('data'):
+        return json.loads(row['data'])
+    submission = {'allies': row['allies'].split() if row.get('allies') else []}
+    if row.get('points') is not None:
+        submission['points'] = row['points']
+    if row.get('state') == 'judged':
+        submission['status'] = row['status']
+    if row.get('seq'):
+        submission['seq'] = row['seq']
+    for field in ('channel_id', 'base_points', 'multiplier_applied', 'multiplier_emoji', 'rules_version', 'rules_season', 'rescore_seq'):
+        if row.get(field) is not None:
+            submission[field] = row[field]
+    return submission
+
+def _import_entries(path: str, guild_id: int, kind: str, store: str):
+    """((servidor, archivo), message_id, envío) en el orden del archivo, sin cargar una exportación JSONL entera."""
+    if path.endswith(('.jsonl', '.jsonl.gz')):
+        for row in _read_export_rows(path):
+            row_guild = int(row['guild_id'])
+            if guild_id and row_guild != guild_id:
+                continue
+            filenames = JUDGED_FILES if row['state'] == 'judged' else PENDING_FILES
+            yield (row_guild, filenames[row['kind']]), str(row['message_id']), _submission_from_row(row)
+        return
+    guild_id = guild_id or state.LEGACY_GUILD_ID
+    if not guild_id or kind not in PENDING_FILES or store not in ('pending', 'judged'):
+        raise ValueError("Para importar un documento JSON hay que indicar el servidor, el tipo y el estado (pending/judged).")
+    filename = (JUDGED_FILES if store == 'judged' else PENDING_FILES)[kind]
+    for message_id, submission in state.load_json(path, {}).items():
+        yield (guild_id, filename), str(message_id), submission
+
+def import_json(path: str, guild_id: int = None, kind: str = None, store: str = 'judged', overwrite: bool = False) -> dict:
+    """
+    Incorpora envíos al estado particionado (data/<guild_id>/... y el almacén de juzgados).
+
+    Acepta un documento JSON {message_id: envío} como los de los cogs (hace falta indicar
+    `kind`, `store` y el servidor) o una exportación JSONL de 'submissions', que ya trae
+    servidor, tipo y estado en cada fila. La exportación se lee en streaming y se aplica por
+    tramos de filas seguidas del mismo servidor y archivo, como salen de `export`.
+    Los envíos que ya existen no se tocan salvo con `overwrite`. El bot debe estar apagado:
+    tiene el estado cacheado en memoria.
+    Devuelve {'imported': n, 'skipped': n, 'files': n}.
+    """
+    report = {'imported': 0, 'skipped': 0, 'files': 0}
+    files = set()
+    judged = {judged_store.filename: judged_store for judged_store in judged_stores().values()}
+    try:
+        for (target_guild, filename), entries in itertools.groupby(_import_entries(path, guild_id, kind, store), key=lambda entry: entry[0]):
+            # Los juzgados van al almacén SQLite; los pendientes, a su JSON.
+            judged_store = judged.get(filename)
+            current = judged_store.get(target_guild) if judged_store else state.load_json(state.partition_path(target_guild, filename, filename), {})
+            for _, message_id, submission in entries:
+                if message_id in current and not overwrite:
+                    report['skipped'] += 1
+                    continue
+                current[message_id] = submission
+                report['imported'] += 1
+                if judged_store and report['imported'] % IMPORT_CHUNK_SIZE == 0:
+                    judged_store.save(target_guild)
+            if judged_store:
+                judged_store.save(target_guild)
+            else:
+                state.save_json(state.guild_path(target_guild, filename), current, durable=True)
+            files.add((target_guild, filename))
+    finally:
+        for judged_store in judged.values():
+            judged_store.close()
+    report['files'] = len(files)
+    return report
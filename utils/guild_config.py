@@ -0,0 +1,64 @@
+# utils/guild_config.py
+# Configuración por servidor guardada en leaderboard.db y cacheada en memoria.
+import os
+import sqlite3
+
+# --- CONFIGURACIÓN ---
+# Campos configurables y la variable de entorno que sirve de valor por defecto.
+CONFIG_FIELDS = {
+    'admin_role_id': 'ADMIN_ROLE_ID',
+    'audit_channel_id': 'BOT_AUDIT_LOGS_CHANNEL_ID',
+    'koth_channel_id': 'KOTH_CHANNEL_ID',
+    'announcement_channel_id': 'ANNOUNCEMENT_CHANNEL_ID',
+}
+
+def defaults_from_env() -> dict:
+    """Valores globales del .env, usados por los servidores que no tienen configuración propia."""
+    return {field: int(os.getenv(env_name) or 0) for field, env_name in CONFIG_FIELDS.items()}
+
+class GuildConfigStore:
+    """Lee y escribe la tabla `guild_config`; cada servidor se consulta a disco una sola vez."""
+    def __init__(self, db_file: str, defaults: dict = None):
+        self.db_file = db_file
+        self.defaults = defaults if defaults is not None else defaults_from_env()
+        self._cache = {}
+        self._initialize_table()
+
+    def _initialize_table(self):
+        con = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            columns = ", ".join(f"{field} INTEGER" for field in CONFIG_FIELDS)
+            con.execute(f"CREATE TABLE IF NOT EXISTS guild_config (guild_id INTEGER PRIMARY KEY, {columns})")
+            con.commit()
+        finally:
+            con.close()
+
+    def get(self, guild_id: int) -> dict:
+        """Configuración efectiva del servidor: sus valores guardados y, para el resto, los del .env."""
+        if guild_id not in self._cache:
+            con = sqlite3.connect(self.db_file, timeout=30)
+            try:
+                row = con.execute(f"SELECT {', '.join(CONFIG_FIELDS)} FROM guild_config WHERE guild_id = ?", (guild_id,)).fetchone()
+            finally:
+                con.close()
+            config = dict(self.defaults)
+            if row:
+                config.update({field: value for field, value in zip(CONFIG_FIELDS, row) if value})
+            self._cache[guild_id] = config
+        return self._cache[guild_id]
+
+    def set(self, guild_id: int, **values) -> dict:
+        """Guarda uno o varios campos del servidor y actualiza la caché."""
+        unknown = set(values) - set(CONFIG_FIELDS)
+        if unknown:
+            raise ValueError(f"Campos de configuración desconocidos: {', '.join(sorted(unknown))}")
+        con = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            con.execute("INSERT OR IGNORE INTO guild_config (guild_id) VALUES (?)", (guild_id,))
+            for field, value in values.items():
+                con.execute(f"UPDATE guild_config SET {field} = ? WHERE guild_id = ?", (value, guild_id))
+            con.commit()
+        finally:
+            con.close()
+        self._cache.pop(guild_id, None)
+        return self.get(guild_id)
@@ -0,0 +1,309 @@
+# utils/judged.py
+# Envíos juzgados: un conjunto de trabajo acotado en memoria sobre un almacén SQLite indexado.
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from utils import state
+from utils.shards import owns_guild
+
+# --- CONFIGURACIÓN ---
+# Archivo del almacén (por defecto data/judged.db).
+JUDGED_DB_FILE = os.getenv("JUDGED_DB_FILE")
+# Envíos juzgados que cada tipo mantiene en memoria como máximo (el resto se lee de disco al pedirlo).
+JUDGED_CACHE_SIZE = int(os.getenv("JUDGED_CACHE_SIZE", 5000))
+# Claves por consulta al recorrer un documento entero.
+PAGE_SIZE = 1000
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS judged (
+        store TEXT NOT NULL, guild_id INTEGER NOT NULL, message_id TEXT NOT NULL, data TEXT NOT NULL,
+        PRIMARY KEY (store, guild_id, message_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS judged_migrated (
+        store TEXT NOT NULL, guild_id INTEGER NOT NULL, PRIMARY KEY (store, guild_id)
+    );
+'''
+
+def db_path() -> str:
+    return JUDGED_DB_FILE or os.path.join(state.DATA_DIR, 'judged.db')
+
+# --- DOCUMENTO DE UN SERVIDOR ---
+class JudgedDocument(MutableMapping):
+    """
+    Vista {message_id: envío} de los juzgados de un servidor, con la misma interfaz que el
+    dict de un GuildState. Los envíos se leen de disco al pedirlos y se quedan en la caché
+    del almacén mientras se usen.
+
+    Modificar un envío en sitio no basta para guardarlo: hay que reasignarlo
+    (`judged[message_id] = envío`) antes de `save()`, como ya hacen los cogs.
+    """
+    def __init__(self, store, guild_id: int):
+        self.store = store
+        self.guild_id = guild_id
+
+    def __getitem__(self, message_id):
+        submission = self.store._lookup(self.guild_id, message_id)
+        if submission is None:
+            raise KeyError(message_id)
+        return submission
+
+    def __contains__(self, message_id) -> bool:
+        return self.store._lookup(self.guild_id, message_id) is not None
+
+    def __setitem__(self, message_id, submission):
+        self.store._remember(self.guild_id, message_id, submission, dirty=True)
+
+    def __delitem__(self, message_id):
+        if message_id not in self:
+            raise KeyError(message_id)
+        self.store._forget(self.guild_id, message_id)
+
+    def __iter__(self):
+        for message_id, _ in self.store._scan(self.guild_id, with_data=False):
+            yield message_id
+
+    def __len__(self) -> int:
+        return self.store._count(self.guild_id)
+
+    def items(self):
+        """Recorre los envíos por páginas sin meterlos en la caché (para verificar, exportar...)."""
+        return self.store._scan(self.guild_id, with_data=True)
+
+    def values(self):
+        return (submission for _, submission in self.items())
+
+# --- ALMACÉN ---
+class JudgedStore:
+    """
+    Sustituto de GuildState para los juzgados: en lugar de cargar el historial entero de cada
+    servidor, guarda los envíos en SQLite (clave primaria tipo + servidor + mensaje) y
+    mantiene en memoria solo los `cache_size` más usados recientemente.
+
+    Las entradas modificadas no se expulsan hasta que `save()` las escribe. La primera vez que
+    se abre un servidor se importa su JSON (o el heredado) en una sola transacción; el
+    archivo original no se borra.
+    `hits`/`misses` cuentan los envíos encontrados en memoria y los que hubo que leer de disco;
+    `absent`, las búsquedas de mensajes que no están juzgados (siempre van a disco).
+    """
+    def __init__(self, filename: str, legacy_file: str = None, legacy_guild_id: int = state.LEGACY_GUILD_ID,
+                 cache_size: int = JUDGED_CACHE_SIZE, db_file: str = None):
+        self.filename = filename
+        self.legacy_file = legacy_file
+        self.legacy_guild_id = legacy_guild_id
+        self.cache_size = cache_size
+        self.db_file = db_file or db_path()
+        self._con = None
+        # (guild_id, message_id) -> envío; de menos a más reciente.
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._deleted = {}
+        self._documents = {}
+        self._versions = {}
+        self._migrated = set()
+        self.hits = 0
+        self.misses = 0
+        self.absent = 0
+        state._STORES.add(self)
+
+    # --- SQLITE ---
+    def _connection(self) -> sqlite3.Connection:
+        if self._con is None:
+            directory = os.path.dirname(self.db_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._con = sqlite3.connect(self.db_file, timeout=30)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.executescript(SCHEMA)
+        return self._con
+
+    def _migrate(self, guild_id: int):
+        """Importa el JSON del servidor la primera vez que se abre su documento."""
+        if guild_id in self._migrated:
+            return
+        con = self._connection()
+        if not con.execute("SELECT 1 FROM judged_migrated WHERE store = ? AND guild_id = ?", (self.filename, guild_id)).fetchone():
+            path = state.partition_path(guild_id, self.filename, self.legacy_file, self.legacy_guild_id)
+            documents = state.load_json(path, {})
+            with con:
+                con.executemany(
+                    "INSERT OR IGNORE INTO judged (store, guild_id, message_id, data) VALUES (?, ?, ?, ?)",
+                    ((self.filename, guild_id, str(message_id), json.dumps(submission)) for message_id, submission in documents.items())
+                )
+                con.execute("INSERT INTO judged_migrated (store, guild_id) VALUES (?, ?)", (self.filename, guild_id))
+        self._migrated.add(guild_id)
+
+    def adopt_legacy(self, guild_id: int) -> int:
+        """
+        Asigna el JSON heredado a `guild_id` e importa los juzgados que el servidor aún no tenga
+        (también si su documento ya se había abierto sin él). Devuelve cuántos se importaron.
+        """
+        self.legacy_guild_id = guild_id
+        self._migrate(guild_id)
+        documents = state.load_json(self.legacy_file, {}) if self.legacy_file else {}
+        if not isinstance(documents, dict) or not documents:
+            return 0
+        con = self._connection()
+        with con:
+            imported = con.executemany(
+                "INSERT OR IGNORE INTO judged (store, guild_id, message_id, data) VALUES (?, ?, ?, ?)",
+                ((self.filename, guild_id, str(message_id), json.dumps(submission)) for message_id, submission in documents.items())
+            ).rowcount
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        return imported
+
+    # --- CACHÉ ---
+    def _lookup(self, guild_id: int, message_id):
+        key = (guild_id, str(message_id))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key]
+        if key[1] in self._deleted.get(guild_id, ()):
+            return None
+        row = self._connection().execute(
+            "SELECT data FROM judged WHERE store = ? AND guild_id = ? AND message_id = ?", (self.filename, guild_id, key[1])
+        ).fetchone()
+        if row is None:
+            self.absent += 1
+            return None
+        self.misses += 1
+        submission = json.loads(row[0])
+        self._remember(guild_id, key[1], submission)
+        return submission
+
+    def _remember(self, guild_id: int, message_id, submission, dirty: bool = False):
+        key = (guild_id, str(message_id))
+        self._cache[key] = submission
+        self._cache.move_to_end(key)
+        if dirty:
+            self._dirty.setdefault(guild_id, set()).add(key[1])
+            self._deleted.get(guild_id, set()).discard(key[1])
+        self._evict()
+
+    def _forget(self, guild_id: int, message_id):
+        key = (guild_id, str(message_id))
+        self._cache.pop(key, None)
+        self._dirty.get(guild_id, set()).discard(key[1])
+        self._deleted.setdefault(guild_id, set()).add(key[1])
+
+    def _evict(self):
+        """Expulsa las entradas limpias menos usadas hasta volver al límite."""
+        excess = len(self._cache) - self.cache_size
+        if excess <= 0:
+            return
+        victims = []
+        for key in self._cache:
+            if key[1] not in self._dirty.get(key[0], ()):
+                victims.append(key)
+                if len(victims) == excess:
+                    break
+        for key in victims:
+            del self._cache[key]
+
+    def _scan(self, guild_id: int, with_data: bool):
+        """
+        Pares (message_id, envío o None) del servidor, paginados por clave para que las
+        escrituras entre página y página no afecten al recorrido. Lo que aún no se ha
+        guardado sale de la caché.
+        """
+        con = self._connection()
+        unsaved = set(self._dirty.get(guild_id, ()))
+        deleted = set(self._deleted.get(guild_id, ()))
+        last = ''
+        while True:
+            rows = con.execute(
+                f"SELECT message_id{', data' if with_data else ''} FROM judged WHERE store = ? AND guild_id = ? AND message_id > ? "
+                "ORDER BY message_id LIMIT ?", (self.filename, guild_id, last, PAGE_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                message_id = row[0]
+                if message_id in unsaved or message_id in deleted:
+                    continue
+                cached = self._cache.get((guild_id, message_id))
+                yield message_id, (cached if cached is not None else json.loads(row[1])) if with_data else None
+            last = rows[-1][0]
+        for message_id in unsaved:
+            submission = self._cache.get((guild_id, message_id))
+            if submission is not None:
+                yield message_id, submission if with_data else None
+
+    def _count(self, guild_id: int) -> int:
+        con = self._connection()
+        total = con.execute("SELECT COUNT(*) FROM judged WHERE store = ? AND guild_id = ?", (self.filename, guild_id)).fetchone()[0]
+        for message_id in self._dirty.get(guild_id, ()):
+            if not con.execute("SELECT 1 FROM judged WHERE store = ? AND guild_id = ? AND message_id = ?",
+                               (self.filename, guild_id, message_id)).fetchone():
+                total += 1
+        return total - len(self._deleted.get(guild_id, ()))
+
+    # --- INTERFAZ DE GUILDSTATE ---
+    def get(self, guild_id: int) -> JudgedDocument:
+        """Documento del servidor (el mismo objeto en cada llamada)."""
+        if guild_id not in self._documents:
+            self._migrate(guild_id)
+            self._documents[guild_id] = JudgedDocument(self, guild_id)
+        return self._documents[guild_id]
+
+    def save(self, guild_id: int, durable: bool = False):
+        """Escribe en una sola transacción los envíos reasignados o borrados desde el último guardado."""
+        dirty = self._dirty.pop(guild_id, set())
+        deleted = self._deleted.pop(guild_id, set())
+        if dirty or deleted:
+            con = self._connection()
+            with con:
+                con.executemany(
+                    "INSERT OR REPLACE INTO judged (store, guild_id, message_id, data) VALUES (?, ?, ?, ?)",
+                    [(self.filename, guild_id, message_id, json.dumps(self._cache[(guild_id, message_id)])) for message_id in dirty]
+                )
+                con.executemany("DELETE FROM judged WHERE store = ? AND guild_id = ? AND message_id = ?",
+                                [(self.filename, guild_id, message_id) for message_id in deleted])
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        self._evict()
+
+    def reload(self, guild_id: int) -> JudgedDocument:
+        """Descarta lo que hay en memoria del servidor (también lo no guardado) y devuelve un documento nuevo."""
+        for key in [key for key in self._cache if key[0] == guild_id]:
+            del self._cache[key]
+        self._dirty.pop(guild_id, None)
+        self._deleted.pop(guild_id, None)
+        self._documents.pop(guild_id, None)
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        return self.get(guild_id)
+
+    def version(self, guild_id: int) -> int:
+        return self._versions.get(guild_id, 0)
+
+    def flush(self) -> int:
+        """Guarda lo pendiente de todos los servidores. Devuelve cuántos tenían cambios."""
+        guild_ids = set(self._dirty) | set(self._deleted)
+        for guild_id in guild_ids:
+            self.save(guild_id)
+        return len(guild_ids)
+
+    def guild_ids(self):
+        """Servidores con juzgados en el almacén o todavía solo en su JSON."""
+        guild_ids = {row[0] for row in self._connection().execute("SELECT DISTINCT guild_id FROM judged WHERE store = ?", (self.filename,))}
+        guild_ids.update(state.guild_ids_with(self.filename))
+        if self.legacy_file and self.legacy_guild_id and os.path.exists(self.legacy_file):
+            guild_ids.add(self.legacy_guild_id)
+        return sorted(guild_ids)
+
+    def items(self):
+        """Pares (guild_id, documento) de todos los servidores de este shard."""
+        return [(guild_id, self.get(guild_id)) for guild_id in self.guild_ids() if owns_guild(guild_id)]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'resident': len(self._cache), 'capacity': self.cache_size, 'hits': self.hits, 'misses': self.misses, 'absent': self.absent,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self._con is not None:
+            self._con.close()
+            self._con = None
@@ -0,0 +1,330 @@
+# utils/ledger.py
+# Capa de acceso al libro de puntos (tabla `puntuaciones` de leaderboard.db).
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+# --- CONFIGURACIÓN ---
+DB_FILE = 'leaderboard.db'
+CHECKPOINT_PREFIX = 'checkpoint:'
+
+# Las claves de filas ya compactadas viven en `puntuaciones_keys`, así que también se consultan.
+INSERT_POINTS_SQL = (
+    "INSERT OR IGNORE INTO puntuaciones (user_id, guild_id, category, points, timestamp, source_key) "
+    "SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM puntuaciones_keys WHERE source_key = ?)"
+)
+RANKING_SQL = (
+    "SELECT user_id, SUM(points) as total_points FROM puntuaciones WHERE guild_id = ? "
+    "GROUP BY user_id HAVING SUM(points) != 0 ORDER BY total_points DESC"
+)
+
+# --- ESQUEMA ---
+def connect(db_file: str = DB_FILE) -> sqlite3.Connection:
+    """Abre una conexión que espera (en vez de fallar) si otro escritor tiene el bloqueo."""
+    return sqlite3.connect(db_file, timeout=30)
+
+def initialize_database(db_file: str = DB_FILE):
+    """Crea las tablas del libro si no existen y migra las bases antiguas añadiendo la clave de origen."""
+    con = connect(db_file)
+    try:
+        cur = con.cursor()
+        # WAL permite que los rankings lean mientras se escribe o se compacta.
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS puntuaciones (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                guild_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                points INTEGER NOT NULL,
+                timestamp DATETIME NOT NULL,
+                source_key TEXT
+            )
+        ''')
+        # Las bases creadas antes de existir la clave de origen no tienen la columna.
+        columns = {row[1] for row in cur.execute("PRAGMA table_info(puntuaciones)")}
+        if 'source_key' not in columns:
+            cur.execute("ALTER TABLE puntuaciones ADD COLUMN source_key TEXT")
+        # Las filas antiguas tienen source_key NULL; SQLite considera distintos los NULL,
+        # así que el índice único solo afecta a las filas que sí llevan clave.
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_puntuaciones_source_key ON puntuaciones (source_key)")
+        # Claves de las filas que la compactación ya ha plegado en un checkpoint.
+        cur.execute("CREATE TABLE IF NOT EXISTS puntuaciones_keys (source_key TEXT PRIMARY KEY) WITHOUT ROWID")
+        # Copia opcional de las filas compactadas, solo para auditoría.
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS puntuaciones_archive (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                guild_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                points INTEGER NOT NULL,
+                timestamp DATETIME NOT NULL,
+                source_key TEXT
+            )
+        ''')
+        # El verificador busca las filas archivadas de un envío por rango de clave.
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_puntuaciones_archive_source_key ON puntuaciones_archive (source_key)")
+        con.commit()
+    finally:
+        con.close()
+
+# --- CLAVES DE ORIGEN ---
+def submission_source_key(category: str, message_id, seq: int, position: int, user_id) -> str:
+    """
+    Clave única de una fila generada por un envío.
+    `seq` es el número de transición con puntos del envío (aprobar, revertir, reaprobar...)
+    y `position` el índice de la mención, para que una mención repetida siga contando dos veces.
+    """
+    return f"{category}:{message_id}:{seq}:{position}:{user_id}"
+
+def manual_source_key(interaction_id) -> str:
+    """Clave única de un ajuste manual hecho con /points."""
+    return f"manual:{interaction_id}"
+
+def submission_rows(guild_id: int, message_id, submission: dict, amount: int, category: str, seq: int):
+    """Construye las filas del libro para todos los aliados de un envío en una transición concreta."""
+    now = datetime.now(timezone.utc)
+    return [
+        (int(user_id), guild_id, category, amount, now, submission_source_key(category, message_id, seq, position, user_id))
+        for position, user_id in enumerate(submission['allies'])
+    ]
+
+# --- ESCRITURA ---
+def insert_points(rows, db_file: str = DB_FILE) -> int:
+    """
+    Inserta filas (user_id, guild_id, category, points, timestamp, source_key) en una sola transacción.
+    Las filas cuya clave ya existe se ignoran, por lo que repetir la operación es seguro.
+    Devuelve cuántas filas se insertaron realmente.
+    """
+    if not rows:
+        return 0
+    con = connect(db_file)
+    try:
+        before = con.total_changes
+        con.executemany(INSERT_POINTS_SQL, [tuple(row) + (row[5],) for row in rows])
+        con.commit()
+        return con.total_changes - before
+    finally:
+        con.close()
+
+# --- COMPACTACIÓN ---
+def _measure(con, guild_ids):
+    """Devuelve (filas, páginas, páginas libres, segundos que tarda el ranking de todos los servidores)."""
+    rows = con.execute("SELECT COUNT(*) FROM puntuaciones").fetchone()[0]
+    page_count = con.execute("PRAGMA page_count").fetchone()[0]
+    freelist = con.execute("PRAGMA freelist_count").fetchone()[0]
+    start = time.perf_counter()
+    for guild_id in guild_ids:
+        con.execute(RANKING_SQL, (guild_id,)).fetchall()
+    return rows, page_count, freelist, time.perf_counter() - start
+
+def compact_ledger(db_file: str = DB_FILE, keep_days: int = 30, archive: bool = True,
+                   batch_size: int = 2000, pause: float = 0.05) -> dict:
+    """
+    Pliega las filas más antiguas que `keep_days` en una fila checkpoint por
+    (servidor, usuario, categoría), conservando intactas las filas recientes.
+
+    Trabaja por lotes de `batch_size` filas, cada uno en su propia transacción corta,
+    y duerme `pause` segundos entre lotes para que los escritores normales no esperen.
+    Las claves de origen de las filas plegadas se guardan en `puntuaciones_keys` para
+    que los reintentos sigan siendo idempotentes, y las filas se copian a
+    `puntuaciones_archive` si `archive` es True.
+    Es síncrona y bloqueante: desde el bot debe llamarse con `asyncio.to_thread`.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+    foldable = "timestamp < ? AND (source_key IS NULL OR source_key NOT LIKE ?)"
+    con = connect(db_file)
+    try:
+        page_size = con.execute("PRAGMA page_size").fetchone()[0]
+        guild_ids = [row[0] for row in con.execute("SELECT DISTINCT guild_id FROM puntuaciones")]
+        rows_before, pages_before, free_before, query_before = _measure(con, guild_ids)
+
+        folded = 0
+        last_id = 0
+        while True:
+            batch = con.execute(
+                f"SELECT id FROM puntuaciones WHERE id > ? AND {foldable} ORDER BY id LIMIT ?",
+                (last_id, cutoff, CHECKPOINT_PREFIX + '%', batch_size)
+            ).fetchall()
+            if not batch:
+                break
+            in_batch = f"id > ? AND id <= ? AND {foldable}"
+            params = (last_id, batch[-1][0], cutoff, CHECKPOINT_PREFIX + '%')
+            with con:
+                con.execute(f'''
+                    INSERT INTO puntuaciones (user_id, guild_id, category, points, timestamp, source_key)
+                    SELECT user_id, guild_id, category, SUM(points), ?,
+                           '{CHECKPOINT_PREFIX}' || guild_id || ':' || user_id || ':' || category
+                    FROM puntuaciones WHERE {in_batch}
+                    GROUP BY guild_id, user_id, category
+                    ON CONFLICT(source_key) DO UPDATE SET points = points + excluded.points
+                ''', (cutoff,) + params)
+                con.execute(f"INSERT OR IGNORE INTO puntuaciones_keys SELECT source_key FROM puntuaciones WHERE {in_batch} AND source_key IS NOT NULL", params)
+                if archive:
+                    con.execute(f"INSERT OR IGNORE INTO puntuaciones_archive SELECT id, user_id, guild_id, category, points, timestamp, source_key FROM puntuaciones WHERE {in_batch}", params)
+                folded += con.execute(f"DELETE FROM puntuaciones WHERE {in_batch}", params).rowcount
+            last_id = batch[-1][0]
+            if pause:
+                time.sleep(pause)
+
+        rows_after, pages_after, free_after, query_after = _measure(con, guild_ids)
+        checkpoints = con.execute("SELECT COUNT(*) FROM puntuaciones WHERE source_key LIKE ?", (CHECKPOINT_PREFIX + '%',)).fetchone()[0]
+    finally:
+        con.close()
+
+    return {
+        'cutoff': cutoff,
+        'rows_folded': folded,
+        'rows_before': rows_before,
+        'rows_after': rows_after,
+        'checkpoints': checkpoints,
+        'archived': archive,
+        # El fichero no encoge (eso exigiría un VACUUM que bloquea a los escritores):
+        # las páginas liberadas se reutilizan para las nuevas filas en lugar de crecer.
+        'bytes_reusable': max(free_after - free_before, 0) * page_size,
+        'bytes_in_use_before': (pages_before - free_before) * page_size,
+        'bytes_in_use_after': (pages_after - free_after) * page_size,
+        'ranking_query_before': query_before,
+        'ranking_query_after': query_after,
+    }
+
+# --- GROUP COMMIT ---
+class GroupCommitWriter:
+    """
+    Agrupa las inserciones de puntos que llegan casi a la vez y las confirma en una sola transacción.
+
+    Cada llamada a `write` espera hasta que sus filas están confirmadas en disco y devuelve
+    cuántas se insertaron, igual que `insert_points`. La cola se vacía cuando pasan `max_delay`
+    segundos desde la primera escritura pendiente o cuando se acumulan `max_rows` filas.
+    """
+    def __init__(self, db_file: str = DB_FILE, max_delay: float = 0.005, max_rows: int = 500):
+        self.db_file = db_file
+        self.max_delay = max_delay
+        self.max_rows = max_rows
+        self.commits = 0
+        self.rows_written = 0
+        self._pending = []  # [(filas, future)]
+        self._pending_rows = 0
+        self._wakeup = None
+        self._full = None
+        self._task = None
+        self._con = None
+        self._closed = False
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._full = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def write(self, rows) -> int:
+        """Encola las filas y espera a que estén confirmadas. Devuelve cuántas se insertaron."""
+        if self._closed:
+            raise RuntimeError("El escritor de puntos ya está cerrado.")
+        if not rows:
+            return 0
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((rows, future))
+        self._pending_rows += len(rows)
+        self._wakeup.set()
+        if self._pending_rows >= self.max_rows:
+            self._full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush()
+            if self._closed and not self._pending:
+                return
+
+    async def _flush(self):
+        batch, self._pending, self._pending_rows = self._pending, [], 0
+        self._wakeup.clear()
+        self._full.clear()
+        if not batch:
+            return
+        try:
+            counts = await asyncio.to_thread(self._commit, [rows for rows, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), count in zip(batch, counts):
+            if not future.done():
+                future.set_result(count)
+
+    def _commit(self, batches):
+        """Escribe todos los lotes en una única transacción (se ejecuta en un hilo aparte)."""
+        if self._con is None:
+            # Los vaciados nunca se solapan, así que la conexión nunca se usa desde dos hilos a la vez.
+            self._con = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        counts = []
+        with self._con:
+            for rows in batches:
+                before = self._con.total_changes
+                self._con.executemany(INSERT_POINTS_SQL, [tuple(row) + (row[5],) for row in rows])
+                counts.append(self._con.total_changes - before)
+        self.commits += 1
+        self.rows_written += sum(counts)
+        return counts
+
+    async def close(self):
+        """Deja de aceptar escrituras, vacía la cola pendiente y cierra la conexión."""
+        self._closed = True
+        if self._task is not None:
+            self._wakeup.set()
+            self._full.set()
+            await self._task
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+# --- ARCHIVO DE TEMPORADAS ---
+def archive_guild_season(guild_id: int, archive_file: str, db_file: str = DB_FILE) -> int:
+    """
+    Mueve las filas de un servidor a una base de archivo (una por temporada y servidor)
+    y las borra del libro, sin tocar las de los demás servidores.
+    Las claves de origen se conservan para que un reintento tardío no vuelva a sumar puntos.
+    Devuelve cuántas filas se archivaron.
+    """
+    initialize_database(archive_file)
+    con = connect(db_file)
+    try:
+        con.execute("ATTACH DATABASE ? AS archivo", (archive_file,))
+        columns = "user_id, guild_id, category, points, timestamp, source_key"
+        with con:
+            con.execute(f"INSERT INTO archivo.puntuaciones ({columns}) SELECT {columns} FROM puntuaciones WHERE guild_id = ?", (guild_id,))
+            con.execute("INSERT OR IGNORE INTO archivo.puntuaciones_archive SELECT * FROM puntuaciones_archive WHERE guild_id = ?", (guild_id,))
+            con.execute(
+                "INSERT OR IGNORE INTO puntuaciones_keys SELECT source_key FROM puntuaciones "
+                "WHERE guild_id = ? AND source_key IS NOT NULL AND source_key NOT LIKE ?",
+                (guild_id, CHECKPOINT_PREFIX + '%')
+            )
+            con.execute("DELETE FROM puntuaciones_archive WHERE guild_id = ?", (guild_id,))
+            moved = con.execute("DELETE FROM puntuaciones WHERE guild_id = ?", (guild_id,)).rowcount
+        con.execute("DETACH DATABASE archivo")
+        return moved
+    finally:
+        con.close()
+
+# --- COMPROBACIONES ---
+def quick_check(db_file: str = DB_FILE) -> list:
+    """
+    Ejecuta PRAGMA quick_check sobre el libro y devuelve los problemas encontrados
+    (lista vacía si la base está sana). Recorre toda la base, así que solo se usa
+    al arrancar tras un cierre que no fue limpio.
+    """
+    con = connect(db_file)
+    try:
+        problems = [row[0] for row in con.execute("PRAGMA quick_check")]
+        return [] if problems == ['ok'] else problems
+    finally:
+        con.close()
@@ -0,0 +1,61 @@
+# utils/locks.py
+# Cerrojos asíncronos por mensaje para que las transiciones de un mismo envío no se intercalen.
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+class MessageLocks:
+    """
+    Un `asyncio.Lock` por (servidor, mensaje), creado al primer uso.
+
+    Dos reacciones sobre el mismo envío se ejecutan una detrás de otra; las de envíos
+    distintos siguen siendo concurrentes. Para que el diccionario no crezca con cada
+    mensaje que recibe una reacción, los cerrojos libres (sin dueño ni nadie esperando)
+    se descartan cuando llevan `idle_seconds` sin usarse o cuando hay más de `max_locks`;
+    los que están en uso nunca se descartan, así que el límite solo se supera si hay más
+    envíos que `max_locks` procesándose a la vez.
+    """
+    def __init__(self, max_locks: int = 10000, idle_seconds: float = 300):
+        self.max_locks = max_locks
+        self.idle_seconds = idle_seconds
+        # clave -> [cerrojo, usuarios (dueño + en espera), último uso]; de menos a más reciente.
+        self._locks = OrderedDict()
+        self.acquired = 0
+        self.contended = 0
+        self.evicted = 0
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in list(self._locks):
+            lock, users, last_used = self._locks[key]
+            if len(self._locks) < self.max_locks and now - last_used < self.idle_seconds:
+                # El resto es más reciente: tampoco ha caducado.
+                break
+            if not users:
+                del self._locks[key]
+                self.evicted += 1
+
+    @asynccontextmanager
+    async def hold(self, guild_id: int, message_id: int):
+        """`async with locks.hold(guild_id, message_id):` serializa el bloque por envío."""
+        key = (guild_id, message_id)
+        entry = self._locks.get(key)
+        if entry is None:
+            self._evict()
+            entry = self._locks[key] = [asyncio.Lock(), 0, time.monotonic()]
+        else:
+            self._locks.move_to_end(key)
+        if entry[0].locked():
+            self.contended += 1
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                self.acquired += 1
+                yield
+        finally:
+            entry[1] -= 1
+            entry[2] = time.monotonic()
+
+    def __len__(self):
+        return len(self._locks)
@@ -0,0 +1,158 @@
+# utils/logs.py
+# Registro no bloqueante: el bucle solo deja los registros en una cola y un hilo aparte los formatea y escribe.
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# --- CONFIGURACIÓN ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Registro estructurado (una línea JSON por registro) con rotación; vacío lo desactiva.
+LOG_FILE = os.getenv("LOG_FILE", "logs/bot.jsonl")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))
+# Registros que pueden esperar en la cola; si el hilo no da abasto se descartan en vez de frenar el bucle.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# De los mensajes muestreados (los del camino caliente, con `extra={'sample': ...}`) se escribe uno de cada N.
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", 50))
+
+# Atributos propios de LogRecord; el resto son los campos que se pasaron en `extra`.
+RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+_queue_handler = None
+
+# --- FORMATOS ---
+def record_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in RECORD_FIELDS and not key.startswith('_')}
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro con los ids y tiempos que se pasaron en `extra`."""
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        data.update(record_fields(record))
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class ConsoleFormatter(logging.Formatter):
+    """Texto para la consola; los campos estructurados se añaden al final como clave=valor."""
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        fields = record_fields(record)
+        if fields:
+            line += " [" + " ".join(f"{key}={value}" for key, value in fields.items()) + "]"
+        return line
+
+# --- FILTROS Y COLA ---
+class SampleFilter(logging.Filter):
+    """
+    Deja pasar uno de cada `every` registros por cada clave `sample` (el primero incluido) y
+    anota en `sample_every` cuántos representa. Los avisos y errores nunca se muestrean.
+    """
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = every
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        if key is None or self.every <= 1 or record.levelno >= logging.WARNING:
+            return True
+        with self.lock:
+            count = self.counts.get(key, 0)
+            self.counts[key] = count + 1
+        if count % self.every:
+            return False
+        record.sample_every = self.every
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler con cola acotada que descarta (y cuenta) en vez de esperar. Solo resuelve el
+    mensaje en el hilo que registra; la traza de las excepciones se formatea en el hilo de escritura.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+# --- CONFIGURACIÓN DEL REGISTRO ---
+def setup_logging(level: str = LOG_LEVEL, log_file: str = LOG_FILE, sample_every: int = LOG_SAMPLE_EVERY):
+    """
+    Envía todos los registros (los de los cogs y los de discord.py) a una cola acotada que vacía
+    un hilo con la consola y, si hay `log_file`, un archivo JSON rotativo. Llamar una sola vez al arrancar.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    handlers = []
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(ConsoleFormatter())
+    handlers.append(console)
+    if log_file:
+        if os.path.dirname(log_file):
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(SampleFilter(sample_every))
+    root = logging.getLogger()
+    root.handlers[:] = [_queue_handler]
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+def shutdown_logging():
+    """Escribe lo que quede en la cola y detiene el hilo de escritura."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+def stats() -> dict:
+    if _queue_handler is None:
+        return {'queued': 0, 'dropped': 0}
+    return {'queued': _queue_handler.queue.qsize(), 'dropped': _queue_handler.dropped}
+
+@contextmanager
+def timed(logger: logging.Logger, message: str, level: int = logging.INFO, **fields):
+    """
+    Registra `message` al terminar el bloque con `elapsed_ms` y los campos dados. El bloque
+    puede añadir campos al diccionario que recibe.
+    """
+    start = time.perf_counter()
+    yield fields
+    fields['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    logger.log(level, message, extra=fields)
@@ -0,0 +1,81 @@
+# utils/pending.py
+# Índice de los envíos pendientes de todos los tipos, ordenado por fecha de creación.
+import bisect
+import heapq
+import time
+from collections import namedtuple
+
+# --- SNOWFLAKES ---
+# Los IDs de Discord llevan en sus bits altos los milisegundos desde el 1 de enero de 2015.
+DISCORD_EPOCH_MS = 1420070400000
+
+def snowflake_time(message_id: int) -> float:
+    """Momento (timestamp Unix) en que se creó el mensaje."""
+    return ((int(message_id) >> 22) + DISCORD_EPOCH_MS) / 1000
+
+def snowflake_at(timestamp: float) -> int:
+    """El menor ID que puede tener un mensaje creado en `timestamp`."""
+    return max(int(timestamp * 1000) - DISCORD_EPOCH_MS, 0) << 22
+
+# --- ÍNDICE ---
+PendingEntry = namedtuple('PendingEntry', 'message_id kind channel_id allies points')
+
+class PendingIndex:
+    """
+    Vista ordenada por antigüedad de los envíos pendientes de un servidor, para todos los tipos.
+
+    `sources` devuelve en cada consulta {tipo: GuildState de pendientes}; así el índice no
+    depende del orden en que se cargan los cogs. Cada tipo se reordena solo cuando su
+    partición cambió (según `GuildState.version`), y las consultas por antigüedad se
+    resuelven con búsqueda binaria sobre los IDs.
+    """
+    def __init__(self, sources):
+        self.sources = sources
+        self._by_kind = {}  # (guild_id, tipo) -> (versión, [PendingEntry ordenadas])
+        self._merged = {}   # guild_id -> (versiones, [PendingEntry], [message_id])
+
+    def _kind_entries(self, guild_id: int, kind: str, store):
+        version = store.version(guild_id)
+        cached = self._by_kind.get((guild_id, kind))
+        if cached and cached[0] == version:
+            return version, cached[1]
+        entries = sorted(
+            PendingEntry(int(message_id), kind, submission.get('channel_id'),
+                         tuple(str(user_id) for user_id in submission.get('allies', [])), submission.get('points'))
+            for message_id, submission in store.get(guild_id).items()
+        )
+        self._by_kind[(guild_id, kind)] = (version, entries)
+        return version, entries
+
+    def entries(self, guild_id: int):
+        """Todos los pendientes del servidor, del más antiguo al más reciente."""
+        sources = self.sources()
+        per_kind = {kind: self._kind_entries(guild_id, kind, store) for kind, store in sources.items()}
+        versions = tuple(sorted((kind, version) for kind, (version, _) in per_kind.items()))
+        cached = self._merged.get(guild_id)
+        if not cached or cached[0] != versions:
+            merged = list(heapq.merge(*(entries for _, entries in per_kind.values())))
+            cached = (versions, merged, [entry.message_id for entry in merged])
+            self._merged[guild_id] = cached
+        return cached[1], cached[2]
+
+    def query(self, guild_id: int, kind: str = None, min_age_hours: float = None, max_age_hours: float = None,
+              channel_id: int = None, ally_id: int = None):
+        """
+        Pendientes que cumplen todos los filtros indicados, del más antiguo al más reciente.
+        `min_age_hours`/`max_age_hours` acotan la antigüedad y se resuelven sobre el índice.
+        """
+        entries, message_ids = self.entries(guild_id)
+        now = time.time()
+        start, end = 0, len(entries)
+        if max_age_hours is not None:
+            start = bisect.bisect_left(message_ids, snowflake_at(now - max_age_hours * 3600))
+        if min_age_hours is not None:
+            end = bisect.bisect_left(message_ids, snowflake_at(now - min_age_hours * 3600))
+        ally = str(ally_id) if ally_id is not None else None
+        return [
+            entry for entry in entries[start:end]
+            if (kind is None or entry.kind == kind)
+            and (channel_id is None or entry.channel_id == channel_id)
+            and (ally is None or ally in entry.allies)
+        ]
@@ -0,0 +1,295 @@
+# utils/rebuild.py
+# Reconstrucción de los envíos pendientes y juzgados de un servidor a partir del historial de sus canales.
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+
+import discord
+
+from utils import ledger, verify
+from utils.checks import has_admin_role
+from utils.rules import submission_rules
+
+log = logging.getLogger(__name__)
+
+# --- CONFIGURACIÓN ---
+# Canales que se recorren a la vez; cada uno pide su historial a Discord de 100 en 100 mensajes.
+REBUILD_CONCURRENCY = int(os.getenv("REBUILD_CONCURRENCY", 4))
+# Mensajes por lote: al terminar cada lote se guardan los envíos y el punto de control del canal.
+REBUILD_BATCH_SIZE = int(os.getenv("REBUILD_BATCH_SIZE", 200))
+REBUILD_CHECKPOINT_FILE = 'rebuild_checkpoint.json'
+# Prefijo del canal -> tipo de envío (el canal de KOTH se toma de la configuración del servidor).
+CHANNEL_KINDS = {'attack-': 'ataque', 'defenses-': 'defensa', 'tempo-': 'tempo', 'interserver-': 'interserver'}
+# Tipo de envío -> (cog, atributo de pendientes, atributo de juzgados).
+REBUILD_STORES = {
+    'ataque': ('Ataque', 'pending_attacks', 'judged_attacks'),
+    'defensa': ('Defensa', 'pending_defenses', 'judged_defenses'),
+    'tempo': ('Tempo', 'pending_tempo', 'judged_tempo'),
+    'interserver': ('Interserver', 'pending_interserver', 'judged_interserver'),
+    'koth': ('koth', 'pending_koth', 'judged_koth'),
+}
+APPROVE_EMOJI = '✅'
+DENY_EMOJI = '❌'
+
+# --- FUNCIONES DE AYUDA ---
+def new_report() -> dict:
+    return {
+        'channels': 0, 'messages': 0, 'submissions': 0, 'existing': 0, 'pending': 0, 'approved': 0,
+        'denied': 0, 'conflicts': 0, 'awarded_rows': 0, 'legacy': 0, 'repaired_rows': 0,
+        'forbidden': [], 'elapsed': 0.0,
+    }
+
+def channel_kind(bot, channel) -> str:
+    """Tipo de envío de un canal, o None si no es un canal de envíos."""
+    if channel.id == bot.guild_config.get(channel.guild.id)['koth_channel_id']:
+        return 'koth'
+    name = channel.name.lower()
+    for prefix, kind in CHANNEL_KINDS.items():
+        if name.startswith(prefix):
+            return kind
+    return None
+
+def ledger_history(con, category: str, message_id: str) -> tuple:
+    """
+    Lo que el libro sabe de un envío: (último seq de transición, último n de recálculo, puntos
+    por mención pagados). Los puntos son el saldo positivo más repetido entre sus menciones (0 si
+    no tiene filas o están compensadas), que es lo que el envío tenía al juzgarse.
+    """
+    low, high = verify._key_range(category, message_id)
+    seq = rescore_seq = 0
+    balances = Counter()
+    for source_key, points, _ in con.execute(verify.ROWS_FOR_SUBMISSION_SQL, (low, high, low, high)):
+        _, _, row_seq, position, user_id = source_key.split(':')
+        balances[(position, user_id)] += points
+        if row_seq.isdigit():
+            seq = max(seq, int(row_seq))
+        elif row_seq.startswith('r'):
+            rescore_seq = max(rescore_seq, int(row_seq[1:].split('.')[0]))
+    paid = Counter(balance for balance in balances.values() if balance > 0)
+    return seq, rescore_seq, (paid.most_common(1)[0][0] if paid else 0)
+
+def newest_keyless_row(con, guild_id: int):
+    """
+    Fecha de la fila sin clave más reciente del servidor. Antes de las claves de origen los
+    envíos aprobados no dejaban rastro en el libro: si un aprobado sin filas es anterior a esta
+    fecha no se sabe si ya se pagó, así que no se le vuelven a escribir puntos.
+    """
+    (timestamp,) = con.execute("SELECT MAX(timestamp) FROM puntuaciones WHERE guild_id = ? AND source_key IS NULL", (guild_id,)).fetchone()
+    if timestamp is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        return datetime.max.replace(tzinfo=timezone.utc)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+# --- RECONSTRUCCIÓN ---
+class HistoryRebuild:
+    """
+    Recorre el historial completo de los canales de envíos de un servidor (varios canales a la
+    vez) y vuelve a construir los pendientes y juzgados que falten. Cada mensaje se construye con
+    el `build_submission` de su cog y su estado sale de las reacciones: ✅/❌ del bot (moderación
+    masiva) o de un moderador. Si tiene las dos se deja pendiente y se cuenta como conflicto.
+    Los envíos que ya están guardados no se tocan, así que repetirla no cambia nada. El avance
+    de cada canal se guarda tras cada lote en `checkpoints`: si se interrumpe, la siguiente
+    ejecución sigue desde el último lote guardado.
+    Los puntos y el `seq` de los juzgados salen del libro; a los aprobados que no tienen filas
+    se les escriben ahora, y al terminar el verificador repara las diferencias que queden.
+    """
+    def __init__(self, bot, guild: discord.Guild, checkpoints, restart: bool = False):
+        self.bot = bot
+        self.guild = guild
+        self.checkpoints = checkpoints
+        self.checkpoint = checkpoints.get(guild.id)
+        self.resumed = bool(self.checkpoint.get('channels')) and not self.checkpoint.get('finished') and not restart
+        if not self.resumed:
+            self.checkpoint.clear()
+        self.checkpoint.setdefault('channels', {})
+        self.checkpoint.setdefault('done', [])
+        self.report = self.checkpoint.setdefault('report', new_report())
+        self.moderators = {}
+        self.con = None
+        self.keyless_until = None
+
+    async def run(self, progress=None) -> dict:
+        """
+        Reconstruye el servidor y devuelve el informe (acumulado con el de las ejecuciones
+        interrumpidas). `progress(informe)` es una corrutina opcional que se espera tras cada lote.
+        """
+        start = time.perf_counter()
+        previous = self.report['elapsed']
+        channels = [channel for channel in self.guild.text_channels
+                    if channel_kind(self.bot, channel) and str(channel.id) not in self.checkpoint['done']]
+        log.info("Reconstruyendo %d canales del servidor %s%s...", len(channels), self.guild.id,
+                 " (reanudado)" if self.resumed else "", extra={'guild_id': self.guild.id})
+        self.con = ledger.connect(ledger.DB_FILE)
+        try:
+            self.keyless_until = newest_keyless_row(self.con, self.guild.id)
+            semaphore = asyncio.Semaphore(REBUILD_CONCURRENCY)
+            # Se espera a todos los canales aunque uno falle: el resto guarda su avance y la conexión sigue abierta.
+            results = await asyncio.gather(*(self._walk(channel, semaphore, progress) for channel in channels), return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+        finally:
+            self.con.close()
+            self.report['elapsed'] = previous + time.perf_counter() - start
+            self.checkpoints.save(self.guild.id, durable=True)
+
+        puntos = self.bot.get_cog('Puntos')
+        if puntos:
+            verification = await puntos.run_verification([self.guild.id], repair=True)
+        else:
+            verification = await asyncio.to_thread(verify.verify_ledger, [self.guild.id], True, ledger.DB_FILE)
+        self.report['repaired_rows'] += verification['repaired_rows']
+        self.report['elapsed'] = previous + time.perf_counter() - start
+        self.checkpoint['finished'] = datetime.now(timezone.utc).isoformat()
+        self.checkpoints.save(self.guild.id, durable=True)
+        log.info(
+            "Reconstrucción del servidor %s terminada: %d mensajes, %d envíos (%d ya guardados), %d pendientes, "
+            "%d aprobados, %d rechazados, %d en conflicto, %d filas nuevas, %d filas de reparación.",
+            self.guild.id, self.report['messages'], self.report['submissions'], self.report['existing'], self.report['pending'],
+            self.report['approved'], self.report['denied'], self.report['conflicts'], self.report['awarded_rows'],
+            self.report['repaired_rows'], extra={'guild_id': self.guild.id, 'elapsed_ms': round(self.report['elapsed'] * 1000, 1)},
+        )
+        return self.report
+
+    async def _walk(self, channel: discord.TextChannel, semaphore: asyncio.Semaphore, progress):
+        kind = channel_kind(self.bot, channel)
+        cog = self.bot.get_cog(REBUILD_STORES[kind][0])
+        if cog is None or not hasattr(cog, 'build_submission'):
+            return
+        async with semaphore:
+            after = self.checkpoint['channels'].get(str(channel.id))
+            entries = []
+            seen = 0
+            last_id = None
+            try:
+                async for message in channel.history(limit=None, oldest_first=True, after=discord.Object(int(after)) if after else None):
+                    seen += 1
+                    last_id = message.id
+                    if not message.author.bot:
+                        entry = await self._entry(cog, message)
+                        if entry:
+                            entries.append(entry)
+                    if seen >= REBUILD_BATCH_SIZE:
+                        await self._apply(channel, kind, entries, last_id, seen)
+                        entries, seen = [], 0
+                        if progress:
+                            await progress(self.report)
+                if seen:
+                    await self._apply(channel, kind, entries, last_id, seen)
+            except discord.Forbidden:
+                log.warning("Sin permisos para leer el historial de #%s", channel.name, extra={'guild_id': self.guild.id})
+                self.report['forbidden'].append(channel.name)
+                return
+            self.report['channels'] += 1
+            self.checkpoint['done'].append(str(channel.id))
+            self.checkpoints.save(self.guild.id)
+            if progress:
+                await progress(self.report)
+
+    async def _entry(self, cog, message: discord.Message):
+        """(message_id, envío, estado, emojis del bot) de un mensaje, o None si no es un envío."""
+        submission = cog.build_submission(message)
+        # Los envíos sin puntos nunca llegan a pendientes (el bot solo les pone 🤷).
+        if submission is None or submission.get('points') == 0:
+            return None
+        verdicts = set()
+        bot_emojis = []
+        for reaction in message.reactions:
+            emoji = str(reaction.emoji)
+            if emoji in (APPROVE_EMOJI, DENY_EMOJI):
+                if reaction.me or await self._moderator_reacted(reaction):
+                    verdicts.add('approved' if emoji == APPROVE_EMOJI else 'denied')
+            elif reaction.me:
+                bot_emojis.append(emoji)
+        status = 'conflicts' if len(verdicts) > 1 else (verdicts.pop() if verdicts else 'pending')
+        return str(message.id), submission, status, bot_emojis, message.created_at
+
+    async def _moderator_reacted(self, reaction: discord.Reaction) -> bool:
+        async for user in reaction.users():
+            if user.bot:
+                continue
+            if user.id not in self.moderators:
+                member = user if isinstance(user, discord.Member) else self.guild.get_member(user.id)
+                if member is None:
+                    try:
+                        member = await self.guild.fetch_member(user.id)
+                    except discord.NotFound:
+                        member = None
+                self.moderators[user.id] = member is not None and has_admin_role(self.bot, self.guild.id, member)
+            if self.moderators[user.id]:
+                return True
+        return False
+
+    def _restore(self, kind: str, message_id: str, submission: dict, status: str, bot_emojis, created_at, awards: list):
+        """Completa el envío con lo que dice el libro y, si es un aprobado sin filas, lo apunta en `awards`."""
+        seq, rescore_seq, paid = ledger_history(self.con, kind, message_id)
+        if seq:
+            submission['seq'] = seq
+        if rescore_seq:
+            submission['rescore_seq'] = rescore_seq
+        if kind == 'defensa' and status != 'denied':
+            rules = submission_rules(self.bot.rules, submission)
+            emoji = next((emoji for emoji in bot_emojis if rules.multiplier('defensa', emoji)), None)
+            if emoji:
+                submission['points'] = int(submission['points'] * rules.multiplier('defensa', emoji))
+                submission['multiplier_applied'] = True
+                submission['multiplier_emoji'] = emoji
+        if status != 'approved':
+            return
+        if kind == 'koth':
+            submission['points'] = paid or self.bot.get_cog('koth').koth_event.get(self.guild.id).get('points_per_tag', 0)
+        if paid:
+            # Lo que ya se pagó manda: puede venir de otras reglas o de un recálculo.
+            submission['points'] = paid
+        elif submission.get('points'):
+            if self.keyless_until is None or created_at > self.keyless_until:
+                awards.append((message_id, submission, submission['points'], kind))
+            else:
+                self.report['legacy'] += 1
+
+    async def _apply(self, channel, kind: str, entries, last_id: int, seen: int):
+        """Guarda un lote de envíos que no estén ya en el estado y avanza el punto de control del canal."""
+        cog_name, pending_attribute, judged_attribute = REBUILD_STORES[kind]
+        cog = self.bot.get_cog(cog_name)
+        pending, judged = getattr(cog, pending_attribute), getattr(cog, judged_attribute)
+        reacciones = self.bot.get_cog('Reacciones')
+        self.report['messages'] += seen
+        self.report['submissions'] += len(entries)
+        async with AsyncExitStack() as stack:
+            # Con los cerrojos de Reacciones ninguna reacción puede juzgar uno de estos envíos a medias.
+            if reacciones:
+                for message_id in sorted({entry[0] for entry in entries}):
+                    await stack.enter_async_context(reacciones.locks.hold(self.guild.id, int(message_id)))
+            pending_documents, judged_documents = pending.get(self.guild.id), judged.get(self.guild.id)
+            placed = []
+            awards = []
+            for message_id, submission, status, bot_emojis, created_at in entries:
+                if message_id in pending_documents or message_id in judged_documents:
+                    self.report['existing'] += 1
+                    continue
+                self._restore(kind, message_id, submission, status, bot_emojis, created_at, awards)
+                placed.append((message_id, submission, status))
+            puntos = self.bot.get_cog('Puntos')
+            if awards and puntos:
+                self.report['awarded_rows'] += await puntos.award_submissions(self.guild.id, awards)
+            for message_id, submission, status in placed:
+                self.report[status] += 1
+                if status in ('approved', 'denied'):
+                    submission['status'] = status
+                    judged_documents[message_id] = submission
+                else:
+                    pending_documents[message_id] = submission
+            if placed:
+                pending.save(self.guild.id)
+                judged.save(self.guild.id)
+            self.checkpoint['channels'][str(channel.id)] = str(last_id)
+            self.checkpoints.save(self.guild.id)
+        if placed and reacciones:
+            reacciones.tracked.forget(self.guild.id)
@@ -0,0 +1,195 @@
+# utils/replay.py
+# Grabación de los eventos de la gateway que mueven puntos y su reproducción contra una API de Discord falsa.
+import asyncio
+import gzip
+import itertools
+import json
+import logging
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import discord
+
+log = logging.getLogger(__name__)
+
+# --- CONFIGURACIÓN ---
+RECORDING_VERSION = 1
+# Eventos de la gateway que se graban: los envíos y las reacciones de los moderadores.
+RECORDED_EVENTS = ('MESSAGE_CREATE', 'MESSAGE_REACTION_ADD', 'MESSAGE_REACTION_REMOVE')
+# Canales de envíos (el de KOTH se toma de la configuración de cada servidor).
+EVENT_CHANNEL_PREFIXES = ('attack-', 'defenses-', 'tempo-', 'interserver-')
+# Campos de MESSAGE_CREATE que se guardan; los embeds, componentes y mensajes citados no los usa ningún cog.
+MESSAGE_FIELDS = (
+    'id', 'channel_id', 'guild_id', 'author', 'member', 'content', 'timestamp', 'edited_timestamp', 'tts',
+    'mention_everyone', 'mentions', 'mention_roles', 'attachments', 'pinned', 'type', 'flags',
+)
+# Segundos máximos entre dos volcados del archivo de grabación.
+RECORD_FLUSH_SECONDS = 5
+
+# --- GRABACIÓN ---
+def is_event_channel(bot, channel) -> bool:
+    if channel is None or getattr(channel, 'guild', None) is None:
+        return False
+    return (channel.name.lower().startswith(EVENT_CHANNEL_PREFIXES)
+            or channel.id == bot.guild_config.get(channel.guild.id)['koth_channel_id'])
+
+def compact_message(data: dict) -> dict:
+    message = {field: data[field] for field in MESSAGE_FIELDS if field in data}
+    message['embeds'] = []
+    return message
+
+def guild_snapshot(bot, guild: discord.Guild) -> dict:
+    """Lo mínimo del servidor para reconstruirlo al reproducir: canales, roles y configuración del bot."""
+    return {
+        'id': str(guild.id), 'name': guild.name,
+        'channels': [{'id': str(channel.id), 'name': channel.name, 'type': channel.type.value, 'position': channel.position}
+                     for channel in guild.channels],
+        'roles': [{'id': str(role.id), 'name': role.name, 'position': role.position, 'permissions': str(role.permissions.value)}
+                  for role in guild.roles],
+        'config': bot.guild_config.get(guild.id),
+    }
+
+class GatewayRecorder:
+    """
+    Graba en un JSONL comprimido los mensajes y reacciones de los canales de envíos, tal y
+    como llegan de la gateway. Se engancha a los parsers del estado de discord.py, así que
+    ve el evento en crudo antes que los cogs y sin pasar por ellos. El archivo se abre en modo
+    de añadir: cada arranque empieza con su propia cabecera y la reproducción las encadena.
+    """
+    def __init__(self, bot, path: str):
+        self.bot = bot
+        self.path = path
+        self.file = None
+        self.guilds = set()
+        self.recorded = 0
+        self._last_flush = 0.0
+
+    def install(self):
+        self.file = gzip.open(self.path, 'at', encoding='utf-8')
+        user = self.bot.user
+        self._write('HEADER', {
+            'version': RECORDING_VERSION,
+            'user': {'id': str(user.id), 'username': user.name, 'discriminator': user.discriminator, 'avatar': None, 'bot': True} if user else None,
+        })
+        parsers = self.bot._connection.parsers
+        for event in RECORDED_EVENTS:
+            parsers[event] = self._wrap(event, parsers[event])
+
+    def _wrap(self, event: str, parser):
+        def recording_parser(data):
+            try:
+                self._record(event, data)
+            except Exception:
+                log.exception("No se pudo grabar el evento %s", event)
+            parser(data)
+        return recording_parser
+
+    def _record(self, event: str, data: dict):
+        if data.get('guild_id') is None:
+            return
+        channel = self.bot.get_channel(int(data['channel_id']))
+        if not is_event_channel(self.bot, channel):
+            return
+        if event == 'MESSAGE_CREATE':
+            if data['author'].get('bot'):
+                return
+            data = compact_message(data)
+        if channel.guild.id not in self.guilds:
+            self.guilds.add(channel.guild.id)
+            self._write('GUILD', guild_snapshot(self.bot, channel.guild))
+        self._write(event, data)
+        self.recorded += 1
+
+    def _write(self, event: str, data):
+        now = time.time()
+        self.file.write(json.dumps({'e': event, 't': round(now, 3), 'd': data}, separators=(',', ':'), ensure_ascii=False) + '\n')
+        if now - self._last_flush > RECORD_FLUSH_SECONDS:
+            self.file.flush()
+            self._last_flush = now
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def read_recording(path: str):
+    """Registros {'e': evento, 't': segundos epoch, 'd': datos} de una grabación, en orden."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+# --- REPRODUCCIÓN ---
+def guild_payload(snapshot: dict, user: dict) -> dict:
+    """GUILD_CREATE a partir de la instantánea grabada, con el bot como único miembro."""
+    return {
+        'id': snapshot['id'], 'name': snapshot['name'], 'owner_id': user['id'], 'large': False, 'unavailable': False,
+        'member_count': 1, 'features': [], 'emojis': [], 'stickers': [], 'threads': [], 'voice_states': [],
+        'roles': [{**role, 'color': 0, 'hoist': False, 'managed': False, 'mentionable': False} for role in snapshot['roles']],
+        'channels': [{**channel, 'permission_overwrites': []} for channel in snapshot['channels']],
+        'members': [{'user': user, 'roles': [], 'joined_at': '2024-01-01T00:00:00+00:00', 'deaf': False, 'mute': False, 'flags': 0}],
+    }
+
+class FakeDiscordAPI:
+    """
+    Sustituye a `HTTPClient.request`: responde a las rutas que usan los cogs como lo haría
+    Discord, con los mensajes y miembros vistos en la grabación y una latencia aleatoria de
+    hasta `latency` segundos. Las reacciones de los mensajes no se simulan (los mensajes
+    pedidos llegan sin reacciones). Las rutas desconocidas devuelven None y se cuentan.
+    """
+    def __init__(self, user: dict, latency: float = 0.0, seed: int = 1):
+        self.user = user
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.messages = {}
+        self.members = {}
+        self.calls = Counter()
+        self.unhandled = Counter()
+        self._ids = itertools.count((int(time.time() * 1000) - 1420070400000) << 22)
+
+    def remember(self, event: str, data: dict):
+        if event == 'MESSAGE_CREATE':
+            self.messages[data['id']] = data
+        elif data.get('member'):
+            self.members[(data['guild_id'], data['user_id'])] = data['member']
+
+    def _bot_message(self, channel_id: str, message_id: str, body: dict) -> dict:
+        return {
+            'id': message_id, 'channel_id': channel_id, 'author': self.user, 'content': body.get('content') or '',
+            'timestamp': discord.utils.utcnow().isoformat(), 'edited_timestamp': None, 'tts': False, 'mention_everyone': False,
+            'mentions': [], 'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False, 'type': 0,
+        }
+
+    @staticmethod
+    def _not_found(message: str):
+        return discord.NotFound(SimpleNamespace(status=404, reason='Not Found'), {'code': 10008, 'message': message})
+
+    async def request(self, route, **kwargs):
+        self.calls[route.key] += 1
+        if self.latency:
+            await asyncio.sleep(self.rng.random() * self.latency)
+        parts = route.url.split('/')
+        channel_id = str(route.channel_id) if route.channel_id else None
+        if route.path == '/channels/{channel_id}/messages/{message_id}':
+            if route.method == 'GET':
+                if parts[-1] not in self.messages:
+                    raise self._not_found('Unknown Message')
+                return self.messages[parts[-1]]
+            if route.method == 'PATCH':
+                return self._bot_message(channel_id, parts[-1], kwargs.get('json') or {})
+            return None
+        if route.path == '/channels/{channel_id}/messages' and route.method == 'POST':
+            return self._bot_message(channel_id, str(next(self._ids)), kwargs.get('json') or {})
+        if route.path == '/channels/{channel_id}/messages/{message_id}/reactions/{emoji}' and route.method == 'GET':
+            return []
+        if route.path == '/guilds/{guild_id}/members/{user_id}' and route.method == 'GET':
+            member = self.members.get((str(route.guild_id), parts[-1]))
+            if member is None:
+                raise self._not_found('Unknown Member')
+            return member
+        if route.method in ('PUT', 'DELETE'):
+            return None
+        self.unhandled[route.key] += 1
+        return None
@@ -0,0 +1,156 @@
+# utils/rescore.py
+# Recálculo retroactivo de los envíos cuando cambian las tablas de puntos (scoring_rules.json).
+import time
+from utils import ledger, state
+from utils.export import PENDING_FILES
+from utils.judged import JudgedStore
+from utils.verify import JUDGED_FILES, guilds_to_verify
+
+# --- CONFIGURACIÓN ---
+# Los puntos de KOTH los fija cada evento, no las reglas: no se recalculan.
+RESCORABLE = ('ataque', 'defensa', 'tempo', 'interserver')
+
+def new_report(version: int, dry_run: bool) -> dict:
+    return {
+        'version': version, 'dry_run': dry_run, 'guilds': 0, 'submissions': 0, 'unscorable': 0,
+        'repriced': 0, 'rows': 0, 'delta_points': 0, 'users': {}, 'elapsed': 0.0,
+    }
+
+# --- CÁLCULO ---
+def rescored_points(engine, kind: str, submission: dict, version: int):
+    """
+    Puntos (base, finales) de un envío con las reglas de `version`, usando las entradas que
+    guardó al puntuarse y el multiplicador que tenga aplicado.
+    Devuelve None si el envío es anterior al motor de reglas o queda fuera de la tabla nueva.
+    """
+    inputs = submission.get('rule_inputs')
+    if not inputs:
+        return None
+    rules = engine.rules(submission.get('rules_season'), version)
+    base = rules.base_points(kind, inputs)
+    if base is None:
+        return None
+    emoji = submission.get('multiplier_emoji') if submission.get('multiplier_applied') else None
+    return base, rules.score(kind, inputs, emoji)
+
+def plan_chunk(engine, guild_id: int, kind: str, items, version: int, report: dict) -> list:
+    """
+    Calcula los cambios de un bloque de envíos (message_id, envío) sin tocar nada.
+    Devuelve tuplas (message_id, envío, base, puntos, filas); las filas compensatorias solo existen para
+    los envíos aprobados y llevan la clave `r<n>.<versión>`, donde n numera los recálculos
+    del envío: si el proceso se cae antes de guardar el estado, repetir el mismo recálculo
+    reutiliza las claves y no vuelve a sumar las filas.
+    """
+    changes = []
+    for message_id, submission in items:
+        report['submissions'] += 1
+        result = rescored_points(engine, kind, submission, version)
+        if result is None:
+            report['unscorable'] += 1
+            continue
+        base, points = result
+        old_points = submission.get('points', 0)
+        if points == old_points and submission.get('rules_version') == version:
+            continue
+        rows = []
+        if points != old_points:
+            report['repriced'] += 1
+            if submission.get('status') == 'approved':
+                delta = points - old_points
+                seq = f"r{submission.get('rescore_seq', 0) + 1}.{version}"
+                rows = ledger.submission_rows(guild_id, message_id, submission, delta, kind, seq)
+                report['rows'] += len(rows)
+                report['delta_points'] += delta * len(rows)
+                for row in rows:
+                    user_key = (guild_id, str(row[0]))
+                    report['users'][user_key] = report['users'].get(user_key, 0) + delta
+        changes.append((message_id, submission, base, points, rows))
+    return changes
+
+def apply_changes(documents, changes, version: int) -> list:
+    """
+    Aplica los cambios a los envíos (y los reasigna en `documents`, para que el almacén de
+    juzgados los guarde) y devuelve lo necesario para deshacerlos con `restore_changes`.
+    """
+    undo = []
+    for message_id, submission, base, points, rows in changes:
+        undo.append((submission, {field: submission.get(field) for field in ('points', 'base_points', 'rules_version', 'rescore_seq')}))
+        if rows:
+            submission['rescore_seq'] = submission.get('rescore_seq', 0) + 1
+        submission['points'] = points
+        if 'base_points' in submission:
+            submission['base_points'] = base
+        submission['rules_version'] = version
+        documents[message_id] = submission
+    return undo
+
+def restore_changes(undo):
+    for submission, previous in undo:
+        for field, value in previous.items():
+            if value is None:
+                submission.pop(field, None)
+            else:
+                submission[field] = value
+
+def change_rows(changes) -> list:
+    return [row for change in changes for row in change[4]]
+
+def chunks(documents, size: int):
+    """
+    Bloques de pares (message_id, envío). Solo se copian las claves al empezar; cada envío se
+    lee al llegar a su bloque, así que los que se juzgaron o borraron entre medias se saltan
+    y nunca hay más de un bloque de envíos en memoria.
+    """
+    message_ids = list(documents)
+    for start in range(0, len(message_ids), size):
+        chunk = []
+        for message_id in message_ids[start:start + size]:
+            submission = documents.get(message_id)
+            if submission is not None:
+                chunk.append((message_id, submission))
+        yield chunk
+
+# --- RECÁLCULO SOBRE LOS ARCHIVOS ---
+def rescore_files(engine, guild_ids=None, version: int = None, dry_run: bool = False,
+                  db_file: str = ledger.DB_FILE, chunk_size: int = 1000, progress=None) -> dict:
+    """
+    Recalcula los envíos juzgados y pendientes guardados en disco con las reglas de `version`
+    (la activa por defecto). Cada bloque de `chunk_size` envíos escribe sus filas
+    compensatorias en una sola transacción y guarda sus envíos justo después.
+    Con `dry_run` solo calcula el informe. `progress(guild_id, kind, hechos, total)` se llama
+    tras cada bloque.
+    Trabaja sobre los archivos, así que el bot debe estar apagado (desde el bot se usa /rescore).
+    """
+    start = time.perf_counter()
+    version = version or engine.version
+    report = new_report(version, dry_run)
+    guild_ids = guild_ids or guilds_to_verify()
+    report['guilds'] = len(guild_ids)
+    stores = {kind: (state.GuildState(PENDING_FILES[kind], legacy_file=PENDING_FILES[kind]),
+                     JudgedStore(JUDGED_FILES[kind], legacy_file=JUDGED_FILES[kind])) for kind in RESCORABLE}
+    try:
+        for guild_id in guild_ids:
+            for kind, kind_stores in stores.items():
+                for store in kind_stores:
+                    documents = store.get(guild_id)
+                    total = len(documents)
+                    done = 0
+                    for chunk in chunks(documents, chunk_size):
+                        changes = plan_chunk(engine, guild_id, kind, chunk, version, report)
+                        done += len(chunk)
+                        if changes and not dry_run:
+                            undo = apply_changes(documents, changes, version)
+                            try:
+                                ledger.insert_points(change_rows(changes), db_file)
+                            except Exception:
+                                restore_changes(undo)
+                                raise
+                            store.save(guild_id, durable=True)
+                        if progress:
+                            progress(guild_id, kind, done, total)
+    finally:
+        for _, judged in stores.values():
+            judged.close()
+    report['users'] = {user_key: delta for user_key, delta in report['users'].items() if delta}
+    report['elapsed'] = time.perf_counter() - start
+    return report
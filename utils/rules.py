@@ -0,0 +1,166 @@
+# utils/rules.py
+# Motor de reglas de puntuación: las tablas de puntos y multiplicadores se leen de un JSON versionado.
+import json
+import os
+from utils import state
+
+# --- CONFIGURACIÓN ---
+RULES_FILE = os.getenv("SCORING_RULES_FILE", 'scoring_rules.json')
+# Copia de cada versión cargada, para poder recalcular envíos antiguos con sus reglas.
+RULES_HISTORY_DIR = 'rules'
+
+class RulesError(ValueError):
+    """La configuración de reglas no es válida."""
+
+# --- REGLAS COMPILADAS ---
+class RuleSet:
+    """
+    Una versión de las reglas (con las modificaciones de una temporada ya aplicadas),
+    compilada en diccionarios para que cada consulta sea una sola búsqueda.
+
+    Tipos de tabla:
+      - "matrix": `values[aliados - 1][enemigos]`, como las antiguas ATTACK_POINTS/DEFENSE_POINTS.
+      - "map": `values[clave]`, donde la clave sale del nombre del canal (tempo, interserver).
+    `multipliers` es {tipo: {emoji: factor}}.
+    """
+    def __init__(self, version: int, tables: dict, multipliers: dict, season_number: int = None):
+        self.version = version
+        self.season_number = season_number
+        self.multipliers = {kind: {emoji: float(factor) for emoji, factor in factors.items()}
+                            for kind, factors in multipliers.items()}
+        self._lookup = {}
+        for kind, table in tables.items():
+            if table.get('type') == 'matrix':
+                self._lookup[kind] = {
+                    (allies, enemies): int(points)
+                    for allies, row in enumerate(table['values'], start=1)
+                    for enemies, points in enumerate(row)
+                }
+            elif table.get('type') == 'map':
+                self._lookup[kind] = {str(key): int(points) for key, points in table['values'].items()}
+            else:
+                raise RulesError(f"La tabla '{kind}' tiene un tipo desconocido: {table.get('type')!r}")
+
+    def base_points(self, kind: str, inputs: dict):
+        """
+        Puntos de la tabla para las entradas de un envío ({'allies', 'enemies'} o {'key'}).
+        Devuelve None si el envío queda fuera de la tabla.
+        """
+        table = self._lookup.get(kind)
+        if table is None:
+            return None
+        if 'key' in inputs:
+            return table.get(str(inputs['key']))
+        return table.get((inputs.get('allies'), inputs.get('enemies', 0)))
+
+    def multiplier(self, kind: str, emoji: str):
+        """Factor del emoji de bono para ese tipo de envío, o None si no es un bono."""
+        return self.multipliers.get(kind, {}).get(emoji)
+
+    def score(self, kind: str, inputs: dict, multiplier_emoji: str = None):
+        """Puntos finales de un envío: los de la tabla con el multiplicador aplicado si lo tiene."""
+        points = self.base_points(kind, inputs)
+        if points is None:
+            return None
+        factor = self.multiplier(kind, multiplier_emoji) if multiplier_emoji else None
+        return int(points * factor) if factor else points
+
+# --- MOTOR ---
+def _validate(config: dict):
+    if not isinstance(config.get('version'), int) or config['version'] < 1:
+        raise RulesError("La configuración necesita un entero 'version' mayor que 0.")
+    if not isinstance(config.get('tables'), dict):
+        raise RulesError("La configuración necesita un objeto 'tables'.")
+    for season, override in config.get('seasons', {}).items():
+        if not str(season).isdigit():
+            raise RulesError(f"La temporada '{season}' debe ser un número.")
+    # Compilar todas las variantes detecta tablas mal formadas antes de activarlas.
+    RuleSet(config['version'], config['tables'], config.get('multipliers', {}))
+    for season, override in config.get('seasons', {}).items():
+        RuleSet(config['version'], {**config['tables'], **override.get('tables', {})},
+                {**config.get('multipliers', {}), **override.get('multipliers', {})})
+
+class RulesEngine:
+    """
+    Carga `scoring_rules.json`, guarda una copia de cada versión en data/rules/ y compila
+    bajo demanda las reglas de cada (versión, temporada).
+    Cambiar las reglas exige subir `version`: así cada envío guarda con qué reglas se puntuó
+    y se puede recalcular más tarde con esa misma versión o con otra.
+    """
+    def __init__(self, path: str = RULES_FILE):
+        self.path = path
+        self.config = None
+        self._compiled = {}
+        self.reload()
+
+    @property
+    def version(self) -> int:
+        return self.config['version']
+
+    def _history_path(self, version: int) -> str:
+        return os.path.join(state.DATA_DIR, RULES_HISTORY_DIR, f"v{version}.json")
+
+    def reload(self) -> int:
+        """
+        Vuelve a leer el archivo de reglas. Si no es válido, o cambia el contenido de una
+        versión ya usada, lanza RulesError y las reglas activas no cambian.
+        Devuelve la versión activa.
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise RulesError(f"No se pudo leer {self.path}: {e}") from e
+        _validate(config)
+        previous = state.load_json(self._history_path(config['version']), None)
+        if previous is not None and previous != config:
+            raise RulesError(f"La versión {config['version']} ya existe con otras reglas; sube 'version' al cambiarlas.")
+        if previous is None:
+            state.save_json(self._history_path(config['version']), config, durable=True)
+        self.config = config
+        return self.version
+
+    def _config_for(self, version: int) -> dict:
+        if version == self.version:
+            return self.config
+        config = state.load_json(self._history_path(version), None)
+        if config is None:
+            raise RulesError(f"No se conserva la versión {version} de las reglas.")
+        return config
+
+    def rules(self, season_number: int = None, version: int = None) -> RuleSet:
+        """Reglas compiladas de una versión (la activa por defecto) para una temporada."""
+        version = version or self.version
+        key = (version, season_number)
+        if key not in self._compiled:
+            config = self._config_for(version)
+            override = config.get('seasons', {}).get(str(season_number), {}) if season_number else {}
+            self._compiled[key] = RuleSet(
+                version,
+                {**config['tables'], **override.get('tables', {})},
+                {**config.get('multipliers', {}), **override.get('multipliers', {})},
+                season_number,
+            )
+        return self._compiled[key]
+
+# --- AYUDA PARA LOS COGS ---
+def season_rules(bot, guild_id: int) -> RuleSet:
+    """Reglas activas para un servidor, con las modificaciones de su temporada en curso."""
+    seasons_cog = bot.get_cog('season')
+    season = seasons_cog.seasons.get(guild_id) if seasons_cog else {}
+    return bot.rules.rules(season.get('season_number') if season.get('active') else None)
+
+def record(submission: dict, rules: RuleSet, inputs: dict) -> dict:
+    """Anota en el envío con qué reglas y entradas se puntuó."""
+    submission['rules_version'] = rules.version
+    if rules.season_number:
+        submission['rules_season'] = rules.season_number
+    submission['rule_inputs'] = inputs
+    return submission
+
+def submission_rules(engine: RulesEngine, submission: dict) -> RuleSet:
+    """Reglas con las que se puntuó un envío (las activas si es anterior al motor de reglas)."""
+    try:
+        return engine.rules(submission.get('rules_season'), submission.get('rules_version'))
+    except RulesError:
+        return engine.rules()
@@ -0,0 +1,21 @@
+# utils/shards.py
+# Reparto de servidores entre shards, para que cada proceso cargue solo el estado de los suyos.
+import os
+
+# --- CONFIGURACIÓN ---
+# SHARD_COUNT: número total de shards (0 = que Discord decida y un solo proceso los atienda todos).
+# SHARD_IDS: shards que atiende este proceso, separados por comas (vacío = todos).
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id.strip()]
+
+def shard_for_guild(guild_id: int, shard_count: int = SHARD_COUNT) -> int:
+    """Shard al que Discord asigna un servidor (misma fórmula que usa la gateway)."""
+    if not shard_count:
+        return 0
+    return (int(guild_id) >> 22) % shard_count
+
+def owns_guild(guild_id: int) -> bool:
+    """True si este proceso atiende el servidor indicado."""
+    if not SHARD_COUNT or not SHARD_IDS:
+        return True
+    return shard_for_guild(guild_id) in SHARD_IDS
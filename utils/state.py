@@ -0,0 +1,195 @@
+# utils/state.py
+# Estado en JSON particionado por servidor: cada servidor tiene su propia carpeta data/<guild_id>/.
+import json
+import os
+import time
+import weakref
+from utils.shards import owns_guild
+
+# --- CONFIGURACIÓN ---
+DATA_DIR = 'data'
+# Servidor al que pertenecen los archivos de estado de cuando el bot atendía a uno solo. Por defecto
+# el de pruebas; con TEST_GUILD_ID=0 (comandos globales) hay que indicarlo en LEGACY_GUILD_ID, o el
+# bot lo deduce al conectarse si solo está en un servidor (ver `adopt_legacy_files`).
+LEGACY_GUILD_ID = int(os.getenv("LEGACY_GUILD_ID") or os.getenv("TEST_GUILD_ID", 0))
+# Marca de que los archivos heredados ya se asignaron a un servidor deducido.
+LEGACY_MARKER = 'legacy_adopted.json'
+# Marca que indica si el último proceso se cerró limpiamente.
+SHUTDOWN_MARKER = 'shutdown.json'
+
+# Todos los GuildState creados, para poder volcarlos al cerrar.
+_STORES = weakref.WeakSet()
+
+# --- FUNCIONES DE AYUDA ---
+def load_json(path: str, default):
+    """Carga un JSON, devolviendo `default` si no existe o está corrupto."""
+    try:
+        with open(path, 'r') as f: return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError): return default
+
+def save_json(path: str, data, durable: bool = False):
+    """
+    Guarda datos en un JSON con formato legible, creando la carpeta si hace falta.
+    Se escribe en un archivo temporal que luego reemplaza al original, así que un corte
+    a mitad de escritura nunca deja el JSON truncado. Con `durable` además se hace fsync.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def guild_path(guild_id: int, filename: str) -> str:
+    return os.path.join(DATA_DIR, str(guild_id), filename)
+
+def guild_ids_with(filename: str):
+    """Servidores que tienen el documento `filename` guardado en su carpeta."""
+    if not os.path.isdir(DATA_DIR):
+        return []
+    return [int(name) for name in os.listdir(DATA_DIR)
+            if name.isdigit() and os.path.exists(guild_path(name, filename))]
+
+def partition_path(guild_id: int, filename: str, legacy_file: str = None, legacy_guild_id: int = LEGACY_GUILD_ID) -> str:
+    """Archivo del que se lee el documento de un servidor (el heredado si aún no tiene partición)."""
+    path = guild_path(guild_id, filename)
+    if not os.path.exists(path) and legacy_file and guild_id == legacy_guild_id:
+        return legacy_file
+    return path
+
+# --- ESTADO POR SERVIDOR ---
+class GuildState:
+    """
+    Un documento JSON por servidor (data/<guild_id>/<filename>), cargado una vez y cacheado.
+
+    `legacy_file` es el archivo único que se usaba cuando el bot atendía a un solo servidor;
+    si existe y el servidor `legacy_guild_id` aún no tiene partición, se usa como punto de partida
+    y la siguiente escritura lo migra a su carpeta (el original no se borra).
+    Nada se lee al construirlo: cada partición se carga la primera vez que se pide, y `items()`
+    carga de una vez las de los servidores que atiende este shard.
+    """
+    def __init__(self, filename: str, default=dict, legacy_file: str = None, legacy_guild_id: int = LEGACY_GUILD_ID):
+        self.filename = filename
+        self.default = default
+        self.legacy_file = legacy_file
+        self.legacy_guild_id = legacy_guild_id
+        self._data = {}
+        self._versions = {}
+        self._loaded_all = False
+        _STORES.add(self)
+
+    def _load_owned(self):
+        """Carga las particiones de disco de los servidores de este shard que aún no estén en memoria."""
+        for guild_id in self.guild_ids_on_disk():
+            if owns_guild(guild_id):
+                self.get(guild_id)
+        if self.legacy_file and self.legacy_guild_id and owns_guild(self.legacy_guild_id) and os.path.exists(self.legacy_file):
+            self.get(self.legacy_guild_id)
+        self._loaded_all = True
+
+    def guild_ids_on_disk(self):
+        """Servidores que tienen este documento guardado en su carpeta."""
+        return guild_ids_with(self.filename)
+
+    def get(self, guild_id: int):
+        """Devuelve el documento del servidor (el mismo objeto en cada llamada, para mutarlo en sitio)."""
+        if guild_id not in self._data:
+            path = partition_path(guild_id, self.filename, self.legacy_file, self.legacy_guild_id)
+            self._data[guild_id] = load_json(path, self.default())
+        return self._data[guild_id]
+
+    def adopt_legacy(self, guild_id: int) -> int:
+        """
+        Asigna el archivo heredado a `guild_id`. Si el servidor aún no tiene partición el heredado
+        pasa a ser su documento; si ya la tiene solo se añaden las claves que le falten.
+        Devuelve cuántas claves se incorporaron.
+        """
+        self.legacy_guild_id = guild_id
+        legacy = load_json(self.legacy_file, None) if self.legacy_file else None
+        if not isinstance(legacy, dict) or not legacy:
+            return 0
+        if not os.path.exists(guild_path(guild_id, self.filename)):
+            self._data[guild_id] = legacy
+            self.save(guild_id, durable=True)
+            return len(legacy)
+        document = self.get(guild_id)
+        missing = {key: value for key, value in legacy.items() if key not in document}
+        if missing:
+            document.update(missing)
+            self.save(guild_id, durable=True)
+        return len(missing)
+
+    def reload(self, guild_id: int):
+        """Descarta la copia en memoria y vuelve a leer la partición del disco."""
+        self._data.pop(guild_id, None)
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        return self.get(guild_id)
+
+    def set(self, guild_id: int, data):
+        """Reemplaza el documento del servidor y lo guarda."""
+        self._data[guild_id] = data
+        self.save(guild_id)
+
+    def save(self, guild_id: int, durable: bool = False):
+        """Escribe solo la partición del servidor indicado."""
+        save_json(guild_path(guild_id, self.filename), self.get(guild_id), durable)
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+
+    def version(self, guild_id: int) -> int:
+        """Contador que sube cada vez que se guarda o recarga la partición; sirve para invalidar índices."""
+        return self._versions.get(guild_id, 0)
+
+    def flush(self) -> int:
+        """Escribe con fsync todas las particiones cargadas en memoria. Devuelve cuántas."""
+        guild_ids = list(self._data)
+        for guild_id in guild_ids:
+            self.save(guild_id, durable=True)
+        return len(guild_ids)
+
+    def items(self):
+        """Pares (guild_id, documento) de todos los servidores de este shard."""
+        if not self._loaded_all:
+            self._load_owned()
+        return list(self._data.items())
+
+# --- ARCHIVOS HEREDADOS ---
+def legacy_files() -> list:
+    """Archivos heredados que siguen en disco sin ningún servidor asignado."""
+    if LEGACY_GUILD_ID or os.path.exists(os.path.join(DATA_DIR, LEGACY_MARKER)):
+        return []
+    return sorted({store.legacy_file for store in list(_STORES) if store.legacy_file and os.path.exists(store.legacy_file)})
+
+def adopt_legacy_files(guild_id: int) -> dict:
+    """
+    Asigna los archivos heredados a `guild_id` en todos los almacenes y deja la marca en data/,
+    así que solo ocurre una vez: en el siguiente arranque un envío ya juzgado no vuelve a
+    pendientes. Devuelve {archivo: claves incorporadas}.
+    """
+    global LEGACY_GUILD_ID
+    adopted = {}
+    for store in list(_STORES):
+        if store.legacy_file and os.path.exists(store.legacy_file):
+            adopted[store.legacy_file] = adopted.get(store.legacy_file, 0) + store.adopt_legacy(guild_id)
+    LEGACY_GUILD_ID = guild_id
+    save_json(os.path.join(DATA_DIR, LEGACY_MARKER), {'guild_id': guild_id, 'at': time.time(), 'files': adopted}, durable=True)
+    return adopted
+
+# --- CIERRE LIMPIO ---
+def flush_all() -> int:
+    """Vuelca a disco (con fsync) el estado en memoria de todos los GuildState. Devuelve las particiones escritas."""
+    return sum(store.flush() for store in list(_STORES))
+
+def read_shutdown_marker() -> dict:
+    """Estado del último cierre: {'clean': bool, ...}. Sin marca se asume que no fue limpio."""
+    return load_json(os.path.join(DATA_DIR, SHUTDOWN_MARKER), {'clean': False})
+
+def write_shutdown_marker(clean: bool, **details):
+    """
+    Guarda la marca de cierre. Al arrancar se escribe `clean=False`, y solo el cierre
+    ordenado la cambia a `True` después de volcar todo el estado.
+    """
+    save_json(os.path.join(DATA_DIR, SHUTDOWN_MARKER), {'clean': clean, 'at': time.time(), **details}, durable=True)
@@ -0,0 +1,98 @@
+# utils/tracking.py
+# Índice en memoria de los mensajes que son envíos, para descartar cuanto antes las reacciones ajenas.
+from array import array
+from bisect import bisect_left
+
+# --- CONJUNTO COMPACTO DE IDS ---
+class MessageSet:
+    """
+    Conjunto de IDs de mensaje guardado como un `array` ordenado de enteros de 64 bits
+    (8 bytes por ID, frente a ~100 de una cadena en un dict) más un `set` pequeño con los
+    últimos añadidos, que se funde con el array cuando crece.
+    Solo admite añadir: para el índice basta con que contenga todo lo juzgado.
+    """
+    def __init__(self, message_ids=()):
+        self.ids = array('q', sorted(message_ids))
+        self.recent = set()
+
+    def add(self, message_id: int):
+        self.recent.add(message_id)
+        if len(self.recent) > max(1024, len(self.ids) // 8):
+            self.ids = array('q', sorted(set(self.ids).union(self.recent)))
+            self.recent.clear()
+
+    def __contains__(self, message_id: int) -> bool:
+        if message_id in self.recent:
+            return True
+        position = bisect_left(self.ids, message_id)
+        return position < len(self.ids) and self.ids[position] == message_id
+
+    def __len__(self):
+        return len(self.ids) + len(self.recent)
+
+# --- ÍNDICE DE MENSAJES SEGUIDOS ---
+class TrackedMessages:
+    """
+    Sabe qué mensajes de cada servidor son envíos: los pendientes en un dict exacto
+    ID -> tipo y los juzgados (todos los tipos juntos) en un MessageSet.
+
+    `sources_callable()` devuelve {tipo: (GuildState de pendientes, GuildState de juzgados)}
+    de los cogs cargados. No hace falta avisar al índice de cada cambio: se compara el
+    contador `version()` de los pendientes, que sube en cada guardado, y los envíos que
+    salen de pendientes se añaden a los juzgados. El historial completo solo se recorre al
+    crear el índice del servidor o cuando se recarga algún documento de juzgados.
+    """
+    def __init__(self, sources_callable):
+        self.sources_callable = sources_callable
+        self._pending = {}
+        self._pending_versions = {}
+        self._judged = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _judged_set(self, guild_id: int, sources: dict) -> MessageSet:
+        documents = tuple(judged.get(guild_id) for _, judged in sources.values())
+        entry = self._judged.get(guild_id)
+        # Si algún documento es otro objeto (se recargó), se reconstruye desde cero.
+        if entry is None or len(entry[0]) != len(documents) or any(a is not b for a, b in zip(entry[0], documents)):
+            entry = (documents, MessageSet(int(message_id) for document in documents for message_id in document))
+            self._judged[guild_id] = entry
+        return entry[1]
+
+    def _refresh_pending(self, guild_id: int, sources: dict):
+        versions = tuple(pending.version(guild_id) for pending, _ in sources.values())
+        if self._pending_versions.get(guild_id) == versions:
+            return
+        current = {int(message_id): kind for kind, (pending, _) in sources.items() for message_id in pending.get(guild_id)}
+        # Lo que ya no está pendiente se ha juzgado (o borrado): pasa al conjunto de juzgados.
+        judged = self._judged_set(guild_id, sources)
+        for message_id in self._pending.get(guild_id, {}):
+            if message_id not in current:
+                judged.add(message_id)
+        self._pending[guild_id] = current
+        self._pending_versions[guild_id] = versions
+
+    def lookup(self, guild_id: int, message_id: int):
+        """
+        Tipos de envío a los que pertenece el mensaje (normalmente uno), o una lista vacía
+        si no es un envío. Un mensaje que no es un envío se descarta con una consulta al dict
+        de pendientes y una búsqueda binaria, sin tocar los documentos.
+        """
+        sources = self.sources_callable()
+        self._refresh_pending(guild_id, sources)
+        kind = self._pending[guild_id].get(message_id)
+        if kind is not None:
+            self.hits += 1
+            return [kind]
+        if message_id not in self._judged_set(guild_id, sources):
+            self.misses += 1
+            return []
+        self.hits += 1
+        key = str(message_id)
+        return [kind for kind, (_, judged) in sources.items() if key in judged.get(guild_id)]
+
+    def forget(self, guild_id: int):
+        """Descarta el índice de un servidor (por ejemplo, al salir de él)."""
+        self._pending.pop(guild_id, None)
+        self._pending_versions.pop(guild_id, None)
+        self._judged.pop(guild_id, None)
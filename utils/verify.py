@@ -0,0 +1,163 @@
+# utils/verify.py
+# Verificador de consistencia entre los envíos juzgados y el libro de puntos (SQLite).
+import itertools
+import time
+from datetime import datetime, timezone
+from utils import ledger
+from utils.judged import JudgedStore
+from utils.shards import owns_guild
+
+# --- CONFIGURACIÓN ---
+# Categoría del libro -> documento con los envíos juzgados de esa categoría.
+JUDGED_FILES = {
+    'ataque': 'judged_attacks.json',
+    'defensa': 'judged_defenses.json',
+    'tempo': 'judged_tempo.json',
+    'interserver': 'judged_interserver.json',
+    'koth': 'judged_koth.json',
+}
+
+ROWS_FOR_SUBMISSION_SQL = '''
+    SELECT source_key, points, timestamp FROM puntuaciones WHERE source_key >= ? AND source_key < ?
+    UNION ALL
+    SELECT source_key, points, timestamp FROM puntuaciones_archive WHERE source_key >= ? AND source_key < ?
+'''
+# Segundos durante los que una transición escrita en el libro pero no guardada en el estado
+# se considera en curso; pasado ese tiempo es un resto de una caída y cuenta como diferencia.
+IN_FLIGHT_GRACE = 600
+FOLDED_KEYS_SQL = "SELECT source_key FROM puntuaciones_keys WHERE source_key >= ? AND source_key < ?"
+
+# --- FUNCIONES DE AYUDA ---
+def _key_range(category: str, message_id) -> tuple:
+    """Rango [desde, hasta) que cubre todas las claves de un envío (';' es el carácter siguiente a ':')."""
+    return f"{category}:{message_id}:", f"{category}:{message_id};"
+
+def _chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+def expected_points(submission: dict) -> int:
+    """Puntos que debería tener cada mención de un envío según su estado."""
+    return int(submission.get('points', 0)) if submission.get('status') == 'approved' else 0
+
+def judged_stores() -> dict:
+    """
+    Un JudgedStore propio por categoría, para leer los juzgados fuera de los cogs (desde un
+    hilo o sin el bot). Hay que cerrarlos con `close()` al terminar.
+    """
+    return {category: JudgedStore(filename, legacy_file=filename) for category, filename in JUDGED_FILES.items()}
+
+def guilds_to_verify():
+    """Servidores de este shard con algún envío juzgado guardado (incluido el de los archivos heredados)."""
+    guild_ids = set()
+    for store in judged_stores().values():
+        guild_ids.update(store.guild_ids())
+        store.close()
+    return sorted(guild_id for guild_id in guild_ids if owns_guild(guild_id))
+
+def _check_submission(con, category: str, message_id: str, submission: dict, in_flight_since: str):
+    """
+    Compara un envío con sus filas del libro.
+    Devuelve ('ok' | 'in_flight' | 'unverifiable' | 'drift', diferencias), donde las diferencias
+    son tuplas (posición, user_id, esperado, registrado) solo para las menciones que no cuadran.
+    """
+    low, high = _key_range(category, message_id)
+    recorded = {}
+    found_keys = set()
+    in_flight = False
+    for source_key, points, timestamp in con.execute(ROWS_FOR_SUBMISSION_SQL, (low, high, low, high)):
+        found_keys.add(source_key)
+        _, _, seq, position, user_id = source_key.split(':')
+        recorded[(int(position), user_id)] = recorded.get((int(position), user_id), 0) + points
+        if seq.isdigit() and int(seq) > submission.get('seq', 0) and str(timestamp) >= in_flight_since:
+            in_flight = True
+
+    # Hay filas recientes de una transición que el estado aún no guardó: el envío se está juzgando ahora mismo.
+    if in_flight:
+        return 'in_flight', []
+    # Filas plegadas sin copia de auditoría o movidas al archivo de una temporada: no se pueden sumar.
+    if any(key not in found_keys for (key,) in con.execute(FOLDED_KEYS_SQL, (low, high))):
+        return 'unverifiable', []
+    # Envíos juzgados antes de que el libro tuviera claves de origen: sus puntos están en filas sin clave.
+    if not submission.get('seq') and not found_keys and expected_points(submission):
+        return 'unverifiable', []
+
+    expected = expected_points(submission)
+    differences = []
+    for position, user_id in enumerate(submission.get('allies', [])):
+        actual = recorded.pop((position, str(user_id)), 0)
+        if actual != expected:
+            differences.append((position, str(user_id), expected, actual))
+    # Filas de menciones que ya no están en el envío.
+    for (position, user_id), actual in recorded.items():
+        if actual:
+            differences.append((position, user_id, 0, actual))
+    return ('drift' if differences else 'ok'), differences
+
+# --- VERIFICACIÓN ---
+def verify_ledger(guild_ids=None, repair: bool = False, db_file: str = ledger.DB_FILE,
+                  chunk_size: int = 500, max_details: int = 50, pause: float = 0.0) -> dict:
+    """
+    Recalcula los puntos esperados de todos los envíos juzgados y los compara, mención
+    a mención, con las filas del libro que llevan la clave de cada envío.
+
+    Recorre los envíos por lotes de `chunk_size` y solo guarda las diferencias acumuladas
+    por usuario y los primeros `max_details` envíos con diferencias, así que la memoria
+    no crece con el historial.
+    Con `repair` escribe una fila compensatoria con clave propia por cada mención que no
+    cuadra; repetir la reparación sobre el mismo estado no vuelve a escribirla.
+    Es síncrona y bloqueante: desde el bot debe llamarse con `asyncio.to_thread`.
+    """
+    start = time.perf_counter()
+    in_flight_since = datetime.fromtimestamp(time.time() - IN_FLIGHT_GRACE, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    if guild_ids is None:
+        guild_ids = guilds_to_verify()
+    report = {
+        'guilds': len(guild_ids), 'submissions': 0, 'in_flight': 0, 'unverifiable': 0,
+        'drifted_submissions': 0, 'drift_points': 0, 'repaired_rows': 0,
+        'users': {}, 'details': [], 'repaired_guilds': set(),
+    }
+    con = ledger.connect(db_file)
+    stores = judged_stores()
+    try:
+        for guild_id in guild_ids:
+            for category, store in stores.items():
+                # items() lee el almacén por páginas: ni los envíos ni la caché crecen con el historial.
+                for chunk in _chunks(store.get(guild_id).items(), chunk_size):
+                    repairs = []
+                    for message_id, submission in chunk:
+                        report['submissions'] += 1
+                        status, differences = _check_submission(con, category, message_id, submission, in_flight_since)
+                        if status in ('in_flight', 'unverifiable'):
+                            report[status] += 1
+                        if not differences:
+                            continue
+                        report['drifted_submissions'] += 1
+                        if len(report['details']) < max_details:
+                            report['details'].append((guild_id, category, message_id, differences))
+                        for position, user_id, expected, actual in differences:
+                            user_key = (guild_id, user_id)
+                            report['users'][user_key] = report['users'].get(user_key, 0) + expected - actual
+                            report['drift_points'] += abs(expected - actual)
+                            # La clave incluye lo registrado al reparar: con el mismo estado la
+                            # compensación es la misma fila y se ignora si ya existe.
+                            seq = f"v{submission.get('seq', 0)}.{actual}"
+                            repairs.append((
+                                int(user_id), guild_id, category, expected - actual, datetime.now(timezone.utc),
+                                ledger.submission_source_key(category, message_id, seq, position, user_id)
+                            ))
+                    if repair and repairs:
+                        inserted = ledger.insert_points(repairs, db_file)
+                        report['repaired_rows'] += inserted
+                        if inserted:
+                            report['repaired_guilds'].add(guild_id)
+                    if pause:
+                        time.sleep(pause)
+    finally:
+        con.close()
+        for store in stores.values():
+            store.close()
+    report['users'] = {user_key: delta for user_key, delta in report['users'].items() if delta}
+    report['elapsed'] = time.perf_counter() - start
+    return report